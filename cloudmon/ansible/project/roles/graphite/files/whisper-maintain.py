@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Prune stale whisper files and resize them to the current schema
+
+Executed inside of the graphite container (where the whisper module and
+whisper-resize.py are available). Summary is written as JSON.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import configparser
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+WHISPER_HEADER_SIZE = 16
+WHISPER_ARCHIVE_INFO_SIZE = 12
+WHISPER_POINT_SIZE = 12
+UNITS = dict(s=1, m=60, h=3600, d=86400, w=604800, y=31536000)
+
+
+def parse_duration(value):
+    value = value.strip()
+    unit_start = len(value.rstrip("abcdefghijklmnopqrstuvwxyz"))
+    number, unit = value[:unit_start], value[unit_start:]
+    return int(number) * (UNITS[unit[0]] if unit else 1)
+
+
+def parse_retentions(retentions):
+    """Parse retentions into list of (seconds per point, points)"""
+    res = []
+    for archive in retentions.split(","):
+        precision, retention = archive.split(":")
+        precision = parse_duration(precision)
+        if retention.strip().isdigit():
+            points = int(retention)
+        else:
+            points = parse_duration(retention) // precision
+        res.append((precision, points))
+    return res
+
+
+def file_size(archives):
+    return (
+        WHISPER_HEADER_SIZE
+        + WHISPER_ARCHIVE_INFO_SIZE * len(archives)
+        + WHISPER_POINT_SIZE * sum(points for _, points in archives)
+    )
+
+
+def load_schemas(path):
+    """Load storage-schemas.conf as list of (regex, archives)"""
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(path)
+    res = []
+    for section in parser.sections():
+        pattern = parser.get(section, "pattern", fallback=None)
+        retentions = parser.get(section, "retentions", fallback=None)
+        if pattern is None or retentions is None:
+            continue
+        res.append((re.compile(pattern), parse_retentions(retentions)))
+    return res
+
+
+def match_schema(schemas, metric):
+    for pattern, archives in schemas:
+        if pattern.search(metric):
+            return archives
+    return None
+
+
+class Throttle:
+    """Limit amount of bytes processed per second by all workers"""
+
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def acquire(self, size):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_slot)
+            self.next_slot = start + size / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+def read_archives(path):
+    import whisper
+
+    info = whisper.info(path)
+    return [(x["secondsPerPoint"], x["points"]) for x in info["archives"]]
+
+
+class Maintainer:
+    def __init__(self, args, schemas):
+        self.args = args
+        self.schemas = schemas
+        self.throttle = Throttle(args.io_limit * 1024 * 1024)
+        self.stale_before = time.time() - args.stale_days * 86400
+        self.lock = threading.Lock()
+        self.summary = dict(
+            files=0,
+            stale=0,
+            stale_bytes=0,
+            resized=0,
+            resized_bytes=0,
+            dry_run=args.dry_run,
+            action=args.stale_action,
+            errors=[],
+        )
+
+    def _count(self, **kwargs):
+        with self.lock:
+            for key, value in kwargs.items():
+                self.summary[key] += value
+
+    def iter_files(self):
+        for root, dirs, files in os.walk(self.args.data_dir):
+            for name in files:
+                if name.endswith(".wsp"):
+                    yield os.path.join(root, name)
+
+    def process(self, path):
+        try:
+            self._process(path)
+        except Exception as ex:
+            with self.lock:
+                self.summary["errors"].append("%s: %s" % (path, ex))
+
+    def _process(self, path):
+        stat = os.stat(path)
+        self._count(files=1)
+        relpath = os.path.relpath(path, self.args.data_dir)
+        if stat.st_mtime < self.stale_before:
+            self._count(stale=1, stale_bytes=stat.st_size)
+            if self.args.dry_run:
+                return
+            if self.args.stale_action == "archive":
+                target = os.path.join(self.args.archive_dir, relpath)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                self.throttle.acquire(stat.st_size)
+                shutil.move(path, target)
+            else:
+                os.unlink(path)
+            return
+        if not self.args.resize:
+            return
+        metric = relpath[:-4].replace(os.sep, ".")
+        archives = match_schema(self.schemas, metric)
+        if not archives:
+            return
+        self.throttle.acquire(WHISPER_HEADER_SIZE)
+        if read_archives(path) == archives:
+            return
+        self._count(
+            resized=1, resized_bytes=stat.st_size - file_size(archives)
+        )
+        if self.args.dry_run:
+            return
+        # Resizing reads and writes the whole file
+        self.throttle.acquire(stat.st_size + file_size(archives))
+        subprocess.run(
+            [self.args.resize_command, path, "--nobackup"]
+            + ["%d:%d" % x for x in archives],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+
+    def run(self):
+        # Limit amount of queued files to keep memory bounded
+        slots = threading.BoundedSemaphore(self.args.workers * 4)
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            for path in self.iter_files():
+                slots.acquire()
+                future = executor.submit(self.process, path)
+                future.add_done_callback(lambda _: slots.release())
+        if not self.args.dry_run:
+            # Drop directories left empty by pruning
+            for root, dirs, files in os.walk(
+                self.args.data_dir, topdown=False
+            ):
+                if root != self.args.data_dir and not os.listdir(root):
+                    os.rmdir(root)
+        return self.summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data-dir", default="/opt/graphite/storage/whisper")
+    parser.add_argument(
+        "--schemas", default="/opt/graphite/conf/storage-schemas.conf"
+    )
+    parser.add_argument("--stale-days", type=int, default=90)
+    parser.add_argument(
+        "--stale-action", choices=["archive", "delete"], default="archive"
+    )
+    parser.add_argument(
+        "--archive-dir", default="/opt/graphite/storage/archive"
+    )
+    parser.add_argument("--resize", action="store_true")
+    parser.add_argument(
+        "--resize-command", default="/opt/graphite/bin/whisper-resize.py"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--io-limit", type=float, default=0, help="MB/s, 0 - no limit"
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    summary = Maintainer(args, load_schemas(args.schemas)).run()
+    with open(args.output, "w") as f:
+        json.dump(summary, f)
+
+
+if __name__ == "__main__":
+    main()
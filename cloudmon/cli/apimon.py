@@ -14,8 +14,10 @@
 import logging
 
 from cliff.command import Command
+from cliff.lister import Lister
 
 from cloudmon.plugin.apimon import ApiMonManager
+from cloudmon.plugin import apimon_stats
 
 
 class ApiMonProvision(Command):
@@ -56,3 +58,54 @@ class ApiMonStart(Command):
         self.log.info("Starting ApiMon")
         manager = ApiMonManager(self.app.config)
         manager.start(parsed_args)
+
+
+class ApiMonStats(Lister):
+    "Show heaviest ApiMon tasks based on historical durations"
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=apimon_stats.DEFAULT_STATS_DAYS,
+            help="Amount of days of history to consider",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=20,
+            help="Amount of tasks to show",
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        manager = ApiMonManager(self.app.config)
+        columns = (
+            "Zone",
+            "Environment",
+            "Task",
+            "Runs",
+            "p50",
+            "p95",
+            "Weight",
+        )
+        data = []
+        for zone, apimon_config in manager.apimon_configs.items():
+            stats = manager.load_task_stats(apimon_config, parsed_args.days)
+            for env, tasks in stats.items():
+                for task, item in tasks.items():
+                    data.append(
+                        (
+                            zone,
+                            env,
+                            task,
+                            item.runs,
+                            item.p50,
+                            item.p95,
+                            item.weight,
+                        )
+                    )
+        data.sort(key=lambda x: x[-1], reverse=True)
+        return (columns, data[:parsed_args.limit])
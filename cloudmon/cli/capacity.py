@@ -0,0 +1,50 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from cliff.lister import Lister
+
+from cloudmon.service.capacity import CapacityPlanner
+
+
+class Capacity(Lister):
+    "Estimate metrics and database load of the configured matrix"
+    log = logging.getLogger(__name__)
+
+    def take_action(self, parsed_args):
+        planner = CapacityPlanner(self.app.config)
+        columns = (
+            "Host",
+            "Role",
+            "Series",
+            "Datapoints/s",
+            "Rows/day",
+            "Disk (GB)",
+            "Budget (GB)",
+            "Over budget",
+        )
+        data = [
+            (
+                item.host,
+                item.role,
+                int(item.series),
+                round(item.datapoints, 1),
+                item.rows_per_day,
+                round(item.disk_gb, 2),
+                item.disk_budget_gb,
+                item.over_budget,
+            )
+            for item in planner.estimate()
+        ]
+        return (columns, data)
@@ -16,10 +16,11 @@ import logging
 from cliff.command import Command
 
 from cloudmon.cli import apimon
+from cloudmon.cli import cache
 from cloudmon.cli import epmon
-from cloudmon.cli import graphite
 from cloudmon.cli import postgres
 from cloudmon.cli import statsd
+from cloudmon.cli import tsdb
 
 
 class Provision(Command):
@@ -27,14 +28,18 @@ class Provision(Command):
     log = logging.getLogger(__name__)
 
     def take_action(self, parsed_args):
-        graphite_cmd = graphite.GraphiteProvision(self.app, self.app_args)
+        cache_cmd = cache.MemcachedProvision(self.app, self.app_args)
+        tsdb_cmd = tsdb.TsdbProvision(self.app, self.app_args)
         statsd_cmd = statsd.StatsdProvision(self.app, self.app_args)
         pg_cmd = postgres.PostgreSQLProvision(self.app, self.app_args)
+        pgbouncer_cmd = postgres.PgBouncerProvision(self.app, self.app_args)
         epmon_cmd = epmon.EpmonProvision(self.app, self.app_args)
         apimon_cmd = apimon.ApiMonProvision(self.app, self.app_args)
 
-        graphite_cmd.take_action(parsed_args)
+        cache_cmd.take_action(parsed_args)
+        tsdb_cmd.take_action(parsed_args)
         statsd_cmd.take_action(parsed_args)
         pg_cmd.take_action(parsed_args)
+        pgbouncer_cmd.take_action(parsed_args)
         epmon_cmd.take_action(parsed_args)
         apimon_cmd.take_action(parsed_args)
@@ -14,8 +14,11 @@
 import logging
 
 from cliff.command import Command
+from cliff.lister import Lister
 
 from cloudmon.service.grafana import GrafanaManager
+from cloudmon.service.querylint import MetricIndex
+from cloudmon.service.querylint import QueryLinter
 
 
 class GrafanaProvision(Command):
@@ -46,5 +49,43 @@ class GrafanaConfigure(Command):
             api_url=grafana_config.api_url,
             api_token=grafana_config.api_token,
         )
-        manager.provision_ds(parsed_args)
-        manager.provision_dashboards(parsed_args)
+        if grafana_config.provisioning_mode == "file":
+            manager.provision_files(parsed_args)
+        else:
+            manager.provision_ds(parsed_args)
+            manager.provision_dashboards(parsed_args)
+
+
+class GrafanaLint(Lister):
+    "Estimate series matched by the dashboard queries"
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "--index",
+            help=(
+                "Metric index: whisper directory, index.json file or URL "
+                "(grafana.lint.index by default)"
+            ),
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        grafana_config = self.app.config.model.grafana
+        index = parsed_args.index or grafana_config.lint.index
+        if not index:
+            raise RuntimeError("Metric index is not configured")
+        manager = GrafanaManager(
+            cloudmon_config=self.app.config,
+            api_url=grafana_config.api_url,
+            api_token=grafana_config.api_token,
+        )
+        bodies = manager.compile_dashboards(manager.prepare_dashboards())
+        linter = QueryLinter(self.app.config, MetricIndex.load(index))
+        columns = ("Dashboard", "Panel", "Target", "Series", "Status")
+        data = [
+            (x.dashboard, x.panel, x.target, x.series, x.status)
+            for x in linter.lint(bodies)
+        ]
+        return (columns, data)
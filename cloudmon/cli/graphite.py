@@ -14,6 +14,7 @@
 import logging
 
 from cliff.command import Command
+from cliff.lister import Lister
 
 from cloudmon.service.tsdb import GraphiteManager
 
@@ -26,3 +27,44 @@ class GraphiteProvision(Command):
         self.log.info("Provisioning Graphite")
         manager = GraphiteManager(self.app.config)
         manager.provision(parsed_args)
+
+
+class GraphiteMaintain(Lister):
+    "Prune stale series and resize whisper files on Graphite hosts"
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report space which would be reclaimed",
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        manager = GraphiteManager(self.app.config)
+        results = manager.maintain(dry_run=parsed_args.dry_run)
+        columns = (
+            "Host",
+            "Files",
+            "Stale",
+            "Resized",
+            "Reclaimed (MB)",
+            "Errors",
+        )
+        data = [
+            (
+                item.host,
+                item.files,
+                item.stale,
+                item.resized,
+                round(item.reclaimed_bytes / 1024 / 1024, 1),
+                len(item.errors),
+            )
+            for item in results
+        ]
+        for item in results:
+            for error in item.errors:
+                self.log.error("%s: %s", item.host, error)
+        return (columns, data)
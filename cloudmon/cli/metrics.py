@@ -11,11 +11,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
 import logging
+import time
 
 from cliff.command import Command
+from cliff.lister import Lister
 
+from cloudmon.service.capacity import parse_duration
+from cloudmon.service.cardinality import CardinalityManager
 from cloudmon.service.metrics import MetricsProcessorManager
+from cloudmon.service import rollout
+from cloudmon.service import sla
+from cloudmon.service import whisperreader
 
 
 class MetricsProcessorProvision(Command):
@@ -26,3 +34,345 @@ class MetricsProcessorProvision(Command):
         self.log.info("Provisioning Metrics Processor")
         manager = MetricsProcessorManager(self.app.config)
         manager.provision(parsed_args)
+
+
+class MetricsCardinality(Lister):
+    "Report amount of Graphite series and disk usage per name prefix"
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "source",
+            nargs="*",
+            help=(
+                "Whisper directory, whisper listing, carbonapi index.json "
+                "file or URL. Listings of all graphite hosts are fetched "
+                "when not given"
+            ),
+        )
+        parser.add_argument(
+            "--depth",
+            type=int,
+            default=4,
+            help="Amount of name components to report (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--max-children",
+            type=int,
+            default=1000,
+            help=(
+                "Amount of distinct children per prefix, further children "
+                "are accounted as <other> (default: %(default)s)"
+            ),
+        )
+        parser.add_argument(
+            "--min-series",
+            type=int,
+            default=0,
+            help="Hide prefixes with less series",
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        manager = CardinalityManager(self.app.config)
+        sources = parsed_args.source or manager.fetch_listings(
+            "_whisper_listing"
+        )
+        trie = manager.analyze(
+            sources,
+            max_depth=parsed_args.depth,
+            max_children=parsed_args.max_children,
+        )
+        columns = ("Prefix", "Level", "Series", "Size (MB)")
+        data = [
+            (prefix, level, series, round(size / 1024 / 1024, 2))
+            for prefix, level, series, size in trie.iter_prefixes()
+            if series >= parsed_args.min_series
+        ]
+        return (columns, data)
+
+
+class MetricsRead(Command):
+    "Read series from local whisper files as CSV or Parquet"
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "pattern",
+            help="Metric glob (i.e. stats.timers.epmon.*.zone1.**)",
+        )
+        parser.add_argument(
+            "--data-dir",
+            default=".",
+            help="Whisper directory (default: current directory)",
+        )
+        parser.add_argument(
+            "--from",
+            dest="from_time",
+            default="-1d",
+            help=(
+                "Start of the range: epoch, ISO date/time or relative "
+                "(i.e. -30d) (default: %(default)s)"
+            ),
+        )
+        parser.add_argument(
+            "--until",
+            default="now",
+            help="End of the range (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "parquet"],
+            default="csv",
+            help="Output format (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--output",
+            help="Output file (stdout by default, required for parquet)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Amount of series read concurrently",
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        if parsed_args.format == "parquet" and not parsed_args.output:
+            raise RuntimeError("Parquet output requires --output")
+        now = int(time.time())
+        reader = whisperreader.WhisperReader(
+            parsed_args.data_dir, parsed_args.workers
+        )
+        series = reader.read(
+            parsed_args.pattern,
+            whisperreader.parse_time(parsed_args.from_time, now),
+            whisperreader.parse_time(parsed_args.until, now),
+            now,
+        )
+        self.log.info("Read %d series", len(series))
+        if parsed_args.format == "parquet":
+            whisperreader.write_parquet(series, parsed_args.output)
+        elif parsed_args.output:
+            with open(parsed_args.output, "w") as f:
+                whisperreader.write_csv(series, f)
+        else:
+            whisperreader.write_csv(series, self.app.stdout)
+
+
+class MetricsSla(Lister):
+    "Compute availability and latency of the Metrics Processor environments"
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "--instance",
+            help="Metrics processor instance name (default: first one)",
+        )
+        parser.add_argument(
+            "--source",
+            help=(
+                "Graphite URL or local whisper directory (default: "
+                "datasource_url of the instance)"
+            ),
+        )
+        parser.add_argument(
+            "--from",
+            dest="from_time",
+            default="-30d",
+            help=(
+                "Start of the range: epoch, ISO date/time or relative "
+                "(i.e. -30d) (default: %(default)s)"
+            ),
+        )
+        parser.add_argument(
+            "--until",
+            default="now",
+            help="End of the range (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--window",
+            default="1d",
+            help="Length of the reported windows (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--step",
+            help="Resolution of the series (default: StatsD flush interval)",
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        instance = sla.get_metrics_processor(
+            self.app.config, parsed_args.instance
+        )
+        now = int(time.time())
+        calculator = sla.SlaCalculator(
+            self.app.config,
+            instance,
+            sla.get_source(
+                parsed_args.source
+                or sla.get_datasource_url(self.app.config, instance)
+            ),
+            parse_duration(parsed_args.step) if parsed_args.step else None,
+        )
+        results = calculator.compute(
+            whisperreader.parse_time(parsed_args.from_time, now),
+            whisperreader.parse_time(parsed_args.until, now),
+            parse_duration(parsed_args.window),
+        )
+        columns = (
+            "Environment",
+            "Service",
+            "Window",
+            "Availability (%)",
+            "Success rate (%)",
+            "Requests",
+        ) + tuple(f"p{x:g} (ms)" for x in instance.sla.percentiles)
+        data = []
+        for item in results:
+            data.append(
+                (
+                    item.environment,
+                    item.service,
+                    _format_time(item.start),
+                    _percent(item.availability),
+                    _percent(item.success_rate),
+                    item.requests,
+                )
+                + tuple(
+                    None if x is None else round(x, 1)
+                    for x in item.latency.values()
+                )
+            )
+        return (columns, data)
+
+
+class MetricsRollouts(Lister):
+    "List image rollouts recorded by provisioning"
+    log = logging.getLogger(__name__)
+
+    def take_action(self, parsed_args):
+        columns = (
+            "#",
+            "Time",
+            "Component",
+            "Zone",
+            "Image",
+            "Digest",
+            "Previous",
+        )
+        data = [
+            (
+                index,
+                _format_time(item.timestamp),
+                item.component,
+                item.zone,
+                item.image,
+                item.digest,
+                item.previous,
+            )
+            for index, item in enumerate(
+                rollout.get_journal(self.app.config).load()
+            )
+        ]
+        return (columns, data)
+
+
+class MetricsRegression(Lister):
+    "Compare latency and error rate of the series before and after rollout"
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "--rollout",
+            type=int,
+            help="Journal entry (see metrics rollouts, default: last one)",
+        )
+        parser.add_argument(
+            "--component",
+            help="Use the last rollout of the component",
+        )
+        parser.add_argument(
+            "--zone",
+            help="Use the last rollout in the monitoring zone",
+        )
+        parser.add_argument(
+            "--source",
+            help=(
+                "Graphite URL or local whisper directory (default: "
+                "datasource_url of the first metrics processor instance)"
+            ),
+        )
+        parser.add_argument(
+            "--before",
+            help="Window before the rollout (default: rollouts.before)",
+        )
+        parser.add_argument(
+            "--after",
+            help="Window after the rollout (default: rollouts.after)",
+        )
+        parser.add_argument(
+            "--regressed",
+            action="store_true",
+            help="Only list regressed series",
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        journal = rollout.get_journal(self.app.config)
+        if parsed_args.rollout is not None:
+            rollouts = journal.load()[parsed_args.rollout:][:1]
+        else:
+            rollouts = journal.find(parsed_args.component, parsed_args.zone)
+        if not rollouts:
+            raise RuntimeError("No matching rollouts recorded")
+        item = rollouts[-1]
+        self.log.info("Comparing series around %s", item)
+        source = parsed_args.source
+        if not source:
+            source = sla.get_datasource_url(
+                self.app.config, sla.get_metrics_processor(self.app.config)
+            )
+        detector = rollout.RegressionDetector(
+            self.app.config, sla.get_source(source)
+        )
+        results = detector.compare(
+            item,
+            parse_duration(parsed_args.before) if parsed_args.before else None,
+            parse_duration(parsed_args.after) if parsed_args.after else None,
+        )
+        columns = (
+            "Series",
+            "Metric",
+            "Before",
+            "After",
+            "p-value",
+            "Regressed",
+        )
+        data = [
+            (
+                x.name,
+                x.metric,
+                round(x.before, 4),
+                round(x.after, 4),
+                round(x.p, 6),
+                x.regressed,
+            )
+            for x in sorted(results, key=lambda x: (not x.regressed, x.p))
+            if x.regressed or not parsed_args.regressed
+        ]
+        return (columns, data)
+
+
+def _format_time(timestamp):
+    return datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc
+    ).isoformat()
+
+
+def _percent(value):
+    return None if value is None else round(100 * value, 3)
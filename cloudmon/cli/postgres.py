@@ -14,7 +14,10 @@
 import logging
 
 from cliff.command import Command
+from cliff.lister import Lister
 
+from cloudmon.service.pgbouncer import PgBouncerManager
+from cloudmon.service.sqlbackup import PostgreSQLBackupManager
 from cloudmon.service.sqldb import PostgreSQLManager
 
 
@@ -48,6 +51,16 @@ class PostgreSQLProvisionDB(Command):
         manager.provision_db(parsed_args)
 
 
+class PostgreSQLManageSchema(Command):
+    "Manage partitioning, indexes and rollups of PostgreSQL Databases"
+    log = logging.getLogger(__name__)
+
+    def take_action(self, parsed_args):
+        self.log.info("Managing PostgreSQL databases schema")
+        manager = PostgreSQLManager(self.app.config)
+        manager.manage_schema(parsed_args)
+
+
 class PostgreSQLStop(Command):
     "Stop PostgreSQL Database"
     log = logging.getLogger(__name__)
@@ -66,3 +79,96 @@ class PostgreSQLStart(Command):
         self.log.info("Provisioning PostgreSQL database")
         manager = PostgreSQLManager(self.app.config)
         manager.start(parsed_args)
+
+
+class _PostgreSQLBackupLister(Lister):
+    columns = (
+        "Database",
+        "Operation",
+        "Jobs",
+        "Size (MB)",
+        "Duration (s)",
+        "Status",
+    )
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "--database",
+            action="append",
+            help="Database to process (may be repeated, all by default)",
+        )
+        return parser
+
+    def run(self, parsed_args):
+        self.failed = []
+        res = super().run(parsed_args)
+        # Table is printed first, failure makes the command exit non-zero
+        if self.failed:
+            raise RuntimeError(
+                "Failed databases: %s" % ", ".join(self.failed)
+            )
+        return res
+
+    def _report(self, results):
+        data = [
+            (
+                item.database,
+                item.operation,
+                item.jobs,
+                round(item.size / 1024 / 1024, 1),
+                round(item.duration, 1),
+                item.status,
+            )
+            for item in results
+        ]
+        self.failed = [x.database for x in results if x.error]
+        return (self.columns, data)
+
+
+class PostgreSQLBackup(_PostgreSQLBackupLister):
+    "Backup PostgreSQL Databases with parallel pg_dump"
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "--target",
+            help="Target directory (database.backup.target_dir by default)",
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        manager = PostgreSQLBackupManager(self.app.config)
+        return self._report(
+            manager.backup(parsed_args.target, parsed_args.database)
+        )
+
+
+class PostgreSQLRestore(_PostgreSQLBackupLister):
+    "Restore PostgreSQL Databases with parallel pg_restore"
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "source",
+            help="Backup directory (<target>/<timestamp>)",
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        manager = PostgreSQLBackupManager(self.app.config)
+        return self._report(
+            manager.restore(parsed_args.source, parsed_args.database)
+        )
+
+
+class PgBouncerProvision(Command):
+    "Provision PgBouncer (database connection pooler)"
+    log = logging.getLogger(__name__)
+
+    def take_action(self, parsed_args):
+        self.log.info("Provisioning PgBouncer")
+        manager = PgBouncerManager(self.app.config)
+        manager.provision(parsed_args)
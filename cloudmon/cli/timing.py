@@ -0,0 +1,47 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from cliff.lister import Lister
+
+from cloudmon.service import timing
+
+
+class Timing(Lister):
+    "Compare timing profile with the individual timing settings"
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        parser.add_argument(
+            "--query-range",
+            type=int,
+            default=timing.DEFAULT_QUERY_RANGE,
+            help="Dashboard time range in seconds (default: %(default)s)",
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        config = self.app.config
+        if not config.model.timing:
+            self.log.warning(
+                "Timing profile is not configured, current settings are "
+                "compared with themselves"
+            )
+        errors, warnings = timing.validate_timing(config.timing_baseline)
+        for issue in errors + warnings:
+            self.log.warning("Current settings: %s", issue)
+        manager = timing.TimingManager(config)
+        columns = ("Metric", "Current", "Profile", "Savings (%)")
+        return (columns, manager.report(parsed_args.query_range))
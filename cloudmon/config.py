@@ -20,6 +20,7 @@ import yaml
 import ansible_runner
 from ruamel.yaml import YAML
 
+from cloudmon.service import timing
 from cloudmon.types import ConfigModel
 
 
@@ -37,6 +38,7 @@ class CloudMonConfig:
         self.inventory = None
         self.inventory_path = None
         self.apimon_configs = dict()
+        self.timing_baseline = None
         self.private_data_dir = None
         self.project_dir = Path(
             importlib.resources.files("cloudmon"), "ansible", "project"
@@ -66,6 +68,7 @@ class CloudMonConfig:
             ]
         )
         self.is_updated = False
+        self.hosts_facts = dict()
 
         self.private_data_dir = Path(tempfile.mkdtemp(prefix="cloudmon"))
 
@@ -90,6 +93,25 @@ class CloudMonConfig:
         else:
             return hostvars
 
+    def get_group_hosts(self, group_name):
+        """Return all hosts of the group including hosts of child groups
+
+        :param str group_name: ansible group name
+        :returns: list of host names (inventory order, without duplicates)
+        """
+        res = []
+        groups = [group_name]
+        seen = set()
+        while groups:
+            name = groups.pop(0)
+            if name in seen:
+                continue
+            seen.add(name)
+            group = self.inventory.get(name, {})
+            res.extend(x for x in group.get("hosts", []) if x not in res)
+            groups.extend(group.get("children", []))
+        return res
+
     def get_statsd_zone_address(self, zone):
         statsd_group_name = self.model.get_monitoring_zone_by_name(
             zone
@@ -118,6 +140,158 @@ class CloudMonConfig:
 
         return graphite_address
 
+    def get_memcached_servers(self):
+        """Return list of memcached "address:port" entries
+
+        Empty list is returned when there are no hosts in the cache group
+        """
+        cache = self.model.cache
+        servers = []
+        for host in self.inventory.get(cache.group_name, {}).get("hosts", []):
+            host_vars = self.hostvars(host)
+            address = host_vars.get(
+                "internal_address", host_vars.get("ansible_host", host)
+            )
+            servers.append(f"{address}:{cache.port}")
+
+        return servers
+
+    def get_database_endpoint(self, read_only=False, required=False):
+        """Return (address, port) clients should use to reach the databases
+
+        PgBouncer is used when configured, otherwise HAProxy in front of
+        Patroni (HA mode) or PostgreSQL itself. In the HA mode read only
+        clients are sent to the HAProxy port balancing over replicas. None
+        is returned when there are no corresponding hosts in the inventory
+        (RuntimeError is raised instead when ``required`` is set).
+        """
+        db_config = self.model.database
+        if db_config.pgbouncer:
+            group_name = db_config.pgbouncer.group_name
+            port = db_config.pgbouncer.port
+        elif db_config.ha_mode:
+            group_name = "postgres"
+            port = db_config.replica_port if read_only else 5000
+        else:
+            group_name = "postgres"
+            port = 5432
+        hosts = self.inventory.get(group_name, {}).get("hosts", [])
+        if not hosts:
+            if required:
+                raise RuntimeError(
+                    "No hosts in the %s group to reach the databases"
+                    % group_name
+                )
+            return None
+        host_vars = self.hostvars().get(hosts[0], {})
+        address = host_vars.get(
+            "internal_address", host_vars.get("ansible_host", hosts[0])
+        )
+        return (address, port)
+
+    def get_database_name(self, db_name, read_only=False):
+        """Return database name clients should connect to
+
+        PgBouncer exposes "<db_name>_ro" aliases pointing to replicas in the
+        HA mode.
+        """
+        db_config = self.model.database
+        if read_only and db_config.pgbouncer and db_config.ha_mode:
+            return f"{db_name}_ro"
+        return db_name
+
+    def get_database_url(self, db_entry, read_only=False):
+        """Return connection URL for the "<db_name>.<user_name>" entry
+
+        None is returned when the database or user are not defined or there
+        are no database hosts in the inventory.
+        """
+        (db_name, user_name) = db_entry.split(".")
+        endpoint = self.get_database_endpoint(read_only)
+        if not endpoint:
+            self.log.warning(
+                "No database hosts available for the %s entry", db_entry
+            )
+            return None
+        (db_address, db_port) = endpoint
+        for db in self.model.database.databases:
+            if db.name != db_name:
+                continue
+            for user in db.users:
+                if user.name == user_name:
+                    return (
+                        f"postgresql://{user_name}:{user.password}"
+                        f"@{db_address}:{db_port}/"
+                        f"{self.get_database_name(db_name, read_only)}"
+                    )
+        self.log.warning("Database entry %s is not defined", db_entry)
+        return None
+
+    def get_hosts_facts(self, group_name, hosts=None):
+        """Return hardware facts of the hosts in the group
+
+        Facts can be predefined in the inventory (``ansible_processor_vcpus``,
+        ``ansible_memtotal_mb`` and optionally ``ansible_mounts``). Otherwise
+        they are gathered from the hosts. Results are cached.
+
+        :param str group_name: ansible group name
+        :param list hosts: Only facts of these hosts of the group are
+            required
+        :returns: dict of host name to dict with ``processor_vcpus``,
+            ``memtotal_mb`` and ``mounts``
+        """
+        group_hosts = self.inventory.get(group_name, {}).get("hosts", [])
+        if hosts is None:
+            hosts = group_hosts
+        else:
+            hosts = [x for x in group_hosts if x in hosts]
+        missing = []
+        for host in hosts:
+            if host in self.hosts_facts:
+                continue
+            host_vars = self.hostvars().get(host, {})
+            if (
+                "ansible_processor_vcpus" in host_vars
+                and "ansible_memtotal_mb" in host_vars
+            ):
+                self.hosts_facts[host] = dict(
+                    processor_vcpus=int(host_vars["ansible_processor_vcpus"]),
+                    memtotal_mb=int(host_vars["ansible_memtotal_mb"]),
+                    mounts=host_vars.get("ansible_mounts", []),
+                )
+            else:
+                missing.append(host)
+        if missing:
+            self.log.debug("Gathering facts of %s", missing)
+            r = ansible_runner.run(
+                private_data_dir=self.private_data_dir,
+                artifact_dir=".cloudmon_artifact",
+                inventory=self.inventory_path,
+                host_pattern=":".join(missing),
+                module="setup",
+                module_args="gather_subset=!all,!min,hardware",
+                quiet=True,
+            )
+            if r.rc != 0:
+                raise RuntimeError("Error gathering facts of %s" % missing)
+            for event in r.events:
+                if event.get("event") != "runner_on_ok":
+                    continue
+                data = event["event_data"]
+                facts = data["res"].get("ansible_facts", {})
+                self.hosts_facts[data["host"]] = dict(
+                    processor_vcpus=int(
+                        facts.get("ansible_processor_vcpus", 1)
+                    ),
+                    memtotal_mb=int(facts.get("ansible_memtotal_mb", 0)),
+                    mounts=facts.get("ansible_mounts", []),
+                )
+        return {
+            host: self.hosts_facts[host]
+            for host in hosts
+            if host in self.hosts_facts
+        }
+
     def get_env_clouds_credentials(
         self,
         env_name,
@@ -172,6 +346,7 @@ class CloudMonConfig:
                 source = self._deepmerge(supp_source, source)
 
         self.model = ConfigModel(**source)
+        self.apply_timing_profile()
 
     def parse_insecure(
         self, fname: Path,
@@ -186,6 +361,27 @@ class CloudMonConfig:
             source = yaml.safe_load(f)
             self.config = xyaml.load(f)
         self.model = ConfigModel(**source)
+        self.apply_timing_profile()
+
+    def apply_timing_profile(self):
+        """Validate timing profile and propagate it into the settings
+
+        Individual settings before the propagation are preserved in
+        ``timing_baseline`` for comparison.
+        """
+        self.timing_baseline = timing.get_model_timing(self.model)
+        if not self.model.timing:
+            return
+        profile = timing.complete_timing(
+            self.timing_baseline, self.model.timing
+        )
+        self.model.timing = profile
+        errors, warnings = timing.validate_timing(profile)
+        for warning in warnings:
+            self.log.warning("Timing profile: %s", warning)
+        if errors:
+            raise ValueError("Invalid timing profile: %s" % "; ".join(errors))
+        timing.apply_timing(self.model, profile)
 
     def process_inventory(self, inventory_path: Path):
         self.log.debug("Processing inventory file %s" % inventory_path)
@@ -15,6 +15,16 @@ import logging
 
 import ansible_runner
 
+from cloudmon.plugin import apimon_stats
+from cloudmon.service import rollout
+
+
+# Default executor load multiplier (used when host facts are not known)
+DEFAULT_LOAD_MULTIPLIER = 2
+MAX_LOAD_MULTIPLIER = 4
+# Memory required by a single running job (ansible-playbook process)
+EXECUTOR_JOB_MEMORY_MB = 512
+
 
 class ApiMonConfig:
     def __init__(self):
@@ -28,7 +38,11 @@ class ApiMonConfig:
         self.test_matrix = dict()
         self.test_environments = dict()
         self.clouds = dict()
+        self.env_clouds = dict()
         self.db_url = None
+        self.db_read_url = None
+        self.executor_load_multiplier = None
+        self.task_stats = None
         self.zone = None
         self.ref = None
 
@@ -78,11 +92,6 @@ class ApiMonManager:
         plugin_ref = self.config.model.get_plugin_by_name(plugin.name)
         env_name = matrix_entry.env
         zone = matrix_entry.monitoring_zone
-        if zone in self.apimon_configs:
-            raise RuntimeError(
-                f"ApiMon entry for zone {zone} is already present. "
-                "Having multiple entries is not supported yet"
-            )
         apimon_config = self.apimon_configs.setdefault(zone, ApiMonConfig())
         apimon_config.zone = zone
         schedulers_group_name = plugin.schedulers_inventory_group_name
@@ -100,34 +109,33 @@ class ApiMonManager:
             and apimon_config.executors_group_name != executors_group_name
         ):
             raise RuntimeError(
-                "Cannot have different ApiMon Scheduler groups for same "
+                "Cannot have different ApiMon Executor groups for same "
                 "monitoring zone"
             )
+        if (
+            apimon_config.executor_load_multiplier
+            and plugin.executor_load_multiplier
+            and apimon_config.executor_load_multiplier
+            != plugin.executor_load_multiplier
+        ):
+            raise RuntimeError(
+                "Cannot have different ApiMon Executor load multipliers for "
+                "same monitoring zone"
+            )
         apimon_config.schedulers_group_name = schedulers_group_name
         apimon_config.executors_group_name = executors_group_name
-        if "db_url" in matrix_entry:
-            apimon_config.db_url = matrix_entry["db_url"]
-        elif "db_entry" in matrix_entry:
-            (db_name, user_name) = matrix_entry["db_entry"].split(".")
-            for db in self.config.config["database"]["databases"]:
-                if db["name"] == db_name:
-                    for user in db["users"]:
-                        if user["name"] == user_name:
-                            db_host = self.config.inventory["postgres"][
-                                "hosts"
-                            ][0]
-                            db_host_vars = self.config.inventory["_meta"][
-                                "hostvars"
-                            ][db_host]
-
-                            db_host_ip = db_host_vars.get(
-                                "internal_address", db_host
-                            )
-                            db_url = (
-                                f"postgresql://{user_name}:{user['password']}"
-                                f"@{db_host_ip}:5432/{db_name}"
-                            )
-                            apimon_config.db_url = db_url
+        if plugin.executor_load_multiplier:
+            apimon_config.executor_load_multiplier = (
+                plugin.executor_load_multiplier
+            )
+        if matrix_entry.db_entry:
+            db_url = self.config.get_database_url(matrix_entry.db_entry)
+            if db_url:
+                apimon_config.db_url = db_url
+                # Statistics queries are served by replicas
+                apimon_config.db_read_url = self.config.get_database_url(
+                    matrix_entry.db_entry, read_only=True
+                )
 
         if plugin.tests_project not in apimon_config.test_projects:
             for project in plugin_ref.tests_projects:
@@ -150,9 +158,11 @@ class ApiMonManager:
             apimon_config.test_environments[env_name] = self.get_apimon_env(
                 env_name, zone
             )
-            apimon_config.clouds.update(
-                self.config.get_env_clouds_credentials(env_name, zone)
+            env_clouds = self.config.get_env_clouds_credentials(
+                env_name, zone
             )
+            apimon_config.env_clouds[env_name] = env_clouds
+            apimon_config.clouds.update(env_clouds)
 
         statsd_address = self.config.get_statsd_zone_address(zone)
 
@@ -186,6 +196,219 @@ class ApiMonManager:
         self.provision_schedulers(options)
         self.provision_executors(options)
 
+    def get_group_hosts(self, group_name):
+        """Return enabled hosts of the group"""
+        disabled = self.config.inventory.get("disabled", {}).get("hosts", [])
+        hosts = [
+            host
+            for host in self.config.inventory.get(group_name, {}).get(
+                "hosts", []
+            )
+            if host not in disabled
+        ]
+        if not hosts:
+            raise RuntimeError("No enabled hosts in the group %s" % group_name)
+        return hosts
+
+    def get_host_address(self, host):
+        host_vars = self.config.hostvars().get(host, {})
+        return host_vars.get("internal_address", host)
+
+    def load_task_stats(self, apimon_config, days=None):
+        """Load historical task durations of the zone environments
+
+        :returns: dict of environment to dict of task name to TaskStats
+        """
+        if not apimon_config.db_url:
+            raise RuntimeError(
+                "ApiMon database for zone %s is not known" % apimon_config.zone
+            )
+        stats = apimon_stats.compute_task_stats(
+            apimon_stats.fetch_task_durations(
+                apimon_config.db_read_url or apimon_config.db_url,
+                days or apimon_stats.DEFAULT_STATS_DAYS,
+            )
+        )
+        return {
+            env: tasks
+            for env, tasks in stats.items()
+            if env in apimon_config.test_environments
+        }
+
+    def get_task_stats(self, apimon_config):
+        """Task statistics used for scheduling (empty when not available)"""
+        if apimon_config.task_stats is None:
+            apimon_config.task_stats = dict()
+            if apimon_config.db_url:
+                try:
+                    apimon_config.task_stats = self.load_task_stats(
+                        apimon_config
+                    )
+                except RuntimeError as ex:
+                    self.log.warning(
+                        "Not using task durations for scheduling: %s", ex
+                    )
+        return apimon_config.task_stats
+
+    def get_matrix_entry_weight(self, matrix_entry, task_stats=None):
+        """Relative load of the test matrix entry
+
+        Without statistics every task weights 1. With statistics task
+        weight is its median duration relative to the typical task.
+        """
+        env_stats = (task_stats or dict()).get(matrix_entry["env"])
+        if not env_stats:
+            return (
+                len(matrix_entry["tasks"])
+                or self.config.model.capacity.apimon_tasks_per_project
+            )
+        if not matrix_entry["tasks"]:
+            return sum(x.weight for x in env_stats.values())
+        return sum(
+            env_stats[task].weight if task in env_stats else 1
+            for task in matrix_entry["tasks"]
+        )
+
+    def partition_test_matrix(self, apimon_config, schedulers):
+        """Split test matrix into disjoint scheduler partitions
+
+        Entries are assigned heaviest first to the least loaded scheduler,
+        so that partitions have similar weight. Historical task durations
+        are used as weights when available.
+
+        :returns: dict of scheduler host to list of test matrix keys
+        """
+        task_stats = self.get_task_stats(apimon_config)
+        res = {host: list() for host in schedulers}
+        load = {host: 0 for host in schedulers}
+        entries = sorted(
+            apimon_config.test_matrix.items(),
+            key=lambda x: (
+                -self.get_matrix_entry_weight(x[1], task_stats),
+                x[0],
+            ),
+        )
+        for key, entry in entries:
+            host = min(schedulers, key=lambda x: load[x])
+            res[host].append(key)
+            load[host] += self.get_matrix_entry_weight(entry, task_stats)
+        return res
+
+    def assign_executors(self, apimon_config, partitions, executors):
+        """Assign executors to schedulers proportionally to partition weight
+
+        Amount of executors is distributed with the largest remainder
+        method. Every non empty partition gets at least one executor when
+        there are enough executors.
+
+        :returns: dict of executor host to scheduler host
+        """
+        task_stats = self.get_task_stats(apimon_config)
+        weights = {
+            scheduler: sum(
+                self.get_matrix_entry_weight(
+                    apimon_config.test_matrix[key], task_stats
+                )
+                for key in keys
+            )
+            for scheduler, keys in partitions.items()
+        }
+        total = sum(weights.values())
+        if not total:
+            # Nothing to execute, spread executors evenly
+            schedulers = list(partitions)
+            return {
+                executor: schedulers[idx % len(schedulers)]
+                for idx, executor in enumerate(executors)
+            }
+        quotas = {
+            scheduler: len(executors) * weight / total
+            for scheduler, weight in weights.items()
+        }
+        counts = {
+            scheduler: int(quota) for scheduler, quota in quotas.items()
+        }
+        remaining = len(executors) - sum(counts.values())
+        for scheduler in sorted(
+            quotas, key=lambda x: -(quotas[x] - counts[x])
+        )[:remaining]:
+            counts[scheduler] += 1
+        for scheduler, weight in weights.items():
+            if weight and not counts[scheduler]:
+                donor = max(counts, key=lambda x: counts[x])
+                if counts[donor] > 1:
+                    counts[donor] -= 1
+                    counts[scheduler] += 1
+                else:
+                    self.log.warning(
+                        "Not enough ApiMon executors in zone %s for "
+                        "scheduler %s",
+                        apimon_config.zone,
+                        scheduler,
+                    )
+        res = dict()
+        executors_iter = iter(executors)
+        for scheduler in partitions:
+            for _ in range(counts[scheduler]):
+                res[next(executors_iter)] = scheduler
+        return res
+
+    def get_executor_load_multipliers(self, apimon_config, executors):
+        """Executor load multiplier of every executor host
+
+        Executor accepts jobs while the system load is below
+        ``load_multiplier * CPUs``. Multiplier is reduced when the host does
+        not have enough memory per CPU to run that many jobs. Value can be
+        overridden for the monitoring zone (``executor_load_multiplier`` of
+        the matrix entry) or per host (``apimon_executor_load_multiplier``
+        inventory variable). Facts are only gathered for hosts without an
+        override, hosts without facts get the default multiplier.
+
+        :returns: dict of executor host to load multiplier
+        """
+        facts = dict()
+        derived = [
+            host
+            for host in executors
+            if "apimon_executor_load_multiplier"
+            not in self.config.hostvars().get(host, {})
+        ]
+        if derived and not apimon_config.executor_load_multiplier:
+            try:
+                facts = self.config.get_hosts_facts(
+                    apimon_config.executors_group_name, derived
+                )
+            except RuntimeError as ex:
+                self.log.warning(
+                    "%s, default executor load multiplier is used", ex
+                )
+        res = dict()
+        for host in executors:
+            host_vars = self.config.hostvars().get(host, {})
+            if "apimon_executor_load_multiplier" in host_vars:
+                multiplier = float(
+                    host_vars["apimon_executor_load_multiplier"]
+                )
+            elif apimon_config.executor_load_multiplier:
+                multiplier = apimon_config.executor_load_multiplier
+            elif host in facts and facts[host]["memtotal_mb"]:
+                vcpus = max(1, facts[host]["processor_vcpus"])
+                multiplier = round(
+                    min(
+                        MAX_LOAD_MULTIPLIER,
+                        max(
+                            1,
+                            facts[host]["memtotal_mb"]
+                            / (vcpus * EXECUTOR_JOB_MEMORY_MB),
+                        ),
+                    ),
+                    1,
+                )
+            else:
+                multiplier = DEFAULT_LOAD_MULTIPLIER
+            res[host] = multiplier
+        return res
+
     def provision_schedulers(self, options):
         for _, apimon_config in self.apimon_configs.items():
             self.log.info(
@@ -193,14 +416,10 @@ class ApiMonManager:
                 apimon_config.zone,
             )
 
-            schedulers = self.config.inventory[
+            schedulers = self.get_group_hosts(
                 apimon_config.schedulers_group_name
-            ]["hosts"]
-            if len(schedulers) > 1:
-                raise RuntimeError(
-                    "Deploying ApiMon Scheduler to more then one host is "
-                    "currently not supported"
-                )
+            )
+            partitions = self.partition_test_matrix(apimon_config, schedulers)
 
             extravars = dict(
                 scheduler_config_dir="/etc/cloudmon",
@@ -226,17 +445,44 @@ class ApiMonManager:
                     work_dir="/var/lib/apimon",
                     zone=apimon_config.zone,
                 ),
-                test_environments=list(
-                    apimon_config.test_environments.values()
-                ),
-                test_projects=list(apimon_config.test_projects.values()),
-                test_matrix=list(apimon_config.test_matrix.values()),
-            )
-            scheduler_secure_config = dict(
-                clouds=list(apimon_config.clouds.values())
             )
+            host_configs = dict()
+            host_secure_configs = dict()
+            for host, keys in partitions.items():
+                test_matrix = [apimon_config.test_matrix[key] for key in keys]
+                envs = list(dict.fromkeys(x["env"] for x in test_matrix))
+                projects = list(
+                    dict.fromkeys(x["project"] for x in test_matrix)
+                )
+                clouds = dict()
+                for env in envs:
+                    clouds.update(apimon_config.env_clouds[env])
+                host_configs[host] = dict(
+                    test_environments=[
+                        apimon_config.test_environments[env] for env in envs
+                    ],
+                    test_projects=[
+                        apimon_config.test_projects[project]
+                        for project in projects
+                        if project in apimon_config.test_projects
+                    ],
+                    test_matrix=test_matrix,
+                )
+                task_stats = self.get_task_stats(apimon_config)
+                hints = {
+                    env: {
+                        task: stats.as_hint()
+                        for task, stats in task_stats[env].items()
+                    }
+                    for env in envs
+                    if env in task_stats
+                }
+                if hints:
+                    host_configs[host]["scheduling_hints"] = hints
+                host_secure_configs[host] = dict(clouds=list(clouds.values()))
             extravars["scheduler_config"] = scheduler_config
-            extravars["scheduler_secure_config"] = scheduler_secure_config
+            extravars["scheduler_host_configs"] = host_configs
+            extravars["scheduler_host_secure_configs"] = host_secure_configs
 
             self.log.debug("Scheduler extra vars: %s", extravars)
 
@@ -257,6 +503,17 @@ class ApiMonManager:
             self.log.info(
                 "Provision ApiMon Executors for %s", apimon_config.zone
             )
+            schedulers = self.get_group_hosts(
+                apimon_config.schedulers_group_name
+            )
+            executors = self.get_group_hosts(
+                apimon_config.executors_group_name
+            )
+            assignments = self.assign_executors(
+                apimon_config,
+                self.partition_test_matrix(apimon_config, schedulers),
+                executors,
+            )
             extravars = dict(
                 executor_config_dir="/etc/cloudmon",
                 executor_config_file_name="apimon-executor.yaml",
@@ -268,25 +525,35 @@ class ApiMonManager:
 
             executor_config = dict(
                 secure="/etc/apimon/apimon-executor-secure.yaml",
-                gear=[dict(host=apimon_config.scheduler_host, port=4730)],
                 log=dict(config="/etc/apimon/logging.conf"),
                 metrics=dict(
                     statsd=dict(host=apimon_config.statsd_host, port=8125)
                 ),
                 executor=dict(
-                    load_multiplier=2,
                     socket="/tmp/executor.socket",
                     work_dir="/var/lib/apimon",
                     zone=apimon_config.zone,
                     logs_cloud="swift",
                 ),
             )
+            load_multipliers = self.get_executor_load_multipliers(
+                apimon_config, executors
+            )
+            host_configs = dict()
+            for host, scheduler in assignments.items():
+                host_configs[host] = dict(
+                    gear=[
+                        dict(host=self.get_host_address(scheduler), port=4730)
+                    ],
+                    executor=dict(load_multiplier=load_multipliers[host]),
+                )
             executor_secure_config = dict(executor={})
             if apimon_config.db_url:
                 executor_secure_config["executor"] = dict(
                     db_url=apimon_config.db_url
                 )
             extravars["executor_config"] = executor_config
+            extravars["executor_host_configs"] = host_configs
             extravars["executor_secure_config"] = executor_secure_config
 
             self.log.debug("Executor extra vars: %s", extravars)
@@ -302,6 +569,12 @@ class ApiMonManager:
             )
             if r.rc != 0:
                 raise RuntimeError("Error provisioning ApiMon Executors")
+            rollout.get_journal(self.config).record(
+                "apimon_executor",
+                apimon_config.zone,
+                apimon_config.executor_image,
+                digest=rollout.get_image_digest(r),
+            )
 
     def stop(self, options):
         for _, apimon_config in self.apimon_configs.items():
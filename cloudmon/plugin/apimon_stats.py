@@ -0,0 +1,116 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import statistics
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_STATS_DAYS = 7
+
+# Aggregation is done by the database, only one row per task is transferred
+TASK_DURATIONS_QUERY = """
+SELECT
+  environment,
+  name,
+  count(*),
+  percentile_cont(0.5) WITHIN GROUP (ORDER BY duration),
+  percentile_cont(0.95) WITHIN GROUP (ORDER BY duration)
+FROM result_summary
+WHERE timestamp > now() - %s * interval '1 day'
+  AND duration IS NOT NULL
+GROUP BY environment, name
+"""
+
+
+class TaskStats:
+    def __init__(self, environment, task, runs, p50, p95):
+        self.environment = environment
+        self.task = task
+        self.runs = runs
+        self.p50 = p50
+        self.p95 = p95
+        self.weight = 1.0
+
+    def __repr__(self):
+        return (
+            "TaskStats("
+            f"environment: {self.environment}; "
+            f"task: {self.task}; "
+            f"runs: {self.runs}; "
+            f"p50: {self.p50}; "
+            f"p95: {self.p95}; "
+            f"weight: {self.weight}"
+            ")"
+        )
+
+    def as_hint(self):
+        return dict(weight=self.weight, p50=self.p50, p95=self.p95)
+
+
+def fetch_task_durations(db_url, days=DEFAULT_STATS_DAYS):
+    """Fetch duration percentiles of every task from the ApiMon database
+
+    :param str db_url: ApiMon database connection URL
+    :param int days: Amount of days of history to consider
+    :returns: list of (environment, task, runs, p50, p95) tuples
+    """
+    if psycopg2 is None:
+        raise RuntimeError(
+            "psycopg2 is required to query ApiMon statistics "
+            "(pip install stackmon[apimon_stats])"
+        )
+    try:
+        conn = psycopg2.connect(db_url, connect_timeout=10)
+    except psycopg2.Error as ex:
+        raise RuntimeError("Cannot connect to ApiMon database: %s" % ex)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(TASK_DURATIONS_QUERY, (days,))
+            return cur.fetchall()
+    except psycopg2.Error as ex:
+        raise RuntimeError("Error querying ApiMon statistics: %s" % ex)
+    finally:
+        conn.close()
+
+
+def compute_task_stats(rows):
+    """Compute task weights from duration percentiles
+
+    Weight of the task is its median duration relative to the median
+    duration of all tasks, therefore a typical task has weight 1.
+
+    :param rows: iterable of (environment, task, runs, p50, p95)
+    :returns: dict of environment to dict of task name to TaskStats
+    """
+    res = dict()
+    items = []
+    for environment, task, runs, p50, p95 in rows:
+        item = TaskStats(
+            environment, task, int(runs), float(p50 or 0), float(p95 or 0)
+        )
+        res.setdefault(environment, dict())[task] = item
+        items.append(item)
+    durations = [x.p50 for x in items if x.p50 > 0]
+    if not durations:
+        return res
+    median = statistics.median(durations)
+    for item in items:
+        item.weight = round(max(item.p50 / median, 0.01), 2)
+    return res
@@ -18,6 +18,9 @@ from ruamel.yaml import YAML
 
 import ansible_runner
 
+from cloudmon.service import rollout
+from cloudmon.utils import rendezvous_hash
+
 
 class EpmonConfig:
     def __init__(self):
@@ -25,6 +28,7 @@ class EpmonConfig:
         self.image = None
         self.ansible_group_name = None
         self.environment = None
+        self.replication_factor = 1
         self.watch_clouds = dict()
 
     def __repr__(self):
@@ -33,6 +37,7 @@ class EpmonConfig:
             f"zone: {self.zone}; "
             f"image: {self.image}; "
             f"ansible_group_name: {self.ansible_group_name}; "
+            f"replication_factor: {self.replication_factor}; "
             f"watch_clouds: {self.watch_clouds};"
             ")"
         )
@@ -75,6 +80,9 @@ class EpmonManager:
         ansible_group_name = plugin.epmon_inventory_group_name
         epmon_config.ansible_group_name = ansible_group_name
         epmon_config.image = plugin_ref.image
+        epmon_config.replication_factor = max(
+            epmon_config.replication_factor, plugin.replication_factor
+        )
         config = None
 
         # Read config file
@@ -102,6 +110,48 @@ class EpmonManager:
             cloud=plugin.cloud_name,
         )
 
+    def get_epmon_hosts(self, group_name):
+        """Return enabled hosts of the epmon group"""
+        disabled = self.config.get_group_hosts("disabled")
+        hosts = [
+            host
+            for host in self.config.get_group_hosts(group_name)
+            if host not in disabled
+        ]
+        if not hosts:
+            raise RuntimeError(
+                "No enabled hosts in the EpMon group %s" % group_name
+            )
+        return hosts
+
+    def partition_watch_clouds(self, epmon_config, hosts):
+        """Split probing load across epmon hosts
+
+        Every (environment, service_type) pair is assigned to
+        ``replication_factor`` hosts using rendezvous hashing, so that
+        adding or removing host only moves its own share. Environments
+        without explicit service list (whole catalog) are assigned as a
+        single unit.
+
+        :returns: dict of host to watch_clouds subset
+        """
+        res = {host: dict() for host in hosts}
+        replicas = epmon_config.replication_factor
+        for env, data in epmon_config.watch_clouds.items():
+            services = data["services"]
+            if not services:
+                for host in rendezvous_hash(env, hosts, replicas):
+                    res[host][env] = dict(services={}, cloud=data["cloud"])
+                continue
+            for service_type, service in services.items():
+                for host in rendezvous_hash(
+                    f"{env}:{service_type}", hosts, replicas
+                ):
+                    res[host].setdefault(
+                        env, dict(services=dict(), cloud=data["cloud"])
+                    )["services"][service_type] = service
+        return res
+
     def provision(self, options):
         for _, epmon_config in self.epmon_configs.items():
             self.log.info(
@@ -120,40 +170,49 @@ class EpmonManager:
                 statsd_host_vars.get("ansible_host", statsd_servers[0]),
             )
 
-            epmon_cfg = dict(
-                epmon=dict(
-                    clouds=[
-                        {k: dict(service_override=v["services"])}
-                        for (k, v) in epmon_config.watch_clouds.items()
-                    ],
-                    socket="/tmp/epmon.socket",
-                    zone=epmon_config.zone,
-                ),
-                log=dict(config="/etc/apimon/logging.conf"),
-                metrics=dict(
-                    statsd=dict(host=statsd_address, port=8125),
-                ),
-                secure="/etc/apimon/epmon-secure.yaml",
-            )
-            clouds_creds = []
-            # Construct list of cloud credentials for required environments
-            for env, data in epmon_config.watch_clouds.items():
-                clouds_creds.append(
-                    self.config.get_env_cloud_credentials(
-                        env_name=env,
-                        zone_name=epmon_config.zone,
-                        cloud_name=data["cloud"],
-                    )
+            hosts = self.get_epmon_hosts(epmon_config.ansible_group_name)
+            host_configs = dict()
+            host_secure_configs = dict()
+            for host, watch_clouds in self.partition_watch_clouds(
+                epmon_config, hosts
+            ).items():
+                if not watch_clouds:
+                    self.log.info("EpMon host %s has nothing to probe", host)
+                host_configs[host] = dict(
+                    epmon=dict(
+                        clouds=[
+                            {k: dict(service_override=v["services"])}
+                            for (k, v) in watch_clouds.items()
+                        ],
+                        socket="/tmp/epmon.socket",
+                        zone=epmon_config.zone,
+                    ),
+                    log=dict(config="/etc/apimon/logging.conf"),
+                    metrics=dict(
+                        statsd=dict(host=statsd_address, port=8125),
+                    ),
+                    secure="/etc/apimon/epmon-secure.yaml",
                 )
+                clouds_creds = []
+                # Construct list of cloud credentials for required
+                # environments
+                for env, data in watch_clouds.items():
+                    clouds_creds.append(
+                        self.config.get_env_cloud_credentials(
+                            env_name=env,
+                            zone_name=epmon_config.zone,
+                            cloud_name=data["cloud"],
+                        )
+                    )
+                host_secure_configs[host] = dict(clouds=clouds_creds)
 
-            epmon_secure_cfg = dict(clouds=clouds_creds)
             extravars = dict(
                 epmons_group_name=epmon_config.ansible_group_name,
                 epmon_image=epmon_config.image,
                 epmon_config_dir="/etc/cloudmon",
                 epmon_secure_config_file_name="epmon-secure.yaml",
-                epmon_config=epmon_cfg,
-                epmon_secure_config=epmon_secure_cfg,
+                epmon_host_configs=host_configs,
+                epmon_host_secure_configs=host_secure_configs,
             )
             r = ansible_runner.run(
                 private_data_dir=self.config.private_data_dir,
@@ -166,6 +225,12 @@ class EpmonManager:
             )
             if r.rc != 0:
                 raise RuntimeError("Error provisioning EpMon")
+            rollout.get_journal(self.config).record(
+                "epmon",
+                epmon_config.zone,
+                epmon_config.image,
+                digest=rollout.get_image_digest(r),
+            )
 
     def stop(self, options):
         for _, epmon_config in self.epmon_configs.items():
@@ -0,0 +1,228 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+
+# Graphite functions which can be computed by carbon-aggregator
+AGGREGATE_FUNCTIONS = dict(
+    sumSeries="sum", sum="sum", averageSeries="avg", avg="avg"
+)
+# Function combining pre-aggregated series of the multi-value variables
+REWRITE_FUNCTIONS = dict(sum="sumSeries", avg="averageSeries")
+AGGREGATE_CALL_RE = re.compile(
+    r"(?<![\w.])(sumSeries|sum|averageSeries|avg)\(\s*([^(),\s]+)\s*\)"
+)
+VARIABLE_NODE_RE = re.compile(r"^(?:\$(\w+)|\$\{(\w+)\}|\[\[(\w+)\]\])$")
+LITERAL_NODE_RE = re.compile(r"^[\w-]+$")
+# Per service series of the metrics processor environments:
+# (output suffix, method, input pattern)
+ENVIRONMENT_RULES = [
+    (
+        "requests.count",
+        "sum",
+        "stats.counters.openstack.api.{environment}.<zone>.<service>.*.*.*"
+        ".count",
+    ),
+    (
+        "failed.count",
+        "sum",
+        "stats.counters.openstack.api.{environment}.<zone>.<service>.*.*.5*"
+        ".count",
+    ),
+    (
+        "requests.rate",
+        "sum",
+        "stats.counters.openstack.api.{environment}.<zone>.<service>.*.*.*"
+        ".rate",
+    ),
+    (
+        "latency.mean",
+        "avg",
+        "stats.timers.openstack.api.{environment}.<zone>.<service>.*.*.*"
+        ".mean",
+    ),
+]
+
+
+class AggregationRule:
+    """carbon-aggregator rule"""
+
+    def __init__(self, output, method, pattern, frequency):
+        self.output = output
+        self.method = method
+        self.pattern = pattern
+        self.frequency = frequency
+
+    def __str__(self):
+        return (
+            f"{self.output} ({self.frequency}) = {self.method} {self.pattern}"
+        )
+
+    def __repr__(self):
+        return (
+            "AggregationRule("
+            f"output: {self.output}; "
+            f"method: {self.method}; "
+            f"pattern: {self.pattern}; "
+            f"frequency: {self.frequency}"
+            ")"
+        )
+
+
+def query_rule(method, query, prefix, frequency, zone="all"):
+    """Rule pre-aggregating the series query
+
+    Query nodes may be literals, ``*`` or template variables. Variables
+    become fields of the rule, so a series is produced per variable value.
+    Every monitoring zone runs own carbon-aggregator, therefore the zone is
+    part of the output and the replacement query combines all zones.
+
+    :returns: tuple (AggregationRule, replacement query) or None when query
+        can not be pre-aggregated
+    """
+    input_nodes = []
+    output_nodes = []
+    target_nodes = []
+    fields = set()
+    for node in query.split("."):
+        variable = VARIABLE_NODE_RE.match(node)
+        if variable:
+            name = next(x for x in variable.groups() if x)
+            if name in fields:
+                return None
+            fields.add(name)
+            input_nodes.append(f"<{name}>")
+            output_nodes.append(f"<{name}>")
+            target_nodes.append(node)
+        elif node == "*":
+            input_nodes.append(node)
+            output_nodes.append("all")
+            target_nodes.append("all")
+        elif LITERAL_NODE_RE.match(node):
+            input_nodes.append(node)
+            output_nodes.append(node)
+            target_nodes.append(node)
+        else:
+            return None
+    if "*" not in input_nodes:
+        # Every series is selected individually, nothing to aggregate
+        return None
+    rule = AggregationRule(
+        ".".join([prefix, method, zone] + output_nodes),
+        method,
+        ".".join(input_nodes),
+        frequency,
+    )
+    target = "%s(%s)" % (
+        REWRITE_FUNCTIONS[method],
+        ".".join([prefix, method, "*"] + target_nodes),
+    )
+    return (rule, target)
+
+
+def aggregate_target(target, prefix, frequency, zone="all"):
+    """Replace aggregations of the target with pre-aggregated series
+
+    :returns: tuple (new target, list of AggregationRule)
+    """
+    rules = []
+
+    def _replace(match):
+        res = query_rule(
+            AGGREGATE_FUNCTIONS[match.group(1)],
+            match.group(2),
+            prefix,
+            frequency,
+            zone,
+        )
+        if res is None:
+            return match.group(0)
+        rules.append(res[0])
+        return res[1]
+
+    return (AGGREGATE_CALL_RE.sub(_replace, target), rules)
+
+
+def _iter_targets(panels):
+    for panel in panels:
+        yield from panel.get("targets", [])
+        # Collapsed rows contain own panels
+        yield from _iter_targets(panel.get("panels", []))
+
+
+def aggregate_dashboards(
+    bodies, prefix, frequency, zone="all", rewrite=False
+):
+    """Rules pre-aggregating the dashboard queries
+
+    :param bodies: list of dashboard API request bodies
+    :param str zone: Monitoring zone of the carbon-aggregator
+    :param bool rewrite: Replace queries of the dashboards (in place) with
+        the pre-aggregated series
+    :returns: list of AggregationRule
+    """
+    rules = dict()
+    for body in bodies:
+        for target in _iter_targets(body["dashboard"].get("panels", [])):
+            for key in ("target", "targetFull"):
+                if not isinstance(target.get(key), str):
+                    continue
+                expr, target_rules = aggregate_target(
+                    target[key], prefix, frequency, zone
+                )
+                for rule in target_rules:
+                    rules.setdefault(rule.output, rule)
+                if rewrite:
+                    target[key] = expr
+    return list(rules.values())
+
+
+def get_environment_rules(cloudmon_config, prefix, frequency):
+    """Per service and zone rules of the metrics processor environments"""
+    res = []
+    environments = []
+    for instance in cloudmon_config.model.metrics_processor:
+        for env in instance.environments:
+            if env.name not in environments:
+                environments.append(env.name)
+    for env in environments:
+        for suffix, method, pattern in ENVIRONMENT_RULES:
+            res.append(
+                AggregationRule(
+                    f"{prefix}.openstack.api.{env}.<zone>.<service>"
+                    f".{suffix}",
+                    method,
+                    pattern.format(environment=env),
+                    frequency,
+                )
+            )
+    return res
+
+
+def get_rules(cloudmon_config, bodies=None, zone="all"):
+    """Aggregation rules of the environments and dashboards
+
+    :param str zone: Monitoring zone of the carbon-aggregator
+    """
+    aggregation = cloudmon_config.model.graphite.aggregation
+    frequency = cloudmon_config.model.statsd.flush_interval
+    rules = get_environment_rules(
+        cloudmon_config, aggregation.prefix, frequency
+    )
+    rules.extend(
+        aggregate_dashboards(
+            bodies or [], aggregation.prefix, frequency, zone
+        )
+    )
+    return rules
@@ -0,0 +1,54 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import logging
+
+import ansible_runner
+
+
+class MemcachedManager:
+    log = logging.getLogger(__name__)
+
+    def __init__(self, cloudmon_config):
+        self.config = cloudmon_config
+
+    def provision(self, options):
+        cache_config = self.config.model.cache
+        if not self.config.get_memcached_servers():
+            self.log.info(
+                "No hosts in the %s group. Skipping Memcached provisioning",
+                cache_config.group_name,
+            )
+            return
+
+        self.log.info("Provisioning Memcached")
+        extravars = copy.deepcopy(self.config.default_extravars)
+        extravars.update(
+            dict(
+                memcached_group_name=cache_config.group_name,
+                memcached_port=cache_config.port,
+                memcached_memory_ratio=cache_config.memory_ratio,
+            )
+        )
+        r = ansible_runner.run(
+            private_data_dir=self.config.private_data_dir,
+            artifact_dir=".cloudmon_artifact",
+            project_dir=self.config.project_dir.as_posix(),
+            playbook="install_memcached.yaml",
+            inventory=self.config.inventory_path,
+            extravars=extravars,
+            verbosity=1,
+        )
+        if r.rc != 0:
+            raise RuntimeError("Error configuring Memcached")
@@ -0,0 +1,328 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from pathlib import Path
+
+from ruamel.yaml import YAML
+
+
+# Carbon accepts abbreviated and full unit names ("1m", "1min", "1minutes"),
+# therefore only the first letter is significant
+RETENTION_UNITS = dict(
+    s=1,
+    m=60,
+    h=3600,
+    d=86400,
+    w=604800,
+    y=31536000,
+)
+
+WHISPER_METADATA_SIZE = 16
+WHISPER_ARCHIVE_INFO_SIZE = 12
+WHISPER_POINT_SIZE = 12
+
+GB = 1024 ** 3
+
+
+def parse_duration(value):
+    """Parse carbon duration ("10", "10s", "1d") into seconds"""
+    value = value.strip()
+    unit_start = len(value.rstrip("abcdefghijklmnopqrstuvwxyz"))
+    number, unit = value[:unit_start], value[unit_start:]
+    if not number:
+        raise ValueError("Invalid retention duration %s" % value)
+    if not unit:
+        return int(number)
+    if unit[0] not in RETENTION_UNITS:
+        raise ValueError("Invalid retention unit %s" % value)
+    return int(number) * RETENTION_UNITS[unit[0]]
+
+
+def parse_retentions(retentions):
+    """Parse carbon storage-schemas retentions
+
+    :param str retentions: Retentions definition (i.e. "10s:1d,1m:40d")
+    :returns: list of (precision seconds, amount of points) tuples
+    """
+    res = []
+    for archive in retentions.split(","):
+        try:
+            precision, retention = archive.split(":")
+        except ValueError:
+            raise ValueError("Invalid retention definition %s" % archive)
+        precision = parse_duration(precision)
+        if retention.strip().isdigit():
+            # Plain number means amount of points
+            points = int(retention)
+        else:
+            points = parse_duration(retention) // precision
+        res.append((precision, points))
+    return res
+
+
+def whisper_file_size(retentions):
+    """Size (in bytes) of the whisper file with given retentions"""
+    archives = parse_retentions(retentions)
+    return (
+        WHISPER_METADATA_SIZE
+        + WHISPER_ARCHIVE_INFO_SIZE * len(archives)
+        + WHISPER_POINT_SIZE * sum(points for _, points in archives)
+    )
+
+
+class HostCapacity:
+    def __init__(self, host, role):
+        self.host = host
+        self.role = role
+        self.series = 0
+        self.datapoints = 0.0
+        self.rows_per_day = 0
+        self.disk_bytes = 0
+        self.disk_budget_gb = None
+        self.datapoints_budget = None
+
+    def __repr__(self):
+        return (
+            "HostCapacity("
+            f"host: {self.host}; "
+            f"role: {self.role}; "
+            f"series: {self.series}; "
+            f"datapoints: {self.datapoints}; "
+            f"rows_per_day: {self.rows_per_day}; "
+            f"disk_bytes: {self.disk_bytes}"
+            ")"
+        )
+
+    @property
+    def disk_gb(self):
+        return self.disk_bytes / GB
+
+    @property
+    def over_budget(self):
+        if (
+            self.disk_budget_gb is not None
+            and self.disk_gb > self.disk_budget_gb
+        ):
+            return True
+        if (
+            self.datapoints_budget is not None
+            and self.datapoints > self.datapoints_budget
+        ):
+            return True
+        return False
+
+
+class CapacityPlanner:
+    """Estimate load produced by the configured testing matrix
+
+    Amount of series is derived from the matrix (environments x monitoring
+    zones x epmon URLs x apimon tasks x globalmon services) using per element
+    assumptions from the ``capacity`` section of the config. Every series is
+    flushed by StatsD once per flush interval and stored by Graphite with the
+    StatsD retentions.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, cloudmon_config, strict=True):
+        self.config = cloudmon_config
+        # Missing plugin configs raise, otherwise their load is skipped
+        self.strict = strict
+        # series produced by every monitoring zone
+        self.zone_series = dict()
+        # samples per second sent to StatsD by every monitoring zone
+        self.zone_samples = dict()
+        # apimon result rows per day
+        self.db_rows_per_day = 0
+        self._plugin_configs = dict()
+        self.process_config()
+
+    def _load_plugin_config(self, path):
+        if path in self._plugin_configs:
+            return self._plugin_configs[path]
+        config_path = Path(path)
+        if self.config.config_dir is not None and Path(
+            self.config.config_dir, path
+        ).exists():
+            config_path = Path(self.config.config_dir, path)
+        if not config_path.exists():
+            raise RuntimeError("Plugin config %s not found" % path)
+        yaml = YAML(typ="safe")
+        with open(config_path, "r") as f:
+            config = yaml.load(f)
+        self._plugin_configs[path] = config
+        return config
+
+    def _get_urls(self, getter, *args):
+        """Amount of URLs probed by the plugin (0 when not known)"""
+        try:
+            return getter(*args)
+        except RuntimeError as ex:
+            if self.strict:
+                raise
+            self.log.warning("%s, load of the plugin is not accounted", ex)
+            return 0
+
+    def _add_zone_load(self, zone, series, interval):
+        self.zone_series[zone] = self.zone_series.get(zone, 0) + series
+        self.zone_samples[zone] = (
+            self.zone_samples.get(zone, 0) + series / interval
+        )
+
+    def process_config(self):
+        """Walk the testing matrix and accumulate produced load"""
+        assumptions = self.config.model.capacity
+        for matrix_entry in self.config.model.matrix:
+            zone = matrix_entry.monitoring_zone
+            for plugin in matrix_entry.plugins:
+                plugin_data = self.config.model.get_plugin_by_name(plugin.name)
+                if plugin_data.type == "epmon":
+                    urls = self._get_urls(
+                        self.get_epmon_urls, plugin_data, plugin
+                    )
+                    self._add_zone_load(
+                        zone,
+                        urls * assumptions.epmon_series_per_url,
+                        assumptions.epmon_probe_interval,
+                    )
+                elif plugin_data.type == "globalmon":
+                    urls = self._get_urls(self.get_globalmon_urls, plugin)
+                    self._add_zone_load(
+                        zone,
+                        urls * assumptions.globalmon_series_per_url,
+                        assumptions.globalmon_probe_interval,
+                    )
+                elif plugin_data.type == "apimon":
+                    tasks = (
+                        len(plugin.tasks)
+                        or assumptions.apimon_tasks_per_project
+                    )
+                    self._add_zone_load(
+                        zone,
+                        tasks * assumptions.apimon_series_per_task,
+                        assumptions.apimon_run_interval,
+                    )
+                    self.db_rows_per_day += (
+                        tasks
+                        * assumptions.apimon_rows_per_run
+                        * 86400
+                        // assumptions.apimon_run_interval
+                    )
+
+    def get_epmon_urls(self, plugin_data, plugin):
+        config = self._load_plugin_config(plugin_data.config)
+        urls = 0
+        for element_ref in plugin.config_elements:
+            element = config.get("elements", {}).get(element_ref)
+            if element:
+                urls += len(element.get("urls", []))
+        return urls
+
+    def get_globalmon_urls(self, plugin):
+        config = self._load_plugin_config(plugin.config)
+        return sum(
+            len((service or {}).get("urls", []))
+            for service in config.get("services", {}).values()
+        )
+
+    def _group_hosts(self, group_name):
+        hosts = self.config.inventory.get(group_name, {}).get("hosts", [])
+        if not hosts:
+            self.log.warning(
+                "No hosts in group %s, load is not accounted", group_name
+            )
+        return hosts
+
+    def _host_capacity(
+        self, res, host, role, disk_budget=None, dp_budget=None
+    ):
+        key = (host, role)
+        if key not in res:
+            host_vars = self.config.hostvars().get(host, {}) or {}
+            item = HostCapacity(host, role)
+            if disk_budget is not None:
+                item.disk_budget_gb = float(
+                    host_vars.get("cloudmon_disk_budget_gb", disk_budget)
+                )
+            if dp_budget is not None:
+                item.datapoints_budget = float(
+                    host_vars.get("cloudmon_datapoints_budget", dp_budget)
+                )
+            res[key] = item
+        return res[key]
+
+    def estimate(self):
+        """Estimate load of every involved host
+
+        :returns: list of HostCapacity
+        """
+        model = self.config.model
+        assumptions = model.capacity
+        flush_interval = model.statsd.flush_interval
+        whisper_size = whisper_file_size(model.graphite.retentions_stats)
+        res = dict()
+
+        for zone, series in self.zone_series.items():
+            zone_model = model.get_monitoring_zone_by_name(zone)
+            # StatsD receives every sample of the zone
+            for host in self._group_hosts(zone_model.statsd_group_name):
+                item = self._host_capacity(
+                    res,
+                    host,
+                    "statsd",
+                    dp_budget=assumptions.statsd_datapoints_budget,
+                )
+                item.series += series
+                item.datapoints += self.zone_samples[zone]
+            # Graphite persists every series once per flush interval. With
+            # multiple hosts series are spread according to the replication
+            # factor.
+            graphite_hosts = self._group_hosts(zone_model.graphite_group_name)
+            if not graphite_hosts:
+                continue
+            share = min(
+                1.0, model.graphite.replication_factor / len(graphite_hosts)
+            )
+            for host in graphite_hosts:
+                item = self._host_capacity(
+                    res,
+                    host,
+                    "graphite",
+                    assumptions.graphite_disk_budget_gb,
+                    assumptions.graphite_datapoints_budget,
+                )
+                host_series = series * share
+                item.series += host_series
+                item.datapoints += host_series / flush_interval
+                item.disk_bytes += host_series * whisper_size
+
+        if self.db_rows_per_day:
+            # Every database host (also replicas) stores full data set
+            for host in self._group_hosts("postgres"):
+                item = self._host_capacity(
+                    res, host, "postgres", assumptions.postgres_disk_budget_gb
+                )
+                item.rows_per_day += self.db_rows_per_day
+                item.disk_bytes += (
+                    self.db_rows_per_day
+                    * assumptions.planning_horizon_days
+                    * assumptions.apimon_row_bytes
+                )
+
+        for item in res.values():
+            if item.over_budget:
+                self.log.warning(
+                    "Host %s (%s) is over budget", item.host, item.role
+                )
+        return list(res.values())
@@ -0,0 +1,240 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import codecs
+import copy
+import gzip
+import json
+import logging
+import os
+from pathlib import Path
+
+import ansible_runner
+import requests
+
+from cloudmon.service.tsdb import GRAPHITE_STORAGE_PATH
+
+
+WHISPER_DATA_PATH = f"{GRAPHITE_STORAGE_PATH}/whisper"
+# Name of the node collecting children above the max_children limit
+OTHER = "<other>"
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def iter_whisper_dir(path):
+    """Stream (metric name, size) of every whisper file of the directory
+
+    Directories are walked with ``os.scandir`` depth first, so only the
+    stack of currently open directories is held in memory.
+    """
+    path = Path(path)
+    stack = [(path.as_posix(), "")]
+    while stack:
+        dir_path, prefix = stack.pop()
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, f"{prefix}{entry.name}."))
+                elif entry.name.endswith(".wsp"):
+                    yield (
+                        f"{prefix}{entry.name[:-4]}",
+                        entry.stat(follow_symlinks=False).st_size,
+                    )
+
+
+def iter_listing(lines):
+    """Stream (metric name, size) of the ``find -printf '%P %s\\n'`` output"""
+    for line in lines:
+        path, _, size = line.strip().rpartition(" ")
+        if not path.endswith(".wsp"):
+            continue
+        yield (path[:-4].replace("/", "."), int(size))
+
+
+def iter_json_list(chunks):
+    """Stream elements of a JSON list (i.e. carbonapi ``index.json``)
+
+    :param chunks: iterable of str or bytes chunks of the document
+    """
+    decoder = json.JSONDecoder()
+    # Multibyte characters may be split between chunks
+    bytes_decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    started = False
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = bytes_decoder.decode(chunk)
+        buf += chunk
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if not started:
+                if pos >= len(buf):
+                    break
+                if buf[pos] != "[":
+                    raise ValueError("Metrics index is not a JSON list")
+                started = True
+                pos += 1
+                continue
+            if pos >= len(buf) or buf[pos] == "]":
+                break
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Element is not complete yet
+                break
+            yield item
+            pos = end
+        buf = buf[pos:]
+
+
+class PrefixNode:
+    __slots__ = ("series", "size", "children")
+
+    def __init__(self):
+        self.series = 0
+        self.size = 0
+        self.children = dict()
+
+
+class CardinalityTrie:
+    """Series count and size aggregated per metric name prefix
+
+    Only ``max_depth`` leading components are kept and every node keeps at
+    most ``max_children`` children (the rest is accounted in the ``<other>``
+    child), therefore memory is bounded regardless of the amount of
+    metrics.
+    """
+
+    def __init__(self, max_depth=4, max_children=1000):
+        self.max_depth = max_depth
+        self.max_children = max_children
+        self.root = PrefixNode()
+
+    def add(self, name, size=0):
+        node = self.root
+        node.series += 1
+        node.size += size
+        for component in name.split(".")[: self.max_depth]:
+            child = node.children.get(component)
+            if child is None:
+                if len(node.children) >= self.max_children:
+                    component = OTHER
+                    child = node.children.get(OTHER)
+                if child is None:
+                    child = node.children[component] = PrefixNode()
+            child.series += 1
+            child.size += size
+            node = child
+
+    def update(self, items):
+        for name, size in items:
+            self.add(name, size)
+        return self
+
+    def iter_prefixes(self, depth=None):
+        """Yield (prefix, level, series, size) sorted by series per parent"""
+        depth = depth or self.max_depth
+
+        def _walk(node, prefix, level):
+            for name, child in sorted(
+                node.children.items(), key=lambda x: (-x[1].series, x[0])
+            ):
+                child_prefix = f"{prefix}.{name}" if prefix else name
+                yield (child_prefix, level, child.series, child.size)
+                if level < depth:
+                    yield from _walk(child, child_prefix, level + 1)
+
+        yield from _walk(self.root, "", 1)
+
+
+class CardinalityManager:
+    """Analyze amount of series in Graphite"""
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, cloudmon_config):
+        self.config = cloudmon_config
+
+    def fetch_listings(self, target_dir):
+        """Fetch whisper file listing of every graphite host
+
+        :returns: list of fetched listing files
+        """
+        target_dir = Path(target_dir).resolve()
+        target_dir.mkdir(parents=True, exist_ok=True)
+        extravars = copy.deepcopy(self.config.default_extravars)
+        extravars.update(
+            graphite_group_name="graphite",
+            whisper_data_path=WHISPER_DATA_PATH,
+            whisper_listing_dest=target_dir.as_posix(),
+        )
+        r = ansible_runner.run(
+            private_data_dir=self.config.private_data_dir,
+            artifact_dir=".cloudmon_artifact",
+            project_dir=self.config.project_dir.as_posix(),
+            playbook="fetch_whisper_listing.yaml",
+            inventory=self.config.inventory_path,
+            extravars=extravars,
+            verbosity=1,
+        )
+        if r.rc != 0:
+            raise RuntimeError("Error fetching whisper listing")
+        return sorted(target_dir.glob("*.txt.gz"))
+
+    def iter_source(self, source):
+        """Stream (metric name, size) of the source
+
+        :param str source: whisper directory, listing file (optionally
+            gzipped), carbonapi ``index.json`` file or its URL
+        """
+        if source.startswith("http://") or source.startswith("https://"):
+            response = requests.get(source, stream=True, timeout=60)
+            if response.status_code != 200:
+                raise RuntimeError(
+                    "Error fetching metrics index %s: %s"
+                    % (source, response.text)
+                )
+            for name in iter_json_list(
+                response.iter_content(READ_CHUNK_SIZE, decode_unicode=True)
+            ):
+                yield (name, 0)
+            return
+        path = Path(source)
+        if path.is_dir():
+            yield from iter_whisper_dir(path)
+            return
+        if not path.exists():
+            raise RuntimeError("Metrics source %s does not exist" % source)
+        opener = gzip.open if path.suffix == ".gz" else open
+        if ".json" in path.suffixes:
+            with opener(path, "rt") as f:
+                for name in iter_json_list(
+                    iter(lambda: f.read(READ_CHUNK_SIZE), "")
+                ):
+                    yield (name, 0)
+        else:
+            with opener(path, "rt") as f:
+                yield from iter_listing(f)
+
+    def analyze(self, sources, max_depth=4, max_children=1000):
+        """Build prefix trie of all sources
+
+        :returns: CardinalityTrie
+        """
+        trie = CardinalityTrie(max_depth, max_children)
+        for source in sources:
+            self.log.debug("Scanning %s", source)
+            trie.update(self.iter_source(str(source)))
+        return trie
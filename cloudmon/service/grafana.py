@@ -11,7 +11,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 import copy
+import hashlib
+import json
 import logging
 from pathlib import Path
 import shutil
@@ -23,6 +27,59 @@ from urllib.parse import urljoin
 import ansible_runner
 
 from cloudmon import utils
+from cloudmon.service import aggregation
+from cloudmon.service.capacity import parse_duration
+from cloudmon.service.capacity import parse_retentions
+from cloudmon.service.querylint import get_graphite_datasources
+from cloudmon.service.querylint import is_graphite_datasource
+from cloudmon.service.querylint import MetricIndex
+from cloudmon.service.querylint import QueryLinter
+from cloudmon.service import tsdb
+
+
+# Amount of concurrent datasource updates
+DATASOURCE_WORKERS = 8
+# Provisioning directory of Grafana (file provisioning mode)
+GRAFANA_PROVISIONING_DIR = "/etc/grafana/provisioning"
+# Bump whenever the compiled dashboard body changes to invalidate the cache
+DASHBOARD_COMPILER_VERSION = 2
+# libyaml based loader is significantly faster when available
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def format_interval(seconds):
+    """Format interval in seconds as Grafana duration ("30s", "1m")"""
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    if seconds % 60 == 0:
+        return f"{seconds // 60}m"
+    return f"{seconds}s"
+
+
+def _load_yaml_file(path):
+    with open(path, "rb") as f:
+        return yaml.load(f, Loader=YAML_LOADER)
+
+
+def _load_dashboard_sources(dashboard_file, panel_files):
+    """Parse dashboard definition and its panels
+
+    Module level function to be usable in the process pool.
+    """
+    return (
+        _load_yaml_file(dashboard_file),
+        [_load_yaml_file(x) for x in panel_files],
+    )
+
+
+def _get_sources_hash(dashboard_file, panel_files, salt=""):
+    """Hash of the dashboard source files and compiler settings"""
+    digest = hashlib.sha256(f"{DASHBOARD_COMPILER_VERSION}{salt}".encode())
+    for path in [dashboard_file] + list(panel_files):
+        digest.update(path.name.encode())
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
 
 
 class GrafanaSession(requests.Session):
@@ -66,19 +123,44 @@ class GrafanaManager:
 
         return folder
 
-    def provision_ds(self, options):
-        self.log.debug("Configuring Grafana datasources")
+    def get_datasource_bodies(self):
+        """Desired bodies of all configured datasources
+
+        Model is not modified. Hash of the ``secureJsonData`` is stored in
+        the ``jsonData`` since Grafana never returns secure values back and
+        changes would be not detectable otherwise.
+
+        :returns: dict of datasource name to body
+        """
         grafana_config = self.config.model.grafana
+        res = dict()
         for ds in grafana_config.datasources:
-            self.log.debug("Configuring DS %s" % ds["name"])
+            ds = copy.deepcopy(ds)
             port = ds.pop("port", None)
+            # Dashboards only read, therefore replicas are used by default
+            replica = ds.pop("replica", True)
             ds_body = dict(
                 access="proxy",
                 name=ds["name"],
                 type=ds["type"],
             )
             ds_body.update(ds)
-            if "url" not in ds:
+            if "url" not in ds and ds["type"] == "postgres" and not port:
+                # Databases are reached through the pooler or HAProxy
+                (db_address, db_port) = self.config.get_database_endpoint(
+                    read_only=replica, required=True
+                )
+                ds_body["url"] = f"{db_address}:{db_port}"
+                if "database" in ds:
+                    ds_body["database"] = self.config.get_database_name(
+                        ds["database"], read_only=replica
+                    )
+            elif "url" not in ds and ds["type"] == "graphite":
+                # Series are queried from the configured TSDB backend
+                ds_body["url"] = tsdb.get_backend(self.config).get_query_url(
+                    port
+                )
+            elif "url" not in ds:
                 # Warning: ds_type is used as group name - beware
                 host = self.config.inventory[ds["type"]]["hosts"][0]
                 host_vars = self.config.hostvars(host)
@@ -88,33 +170,76 @@ class GrafanaManager:
                 ds_body["url"] = host_ip
                 if port:
                     ds_body["url"] += f":{port}"
+            if ds_body.get("secureJsonData"):
+                ds_body.setdefault("jsonData", dict())[
+                    "cloudmonSecureHash"
+                ] = hashlib.sha256(
+                    json.dumps(
+                        ds_body["secureJsonData"], sort_keys=True
+                    ).encode()
+                ).hexdigest()
+            res[ds_body["name"]] = ds_body
+        return res
 
-            response = self.request(
-                method="GET", url=f"/api/datasources/name/{ds['name']}"
+    @staticmethod
+    def _is_subset(desired, actual):
+        """Whether all desired values are present in the actual object"""
+        if isinstance(desired, dict):
+            return isinstance(actual, dict) and all(
+                GrafanaManager._is_subset(v, actual.get(k))
+                for k, v in desired.items()
             )
+        return desired == actual
 
-            if response.status_code == 200:
-                # Update DS
-                response = self.request(
-                    method="PUT",
-                    url=f"/api/datasources/{response.json()['id']}",
-                    json=ds_body,
-                )
-            elif response.status_code == 404:
-                # Create DS
-                response = self.request(
-                    method="POST", url="/api/datasources", json=ds_body
-                )
-            else:
-                raise RuntimeError(
-                    f"Error checking datasources in Grafana: {response.text}"
-                )
+    def get_datasource_changes(self, desired, existing):
+        """Compare desired datasources with the existing ones
 
-            if response.status_code != 200:
-                raise RuntimeError(
-                    "Error configuring datasources in Grafana: "
-                    f"{response.text}"
-                )
+        :param dict desired: datasource name to desired body
+        :param list existing: datasources as returned by Grafana
+        :returns: list of (method, url, body) tuples
+        """
+        existing = {x["name"]: x for x in existing}
+        res = []
+        for name, body in desired.items():
+            current = existing.get(name)
+            if not current:
+                res.append(("POST", "/api/datasources", body))
+                continue
+            compare = {k: v for k, v in body.items() if k != "secureJsonData"}
+            if not self._is_subset(compare, current):
+                res.append(("PUT", f"/api/datasources/{current['id']}", body))
+        return res
+
+    def _apply_datasource_change(self, change):
+        (method, url, body) = change
+        self.log.debug("Configuring DS %s" % body["name"])
+        response = self.request(method=method, url=url, json=body)
+        if response.status_code != 200:
+            return f"{body['name']}: {response.text}"
+
+    def provision_ds(self, options):
+        self.log.debug("Configuring Grafana datasources")
+        desired = self.get_datasource_bodies()
+        response = self.request(method="GET", url="/api/datasources")
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"Error checking datasources in Grafana: {response.text}"
+            )
+        changes = self.get_datasource_changes(desired, response.json())
+        if not changes:
+            self.log.debug("Grafana datasources are up to date")
+            return
+        with ThreadPoolExecutor(max_workers=DATASOURCE_WORKERS) as executor:
+            errors = [
+                x
+                for x in executor.map(self._apply_datasource_change, changes)
+                if x
+            ]
+        if errors:
+            raise RuntimeError(
+                "Error configuring datasources in Grafana: "
+                + "; ".join(errors)
+            )
 
     def _get_panels(self, panel_defs):
         panels = []
@@ -135,20 +260,59 @@ class GrafanaManager:
         )
         for panel in sorted(panel_defs, key=lambda k: k.get("order", 100)):
             self.log.debug(f"Processing panel {panel}")
-            panel.pop("order", None)
-            if "datasource" not in panel:
-                panel["datasource"] = "cloudmon"
+            panel = {k: v for k, v in panel.items() if k != "order"}
+            panel.setdefault("datasource", "cloudmon")
             panels.append(panel)
         return panels
 
-    def provision_dashboard(self, dashboard_def, panels):
-        self.log.debug(
-            f"Configuring Grafana dashboard {dashboard_def['title']}"
+    def get_refresh_settings(self):
+        """Settings the refresh interval of dashboards depends on"""
+        model = self.config.model
+        return dict(
+            flush_interval=model.statsd.flush_interval,
+            # Finest resolution of the StatsD series in Graphite
+            resolution=parse_retentions(model.graphite.retentions_stats)[0][0],
+            min_refresh_interval=model.grafana.min_refresh_interval,
+            refresh_overrides=model.grafana.refresh_overrides,
+            graphite_datasources=sorted(
+                get_graphite_datasources(self.config)
+            ),
+        )
+
+    def get_dashboard_refresh(self, dashboard_def, panels):
+        """Refresh interval of the dashboard
+
+        Graphite data changes at most once per StatsD flush interval and is
+        stored with the resolution of the finest retention, refreshing more
+        often only produces load. Dashboards may request longer intervals
+        with ``refresh`` (i.e. "1m") in their definition or in
+        ``grafana.refresh_overrides``.
+
+        :returns: Grafana refresh string (i.e. "30s", "1m")
+        """
+        settings = self.get_refresh_settings()
+        refresh = settings["min_refresh_interval"]
+        if any(
+            is_graphite_datasource(
+                x.get("datasource", "cloudmon"),
+                settings["graphite_datasources"],
+            )
+            for x in panels
+        ):
+            refresh = max(
+                refresh, settings["flush_interval"], settings["resolution"]
+            )
+        override = settings["refresh_overrides"].get(
+            dashboard_def["uid"], dashboard_def.get("refresh")
         )
+        if override:
+            refresh = max(refresh, parse_duration(str(override)))
+        return format_interval(refresh)
+
+    def get_dashboard_body(self, dashboard_def, panels):
+        """Body of the dashboard API request"""
         dashboard_uid = dashboard_def["uid"]
         folder_uid = dashboard_def.get("folderUid", "CloudMon")
-
-        self.ensure_folder(uid=folder_uid, title="CloudMon")
         body = dict(
             folderUid=folder_uid,
             overwrite=True,
@@ -156,7 +320,7 @@ class GrafanaManager:
             dashboard=dict(
                 uid=dashboard_uid,
                 title=dashboard_def["title"],
-                refresh="10s",
+                refresh=self.get_dashboard_refresh(dashboard_def, panels),
                 templating=dict(
                     list=[
                         dict(
@@ -189,6 +353,18 @@ class GrafanaManager:
             body["dashboard"]["description"] = dashboard_def["description"]
         panels = self._get_panels(panels)
         body["dashboard"]["panels"] = panels
+        return body
+
+    def provision_dashboard(self, dashboard_def, panels):
+        self.push_dashboard(self.get_dashboard_body(dashboard_def, panels))
+
+    def push_dashboard(self, body):
+        """Push compiled dashboard body into Grafana"""
+        dashboard_uid = body["dashboard"]["uid"]
+        self.log.debug(
+            f"Configuring Grafana dashboard {body['dashboard']['title']}"
+        )
+        self.ensure_folder(uid=body["folderUid"], title="CloudMon")
         response = self.request(
             method="POST", url="/api/dashboards/db", json=body
         )
@@ -198,8 +374,11 @@ class GrafanaManager:
                 f"in Grafana: {response.text}"
             )
 
-    def provision_dashboards(self, options):
-        self.log.debug("Configuring Grafana dashboards")
+    def prepare_dashboards(self):
+        """Checkout dashboard repositories and merge their content
+
+        :returns: Path of the merged dashboards directory
+        """
         grafana_config = self.config.model.grafana
         work_dir = "."
 
@@ -217,25 +396,219 @@ class GrafanaManager:
                     dirs_exist_ok=True,
                 )
 
-        # Ensure target folder exists
-        self.ensure_folder(uid="CloudMon", title="CloudMon")
-        for dashboard_file in dashboards_dir.glob("**/dashboard.yaml"):
+        return dashboards_dir
+
+    def find_dashboards(self, dashboards_dir):
+        """Find dashboard sources
+
+        :returns: list of (dashboard file, list of panel files)
+        """
+        res = []
+        for dashboard_file in sorted(dashboards_dir.glob("**/dashboard.yaml")):
             self.log.debug(f"Found Dashboard definition {dashboard_file}")
-            with open(dashboard_file, "r") as f:
-                dashboard_def = yaml.load(f, Loader=yaml.SafeLoader)
-            dashboard_panels = []
-            for panel_file in dashboard_file.parent.glob("*.yaml"):
-                if panel_file.name == "dashboard.yaml":
-                    continue
-                self.log.debug(
-                    f"Found Dashboard panel definition {panel_file}"
-                )
-                with open(panel_file, "r") as f:
-                    dashboard_panels.append(
-                        yaml.load(f, Loader=yaml.SafeLoader)
+            panel_files = sorted(
+                x
+                for x in dashboard_file.parent.glob("*.yaml")
+                if x.name != "dashboard.yaml"
+            )
+            res.append((dashboard_file, panel_files))
+        return res
+
+    def load_dashboards(self, dashboards_dir):
+        """Yield (dashboard_def, panels) of every dashboard"""
+        for dashboard_file, panel_files in self.find_dashboards(
+            dashboards_dir
+        ):
+            yield _load_dashboard_sources(dashboard_file, panel_files)
+
+    def compile_dashboards(self, dashboards_dir, cache_dir=None):
+        """Compile dashboard bodies reusing results of the previous runs
+
+        Compiled bodies are cached under the hash of their source files.
+        Only dashboards with changed sources are parsed (in parallel
+        processes) and compiled. Cache entries of vanished sources are
+        dropped.
+
+        :param Path dashboards_dir: Directory with dashboard sources
+        :param Path cache_dir: Cache directory (``_dashboards_cache`` by
+            default)
+        :returns: list of dashboard API request bodies
+        """
+        cache_dir = Path(cache_dir or Path(".", "_dashboards_cache"))
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        sources = self.find_dashboards(dashboards_dir)
+        salt = json.dumps(self.get_refresh_settings(), sort_keys=True)
+        keys = [_get_sources_hash(*x, salt=salt) for x in sources]
+        bodies = dict()
+        misses = []
+        for key, source in zip(keys, sources):
+            cache_file = Path(cache_dir, f"{key}.json")
+            if cache_file.exists():
+                with open(cache_file, "r") as f:
+                    bodies[key] = json.load(f)
+            else:
+                misses.append((key, source))
+        self.log.debug(
+            "Compiling %d of %d dashboards", len(misses), len(sources)
+        )
+        if len(misses) > 1:
+            with ProcessPoolExecutor() as executor:
+                parsed = list(
+                    executor.map(
+                        _load_dashboard_sources,
+                        *zip(*(source for _, source in misses)),
                     )
+                )
+        else:
+            parsed = [_load_dashboard_sources(*x) for _, x in misses]
+        for (key, _), (dashboard_def, panels) in zip(misses, parsed):
+            body = self.get_dashboard_body(dashboard_def, panels)
+            with open(Path(cache_dir, f"{key}.json"), "w") as f:
+                json.dump(body, f)
+            bodies[key] = body
+        for cache_file in cache_dir.glob("*.json"):
+            if cache_file.stem not in bodies:
+                cache_file.unlink()
+        return [bodies[key] for key in keys]
+
+    def aggregate_dashboards(self, bodies):
+        """Replace queries with series pre-aggregated by carbon-aggregator
+
+        Only applies when rewriting of the dashboards is explicitly enabled
+        and Graphite is the TSDB backend. Pre-aggregated series have no
+        history before aggregation was enabled.
+        """
+        aggregation_config = self.config.model.graphite.aggregation
+        if not (
+            aggregation_config.enabled
+            and aggregation_config.dashboards
+            and aggregation_config.rewrite_dashboards
+            and self.config.model.tsdb.backend == "graphite"
+        ):
+            return
+        rules = aggregation.aggregate_dashboards(
+            bodies,
+            aggregation_config.prefix,
+            self.config.model.statsd.flush_interval,
+            rewrite=True,
+        )
+        self.log.debug("Dashboards use %d pre-aggregated series", len(rules))
+
+    def lint_dashboards(self, bodies, index=None):
+        """Check query cost of compiled dashboards
 
-            self.provision_dashboard(dashboard_def, dashboard_panels)
+        :param bodies: list of dashboard API request bodies
+        :param str index: Metric index source (``grafana.lint.index`` by
+            default)
+        :returns: list of QueryCost (empty when no index is configured)
+        """
+        index = index or self.config.model.grafana.lint.index
+        if not index:
+            self.log.debug("Metric index is not configured, skipping lint")
+            return []
+        linter = QueryLinter(self.config, MetricIndex.load(index))
+        return linter.check(bodies)
+
+    def provision_dashboards(self, options):
+        self.log.debug("Configuring Grafana dashboards")
+        dashboards_dir = self.prepare_dashboards()
+        bodies = self.compile_dashboards(dashboards_dir)
+        self.aggregate_dashboards(bodies)
+        self.lint_dashboards(bodies)
+        # Ensure target folder exists
+        self.ensure_folder(uid="CloudMon", title="CloudMon")
+        for body in bodies:
+            self.push_dashboard(body)
+
+    def render_provisioning(self, target_dir):
+        """Render datasources and dashboards in the Grafana provisioning
+        format
+
+        Layout of the target directory matches ``/etc/grafana/provisioning``:
+        ``datasources/cloudmon.yaml``, ``dashboards/cloudmon.yaml`` (one
+        provider per folder) and ``dashboards/<folder_uid>/<uid>.json``.
+
+        :param Path target_dir: Directory to render into (content is
+            replaced)
+        """
+        target_dir = Path(target_dir)
+        if target_dir.exists():
+            shutil.rmtree(target_dir)
+        ds_dir = Path(target_dir, "datasources")
+        dashboards_dir = Path(target_dir, "dashboards")
+        ds_dir.mkdir(parents=True)
+        dashboards_dir.mkdir(parents=True)
+
+        datasources = []
+        for body in self.get_datasource_bodies().values():
+            datasources.append(dict(body, editable=False))
+        with open(Path(ds_dir, "cloudmon.yaml"), "w") as f:
+            yaml.safe_dump(
+                dict(apiVersion=1, datasources=datasources),
+                f,
+                default_flow_style=False,
+            )
+
+        bodies = self.compile_dashboards(self.prepare_dashboards())
+        self.aggregate_dashboards(bodies)
+        self.lint_dashboards(bodies)
+        folders = set()
+        for body in bodies:
+            folder_uid = body["folderUid"]
+            folder_dir = Path(dashboards_dir, folder_uid)
+            folder_dir.mkdir(exist_ok=True)
+            folders.add(folder_uid)
+            with open(
+                Path(folder_dir, f"{body['dashboard']['uid']}.json"), "w"
+            ) as f:
+                json.dump(body["dashboard"], f, indent=2, sort_keys=True)
+
+        providers = [
+            dict(
+                name=f"cloudmon-{folder_uid}",
+                folder=folder_uid,
+                folderUid=folder_uid,
+                type="file",
+                disableDeletion=False,
+                allowUiUpdates=False,
+                updateIntervalSeconds=30,
+                options=dict(
+                    path=f"{GRAFANA_PROVISIONING_DIR}/dashboards/{folder_uid}"
+                ),
+            )
+            for folder_uid in sorted(folders)
+        ]
+        with open(Path(dashboards_dir, "cloudmon.yaml"), "w") as f:
+            yaml.safe_dump(
+                dict(apiVersion=1, providers=providers),
+                f,
+                default_flow_style=False,
+            )
+
+    def provision_files(self, options):
+        """Ship datasources and dashboards to the provisioning directory"""
+        grafana_config = self.config.model.grafana
+        if grafana_config.k8_config:
+            raise NotImplementedError
+        self.log.debug("Rendering Grafana provisioning files")
+        target_dir = Path(".", "_grafana_provisioning").resolve()
+        self.render_provisioning(target_dir)
+        extravars = copy.deepcopy(self.config.default_extravars)
+        extravars.update(
+            grafana_group_name="grafana",
+            grafana_provisioning_src=target_dir.as_posix(),
+        )
+        r = ansible_runner.run(
+            private_data_dir=self.config.private_data_dir,
+            project_dir=self.config.project_dir.as_posix(),
+            artifact_dir=".cloudmon_artifact",
+            playbook="configure_grafana_provisioning.yaml",
+            inventory=self.config.inventory_path,
+            extravars=extravars,
+            verbosity=1,
+        )
+        if r.rc != 0:
+            raise RuntimeError("Error shipping Grafana provisioning files")
 
     def provision(self, options):
         grafana_config = self.config.model.grafana
@@ -250,19 +623,20 @@ class GrafanaManager:
             extravars = copy.deepcopy(self.config.default_extravars)
             # For now group_name is hardcoded to grafana
             extravars["grafana_group_name"] = "grafana"
+            extravars["grafana_provisioning_mode"] = (
+                grafana_config.provisioning_mode
+            )
+            extravars["grafana_min_refresh_interval"] = format_interval(
+                grafana_config.min_refresh_interval
+            )
             extravars.update(grafana_config.get("config", {}))
             if "grafana_database_host" not in extravars:
-                db_host = self.config.inventory["postgres"]["hosts"][0]
-                db_host_vars = self.config.hostvars(db_host)
-                db_port = None
-                if self.config.model.database.ha_mode:
-                    db_port = "5000"
-                extravars["grafana_database_host"] = db_host_vars.get(
-                    "internal_address",
-                    db_host_vars.get("ansible_address", db_host),
+                (db_address, db_port) = self.config.get_database_endpoint(
+                    required=True
                 )
-                if db_port:
-                    extravars["grafana_database_host"] += ":" + db_port
+                extravars["grafana_database_host"] = db_address
+                if db_port != 5432:
+                    extravars["grafana_database_host"] += f":{db_port}"
 
             r = ansible_runner.run(
                 private_data_dir=self.config.private_data_dir,
@@ -19,6 +19,7 @@ from jinja2 import Environment
 from jinja2 import PackageLoader
 
 from cloudmon import utils
+from cloudmon.service import sla
 
 
 class MetricsProcessorManager:
@@ -60,7 +61,7 @@ class MetricsProcessorManager:
             with open(Path(overlay_dir, "config.yaml"), "w") as fp:
                 mp_config = dict(
                     datasource=dict(
-                        url=instance.datasource_url,
+                        url=sla.get_datasource_url(self.config, instance),
                         type=instance.datasource_type,
                     ),
                     environments=[i.dict() for i in instance.environments],
@@ -0,0 +1,169 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import logging
+import math
+
+import ansible_runner
+
+from cloudmon.plugin.apimon import ApiMonManager
+
+
+class PgBouncerManager:
+    log = logging.getLogger(__name__)
+
+    def __init__(self, cloudmon_config):
+        self.config = cloudmon_config
+
+    def get_executor_jobs(self):
+        """Amount of concurrent ApiMon jobs writing into every database
+
+        Executor runs up to ``load_multiplier * CPUs`` jobs and every job
+        holds own database connection.
+
+        :returns: dict of database name to amount of jobs
+        """
+        apimon = ApiMonManager(self.config)
+        zone_jobs = dict()
+        for zone, apimon_config in apimon.apimon_configs.items():
+            try:
+                executors = apimon.get_group_hosts(
+                    apimon_config.executors_group_name
+                )
+            except RuntimeError:
+                continue
+            multipliers = apimon.get_executor_load_multipliers(
+                apimon_config, executors
+            )
+            facts = self.config.get_hosts_facts(
+                apimon_config.executors_group_name
+            )
+            zone_jobs[zone] = sum(
+                math.ceil(
+                    multipliers[host]
+                    * facts.get(host, {}).get("processor_vcpus", 1)
+                )
+                for host in executors
+            )
+        res = dict()
+        for matrix_entry in self.config.model.matrix:
+            if not matrix_entry.db_entry:
+                continue
+            db_name = matrix_entry.db_entry.split(".")[0]
+            zone = matrix_entry.monitoring_zone
+            if zone in zone_jobs:
+                res[db_name] = res.get(db_name, 0) + zone_jobs.pop(zone)
+        return res
+
+    def get_pools(self):
+        """Pool configuration of every database
+
+        :returns: dict with ``databases`` (list of name and pool_size) and
+            ``max_client_conn``
+        """
+        pgbouncer = self.config.model.database.pgbouncer
+        executor_jobs = self.get_executor_jobs()
+        databases = []
+        for db in self.config.model.database.databases:
+            jobs = executor_jobs.get(db.name, 0)
+            pool_size = max(
+                pgbouncer.min_pool_size,
+                math.ceil(jobs * pgbouncer.server_connections_ratio),
+            )
+            databases.append(
+                dict(
+                    name=db.name,
+                    pool_size=min(pool_size, pgbouncer.max_db_connections),
+                )
+            )
+            if self.config.model.database.ha_mode:
+                # Read only alias served by replicas (Grafana)
+                databases.append(
+                    dict(
+                        name=self.config.get_database_name(
+                            db.name, read_only=True
+                        ),
+                        dbname=db.name,
+                        port=self.config.model.database.replica_port,
+                        pool_size=min(
+                            max(
+                                pgbouncer.min_pool_size,
+                                math.ceil(
+                                    pgbouncer.grafana_connections
+                                    * pgbouncer.server_connections_ratio
+                                ),
+                            ),
+                            pgbouncer.max_db_connections,
+                        ),
+                    )
+                )
+        return dict(
+            databases=databases,
+            max_client_conn=(
+                sum(executor_jobs.values()) + pgbouncer.grafana_connections
+            ),
+        )
+
+    def provision(self, options):
+        db_config = self.config.model.database
+        if not db_config.pgbouncer:
+            self.log.info("PgBouncer is not configured. Skipping")
+            return
+
+        self.log.info("Provisioning PgBouncer")
+        pgbouncer = db_config.pgbouncer
+        pools = self.get_pools()
+        self.log.debug("PgBouncer pools: %s", pools)
+        extravars = copy.deepcopy(self.config.default_extravars)
+        extravars.update(
+            dict(
+                pgbouncer_group_name=pgbouncer.group_name,
+                pgbouncer_port=pgbouncer.port,
+                pgbouncer_pool_mode=pgbouncer.pool_mode,
+                pgbouncer_backend_port=5000 if db_config.ha_mode else 5432,
+                pgbouncer_databases=pools["databases"],
+                pgbouncer_max_client_conn=pools["max_client_conn"],
+                pgbouncer_max_db_connections=pgbouncer.max_db_connections,
+                pgbouncer_reserve_pool_size=pgbouncer.reserve_pool_size,
+                pgbouncer_users={
+                    user.name: user.password
+                    for db in db_config.databases
+                    for user in db.users
+                },
+            )
+        )
+        if pgbouncer.group_name != "postgres":
+            # Dedicated pooler hosts connect to the first database host,
+            # otherwise every database host is served by the local pooler
+            db_hosts = self.config.inventory.get("postgres", {}).get(
+                "hosts", []
+            )
+            if not db_hosts:
+                raise RuntimeError("No hosts in the postgres group")
+            db_host_vars = self.config.hostvars().get(db_hosts[0], {})
+            extravars["pgbouncer_backend_host"] = db_host_vars.get(
+                "internal_address",
+                db_host_vars.get("ansible_host", db_hosts[0]),
+            )
+        r = ansible_runner.run(
+            private_data_dir=self.config.private_data_dir,
+            artifact_dir=".cloudmon_artifact",
+            project_dir=self.config.project_dir.as_posix(),
+            playbook="install_pgbouncer.yaml",
+            inventory=self.config.inventory_path,
+            extravars=extravars,
+            verbosity=1,
+        )
+        if r.rc != 0:
+            raise RuntimeError("Error configuring PgBouncer")
@@ -0,0 +1,341 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+from pathlib import Path
+import re
+
+import requests
+
+
+# Grafana template variables: $var, ${var}, ${var:format} and [[var]]
+TEMPLATE_VARIABLE_RE = re.compile(r"\$\{[^}]+\}|\$\w+|\[\[[^\]]+\]\]")
+QUOTED_STRING_RE = re.compile(r"\"[^\"]*\"|'[^']*'")
+GLOB_CHARS = set("*?[{")
+# Unquoted function arguments which are not series
+KEYWORDS = {"true", "false", "none", "null", "True", "False", "None"}
+
+_LEAF = object()
+
+
+def _split_top_level(value, separators):
+    """Split string on separators outside of the curly braces"""
+    res = []
+    token = ""
+    depth = 0
+    for char in value:
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth = max(0, depth - 1)
+        if depth == 0 and char in separators:
+            res.append(token)
+            token = ""
+            continue
+        token += char
+    res.append(token)
+    return res
+
+
+def _glob_to_regex(component):
+    """Translate graphite glob of a single path component into regex"""
+    res = ""
+    pos = 0
+    while pos < len(component):
+        char = component[pos]
+        if char == "*":
+            res += ".*"
+        elif char == "?":
+            res += "."
+        elif char == "[":
+            end = component.find("]", pos)
+            if end < 0:
+                res += re.escape(char)
+            else:
+                res += component[pos:end + 1]
+                pos = end
+        elif char == "{":
+            end = component.find("}", pos)
+            if end < 0:
+                res += re.escape(char)
+            else:
+                alternatives = component[pos + 1:end].split(",")
+                res += (
+                    "(?:"
+                    + "|".join(_glob_to_regex(x) for x in alternatives)
+                    + ")"
+                )
+                pos = end
+        else:
+            res += re.escape(char)
+        pos += 1
+    return res
+
+
+def extract_series(target):
+    """Extract series path patterns of the graphite target expression
+
+    Template variables are replaced with ``*`` (all values selected), which
+    is the worst case of the query.
+
+    :param str target: Graphite target (i.e.
+        ``sumSeries(stats.timers.$env.*.mean)``)
+    :returns: list of series path patterns
+    """
+    expr = TEMPLATE_VARIABLE_RE.sub("*", target)
+    expr = QUOTED_STRING_RE.sub("", expr)
+    res = []
+    for token in _split_top_level(expr, "(), \t\n"):
+        token = token.strip()
+        if (
+            not token
+            or token in KEYWORDS
+            or token.startswith("#")
+            or "=" in token
+        ):
+            continue
+        try:
+            float(token)
+            continue
+        except ValueError:
+            pass
+        if "." in token or GLOB_CHARS.intersection(token):
+            res.append(token)
+    return res
+
+
+class MetricIndex:
+    """Tree of known metric names
+
+    Every path component is a node, therefore matching the pattern only
+    visits branches matching its leading components.
+    """
+
+    def __init__(self, names=None):
+        self.tree = dict()
+        self.size = 0
+        for name in names or []:
+            self.add(name)
+
+    def add(self, name):
+        node = self.tree
+        for component in name.split("."):
+            node = node.setdefault(component, dict())
+        if _LEAF not in node:
+            node[_LEAF] = True
+            self.size += 1
+
+    def count(self, pattern, nodes=False):
+        """Amount of metrics matching the graphite path pattern
+
+        :param bool nodes: Count all matching nodes (branches included) the
+            way ``/metrics/find`` of the template variable queries returns
+            them instead of only the series
+        """
+        components = _split_top_level(pattern, ".")
+        matchers = []
+        for component in components:
+            if GLOB_CHARS.intersection(component):
+                matchers.append(re.compile(_glob_to_regex(component) + r"\Z"))
+            else:
+                matchers.append(component)
+
+        def _count(node, depth):
+            if depth == len(matchers):
+                return 1 if nodes or _LEAF in node else 0
+            matcher = matchers[depth]
+            if isinstance(matcher, str):
+                child = node.get(matcher)
+                return _count(child, depth + 1) if child is not None else 0
+            return sum(
+                _count(child, depth + 1)
+                for name, child in node.items()
+                if name is not _LEAF and matcher.match(name)
+            )
+
+        return _count(self.tree, 0)
+
+    @classmethod
+    def from_whisper_dir(cls, path):
+        """Build index of the whisper storage directory"""
+        path = Path(path)
+        index = cls()
+        for root, _, files in os.walk(path):
+            prefix = Path(root).relative_to(path).parts
+            for name in files:
+                if name.endswith(".wsp"):
+                    index.add(".".join(prefix + (name[:-4],)))
+        return index
+
+    @classmethod
+    def from_index_json(cls, data):
+        """Build index of the graphite ``/metrics/index.json`` content"""
+        return cls(data)
+
+    @classmethod
+    def load(cls, source):
+        """Load index from whisper directory, index.json file or URL"""
+        if source.startswith("http://") or source.startswith("https://"):
+            response = requests.get(source, timeout=60)
+            if response.status_code != 200:
+                raise RuntimeError(
+                    "Error fetching metrics index %s: %s"
+                    % (source, response.text)
+                )
+            return cls.from_index_json(response.json())
+        path = Path(source)
+        if path.is_dir():
+            return cls.from_whisper_dir(path)
+        if not path.exists():
+            raise RuntimeError("Metrics index %s does not exist" % source)
+        with open(path, "r") as f:
+            return cls.from_index_json(json.load(f))
+
+
+def get_graphite_datasources(cloudmon_config):
+    """Names of the configured Graphite datasources"""
+    return {
+        x["name"]
+        for x in cloudmon_config.model.grafana.datasources
+        if x.get("type") == "graphite"
+    }
+
+
+def is_graphite_datasource(datasource, names):
+    """Whether panel or variable datasource is Graphite
+
+    :param datasource: Datasource name or ``{"type", "uid"}`` reference
+    :param names: Names of the Graphite datasources
+    """
+    # Modern dashboards reference datasources as {"type", "uid"} and the
+    # uid is assigned by Grafana, so rely on the type
+    if isinstance(datasource, dict):
+        return (
+            datasource.get("type") == "graphite"
+            or datasource.get("uid") in names
+        )
+    return datasource in names
+
+
+class QueryCost:
+    def __init__(self, dashboard, panel, target, series):
+        self.dashboard = dashboard
+        self.panel = panel
+        self.target = target
+        self.series = series
+        self.status = "ok"
+
+    def __repr__(self):
+        return (
+            "QueryCost("
+            f"dashboard: {self.dashboard}; "
+            f"panel: {self.panel}; "
+            f"target: {self.target}; "
+            f"series: {self.series}; "
+            f"status: {self.status}"
+            ")"
+        )
+
+
+class QueryLinter:
+    """Estimate cost of graphite queries of compiled dashboards
+
+    Cost of the query is the amount of series it matches in the metric
+    index. Every refresh of every viewer reads all of them.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, cloudmon_config, index):
+        self.config = cloudmon_config
+        self.index = index
+        self.graphite_datasources = get_graphite_datasources(cloudmon_config)
+
+    def _is_graphite(self, datasource):
+        return is_graphite_datasource(datasource, self.graphite_datasources)
+
+    def _iter_panels(self, panels):
+        for panel in panels:
+            yield panel
+            # Collapsed rows contain own panels
+            yield from self._iter_panels(panel.get("panels", []))
+
+    def _iter_targets(self, dashboard):
+        for variable in dashboard.get("templating", {}).get("list", []):
+            if (
+                variable.get("type") == "query"
+                and self._is_graphite(variable.get("datasource", "cloudmon"))
+                and isinstance(variable.get("query"), str)
+            ):
+                yield (f"${variable['name']}", variable["query"], True)
+        for panel in self._iter_panels(dashboard.get("panels", [])):
+            if not self._is_graphite(panel.get("datasource", "cloudmon")):
+                continue
+            for target in panel.get("targets", []):
+                if target.get("hide"):
+                    continue
+                expr = target.get("targetFull") or target.get("target")
+                if expr:
+                    yield (panel.get("title", ""), expr, False)
+
+    def lint(self, bodies):
+        """Estimate cost of every query
+
+        :param bodies: list of dashboard API request bodies
+        :returns: list of QueryCost
+        """
+        lint_config = self.config.model.grafana.lint
+        res = []
+        for body in bodies:
+            dashboard = body["dashboard"]
+            for panel, target, nodes in self._iter_targets(dashboard):
+                item = QueryCost(
+                    dashboard["uid"],
+                    panel,
+                    target,
+                    sum(
+                        self.index.count(x, nodes)
+                        for x in extract_series(target)
+                    ),
+                )
+                if item.series > lint_config.series_budget:
+                    item.status = "error"
+                elif item.series > lint_config.series_warning:
+                    item.status = "warning"
+                res.append(item)
+        return res
+
+    def check(self, bodies):
+        """Lint queries and fail when any of them is over budget"""
+        results = self.lint(bodies)
+        for item in results:
+            if item.status == "warning":
+                self.log.warning(
+                    "Query %s of %s/%s matches %d series",
+                    item.target,
+                    item.dashboard,
+                    item.panel,
+                    item.series,
+                )
+        failed = [x for x in results if x.status == "error"]
+        if failed:
+            raise RuntimeError(
+                "Queries over the series budget: %s"
+                % "; ".join(
+                    f"{x.dashboard}/{x.panel}: {x.target} ({x.series})"
+                    for x in failed
+                )
+            )
+        return results
@@ -0,0 +1,357 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import math
+from pathlib import Path
+import time
+
+from cloudmon.service.capacity import parse_duration
+from cloudmon.service import sla
+from cloudmon.service import whisperreader
+from cloudmon.service.whisperreader import numpy
+
+# Task of the epmon and apimon_executor roles reporting the image digest
+DIGEST_TASK = "Get rolled out image digest"
+
+
+class Rollout:
+    def __init__(
+        self, timestamp, component, zone, image, previous=None, digest=None
+    ):
+        self.timestamp = timestamp
+        self.component = component
+        self.zone = zone
+        self.image = image
+        self.previous = previous
+        self.digest = digest
+
+    def __repr__(self):
+        return (
+            "Rollout("
+            f"timestamp: {self.timestamp}; "
+            f"component: {self.component}; "
+            f"zone: {self.zone}; "
+            f"image: {self.image}; "
+            f"previous: {self.previous}; "
+            f"digest: {self.digest}"
+            ")"
+        )
+
+
+class RolloutJournal:
+    """Journal (JSON lines) of the image rollouts
+
+    Images usually use floating tags, so a new build may be rolled out
+    under the same image name. Provisioning records an entry when the image
+    or the digest of the pulled image changes.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def load(self):
+        """Recorded rollouts (oldest first)"""
+        res = []
+        if not self.path.exists():
+            return res
+        with open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    res.append(Rollout(**json.loads(line)))
+        return res
+
+    def find(self, component=None, zone=None):
+        return [
+            x
+            for x in self.load()
+            if (component is None or x.component == component)
+            and (zone is None or x.zone == zone)
+        ]
+
+    def record(self, component, zone, image, timestamp=None, digest=None):
+        """Record rollout of the image
+
+        :param str digest: Digest of the pulled image
+        :returns: Rollout or None when there is no image or nothing changed
+        """
+        if not image:
+            return None
+        previous = self.find(component, zone)
+        last = previous[-1] if previous else None
+        if last and last.image == image and last.digest == digest:
+            self.log.debug(
+                "Image %s of %s in %s is not changed", image, component, zone
+            )
+            return None
+        rollout = Rollout(
+            int(timestamp if timestamp is not None else time.time()),
+            component,
+            zone,
+            image,
+            last.image if last else None,
+            digest,
+        )
+        self.log.info("Recording rollout %s", rollout)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(vars(rollout)) + "\n")
+        return rollout
+
+
+def get_image_digest(runner):
+    """Digest of the rolled out image reported by the provisioning run
+
+    :param runner: ansible_runner result
+    :returns: Digest (comma separated distinct digests when hosts differ)
+        or None
+    """
+    digests = set()
+    for event in runner.events:
+        if event.get("event") != "runner_on_ok":
+            continue
+        data = event.get("event_data", {})
+        if data.get("task") != DIGEST_TASK:
+            continue
+        digest = data.get("res", {}).get("stdout", "").strip()
+        if digest and data["res"].get("rc") == 0:
+            digests.add(digest)
+    return ",".join(sorted(digests)) or None
+
+
+def get_journal(cloudmon_config):
+    """Rollout journal of the config"""
+    return RolloutJournal(cloudmon_config.model.rollouts.journal)
+
+
+def shift_test(values, groups, after, n_groups):
+    """Median shift and Mann-Whitney U test of many samples at once
+
+    Every group holds a "before" and an "after" sample. All groups are
+    ranked with a single sort, ties get average ranks.
+
+    :param values: array of the observations
+    :param groups: array of the group index of every observation
+    :param after: bool array, observation belongs to the "after" sample
+    :param int n_groups: Amount of groups
+    :returns: dict of per group arrays: ``before`` and ``after`` medians,
+        ``n_before``, ``n_after`` and ``p`` (one-sided p-value of "after"
+        being stochastically greater than "before")
+    """
+    after = after.astype(bool)
+    # Medians of every (group, sample)
+    order = numpy.lexsort((values, after, groups))
+    sample = groups[order] * 2 + after[order]
+    counts = numpy.bincount(sample, minlength=2 * n_groups)
+    starts = numpy.cumsum(counts) - counts
+    low = values[order][
+        numpy.minimum(starts + (counts - 1) // 2, len(values) - 1)
+    ]
+    high = values[order][numpy.minimum(starts + counts // 2, len(values) - 1)]
+    medians = numpy.where(counts > 0, (low + high) / 2, numpy.nan)
+    n_before = counts[0::2].astype(float)
+    n_after = counts[1::2].astype(float)
+
+    # Ranks within every group
+    order = numpy.lexsort((values, groups))
+    sorted_values = values[order]
+    sorted_groups = groups[order]
+    n = n_before + n_after
+    position = (
+        numpy.arange(len(values)) - (numpy.cumsum(n) - n)[sorted_groups] + 1
+    )
+    new_run = numpy.ones(len(values), dtype=bool)
+    new_run[1:] = (sorted_values[1:] != sorted_values[:-1]) | (
+        sorted_groups[1:] != sorted_groups[:-1]
+    )
+    run = numpy.cumsum(new_run) - 1
+    run_length = numpy.bincount(run).astype(float)
+    rank = (numpy.bincount(run, weights=position) / run_length)[run]
+    rank_after = numpy.bincount(
+        sorted_groups, weights=rank * after[order], minlength=n_groups
+    )
+    ties = numpy.bincount(
+        sorted_groups[new_run],
+        weights=run_length**3 - run_length,
+        minlength=n_groups,
+    )
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        u = rank_after - n_after * (n_after + 1) / 2
+        mean = n_after * n_before / 2
+        sigma = numpy.sqrt(
+            n_after * n_before / 12 * ((n + 1) - ties / (n * (n - 1)))
+        )
+        # Continuity correction
+        z = (u - mean - 0.5) / sigma
+    erfc = numpy.frompyfunc(math.erfc, 1, 1)
+    p = numpy.where(
+        sigma > 0,
+        0.5 * erfc(numpy.nan_to_num(z) / math.sqrt(2)).astype(float),
+        1.0,
+    )
+    return dict(
+        before=medians[0::2],
+        after=medians[1::2],
+        n_before=n_before,
+        n_after=n_after,
+        p=p,
+    )
+
+
+class SeriesShift:
+    def __init__(self, name, metric, before, after, p, regressed):
+        self.name = name
+        self.metric = metric
+        self.before = before
+        self.after = after
+        self.p = p
+        self.regressed = regressed
+
+    def __repr__(self):
+        return (
+            "SeriesShift("
+            f"name: {self.name}; "
+            f"metric: {self.metric}; "
+            f"before: {self.before}; "
+            f"after: {self.after}; "
+            f"p: {self.p}; "
+            f"regressed: {self.regressed}"
+            ")"
+        )
+
+
+def _series_key(name):
+    """Series name without the status and suffix nodes"""
+    return name.rsplit(".", 2)[0]
+
+
+def _series_status(name):
+    return name.rsplit(".", 2)[1]
+
+
+class RegressionDetector:
+    """Compare series before and after a rollout"""
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, cloudmon_config, source, step=None):
+        whisperreader._require_numpy()
+        self.config = cloudmon_config
+        self.settings = cloudmon_config.model.rollouts
+        self.source = source
+        self.step = step or cloudmon_config.model.statsd.flush_interval
+
+    def _fetch_groups(self, query, start, points):
+        """Series of the query grouped by the series key"""
+        groups = dict()
+        for name, timestamps, values in self.source.fetch_series(
+            query, start, start + points * self.step
+        ):
+            groups.setdefault(_series_key(name), []).append(
+                (name, timestamps, values)
+            )
+        return groups
+
+    def _grid(self, series, start, points, how="sum"):
+        return sla.to_grid(
+            [(x[1], x[2]) for x in series], start, self.step, points, how
+        )
+
+    def compare(self, rollout, before=None, after=None, now=None):
+        """Compare latency and error rate around the rollout
+
+        :param Rollout rollout: Rollout to check
+        :param int before: Window before the rollout (seconds)
+        :param int after: Window after the rollout (seconds)
+        :returns: list of SeriesShift
+        """
+        before = before or parse_duration(self.settings.before)
+        after = after or parse_duration(self.settings.after)
+        now = int(now if now is not None else time.time())
+        split = rollout.timestamp - rollout.timestamp % self.step
+        start = split - before
+        until = min(split + after, now)
+        points = max(1, math.ceil((until - start) / self.step))
+        split_index = (split - start) // self.step
+        fmt = dict(environment="*", zone=rollout.zone)
+
+        latency = {
+            key: self._grid(series, start, points, "average")
+            for key, series in self._fetch_groups(
+                self.settings.latency_query.format(**fmt), start, points
+            ).items()
+        }
+        errors = dict()
+        for key, series in self._fetch_groups(
+            self.settings.count_query.format(**fmt), start, points
+        ).items():
+            total = self._grid(series, start, points)
+            failed = self._grid(
+                [x for x in series if _series_status(x[0]).startswith("5")],
+                start,
+                points,
+            )
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                errors[key] = numpy.where(
+                    total > 0, numpy.nan_to_num(failed) / total, numpy.nan
+                )
+        res = self._test("latency", latency, split_index)
+        res.extend(self._test("errors", errors, split_index))
+        return res
+
+    def _test(self, metric, grids, split_index):
+        if not grids:
+            return []
+        keys = sorted(grids)
+        data = numpy.stack([grids[x] for x in keys])
+        after = numpy.zeros(data.shape, dtype=bool)
+        after[:, split_index:] = True
+        valid = ~numpy.isnan(data)
+        if not valid.any():
+            return []
+        groups = numpy.broadcast_to(
+            numpy.arange(len(keys))[:, None], data.shape
+        )[valid]
+        stats = shift_test(data[valid], groups, after[valid], len(keys))
+        if metric == "errors":
+            # Error rates are mostly zero, compare the means instead
+            before_sum = numpy.where(valid & ~after, data, 0).sum(axis=1)
+            after_sum = numpy.where(valid & after, data, 0).sum(axis=1)
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                stats["before"] = before_sum / stats["n_before"]
+                stats["after"] = after_sum / stats["n_after"]
+                shift = stats["after"] - stats["before"]
+            threshold = self.settings.min_error_shift
+        else:
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                shift = (stats["after"] - stats["before"]) / stats["before"]
+            threshold = self.settings.min_latency_shift
+        regressed = (stats["p"] < self.settings.alpha) & (shift >= threshold)
+        res = []
+        for pos, key in enumerate(keys):
+            if not stats["n_before"][pos] or not stats["n_after"][pos]:
+                continue
+            res.append(
+                SeriesShift(
+                    key,
+                    metric,
+                    float(stats["before"][pos]),
+                    float(stats["after"][pos]),
+                    float(stats["p"][pos]),
+                    bool(regressed[pos]),
+                )
+            )
+        return res
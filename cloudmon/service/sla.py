@@ -0,0 +1,422 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import math
+import os
+from pathlib import Path
+from urllib.parse import urljoin
+
+import requests
+
+from cloudmon.service import tsdb
+from cloudmon.service import whisperreader
+from cloudmon.service.whisperreader import numpy
+
+
+# Latency histogram: log spaced bins with 1% relative width between 0.1ms
+# and ~3h. Percentiles are reported with that precision.
+LATENCY_MIN = 0.1
+LATENCY_BIN_RATIO = 1.01
+LATENCY_BINS = int(math.log(1e8) / math.log(LATENCY_BIN_RATIO)) + 1
+# Graphite functions combining series of a query
+RENDER_FUNCTIONS = dict(sum="sumSeries", average="averageSeries")
+
+
+def _grid_slice(timestamps, start, step, points):
+    """Grid slice covered by a regular series, None if it is not regular
+
+    Series of graphite and whisper are sorted and have unique timestamps,
+    therefore series is regular when its span matches its length.
+    """
+    if not len(timestamps):
+        return None
+    offset = int(timestamps[0]) - start
+    first = offset // step
+    last = first + len(timestamps)
+    if (
+        offset % step
+        or int(timestamps[-1]) - int(timestamps[0])
+        != (len(timestamps) - 1) * step
+        or first < 0
+        or last > points
+    ):
+        return None
+    return slice(first, last)
+
+
+def to_grid(series, start, step, points, how="sum"):
+    """Align series onto a common time grid
+
+    :param series: list of (timestamps, values) arrays
+    :param int start: Timestamp of the first grid slot
+    :param int step: Grid step (seconds)
+    :param int points: Amount of grid slots
+    :param str how: Combine multiple series by "sum" or "average"
+    :returns: array of grid values, NaN for slots without data
+    """
+    if len(series) == 1:
+        timestamps, values = series[0]
+        slots = _grid_slice(timestamps, start, step, points)
+        if slots is not None:
+            # Already combined (i.e. by graphite): just place it
+            res = numpy.full(points, numpy.nan)
+            res[slots] = values
+            return res
+    total = numpy.zeros(points)
+    count = numpy.zeros(points)
+    for timestamps, values in series:
+        valid = ~numpy.isnan(values)
+        slots = _grid_slice(timestamps, start, step, points)
+        if slots is not None:
+            total[slots] += numpy.where(valid, values, 0)
+            count[slots] += valid
+            continue
+        index = (timestamps - start) // step
+        in_range = (index >= 0) & (index < points)
+        if not in_range.all():
+            index = index[in_range]
+            values = values[in_range]
+            valid = valid[in_range]
+        total += numpy.bincount(
+            index, weights=numpy.where(valid, values, 0), minlength=points
+        )
+        count += numpy.bincount(index, weights=valid, minlength=points)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        if how == "average":
+            return total / count
+        total[count == 0] = numpy.nan
+        return total
+
+
+def windows(values, window_points):
+    """View values as (windows, window_points) padding the tail with NaN"""
+    pad = (-len(values)) % window_points
+    if pad:
+        values = numpy.concatenate([values, numpy.full(pad, numpy.nan)])
+    return values.reshape(-1, window_points)
+
+
+def availability(success, total, window_points, success_ratio):
+    """Availability of every window
+
+    Slot is available when at least ``success_ratio`` of its requests
+    succeeded. Slots without requests are not accounted.
+
+    :returns: tuple of arrays (availability, success rate, requests) per
+        window, NaN when window has no requests
+    """
+    success = windows(success, window_points)
+    total = windows(total, window_points)
+    # Comparisons with NaN are false
+    has_data = total > 0
+    slots = numpy.count_nonzero(has_data, axis=1)
+    available = numpy.count_nonzero(
+        has_data & (success >= total * success_ratio), axis=1
+    )
+    requests = numpy.where(has_data, total, 0).sum(axis=1)
+    succeeded = numpy.where(has_data & (success > 0), success, 0).sum(axis=1)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        avail = numpy.where(slots > 0, available / slots, numpy.nan)
+        rate = numpy.where(requests > 0, succeeded / requests, numpy.nan)
+    return (avail, rate, requests)
+
+
+def latency_percentiles(values, window_points, percentiles):
+    """Latency percentiles of every window
+
+    Values are counted into a log spaced histogram per window with a single
+    ``bincount``, therefore cost is linear in the amount of points.
+
+    :returns: array of shape (windows, len(percentiles)), NaN for windows
+        without data
+    """
+    values = windows(values, window_points)
+    n_windows = values.shape[0]
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        bins = numpy.log(values / LATENCY_MIN) * (
+            1 / math.log(LATENCY_BIN_RATIO)
+        )
+    # NaN goes into the extra last bin which is not accounted
+    bins = numpy.nan_to_num(bins, nan=LATENCY_BINS, neginf=0).clip(
+        0, LATENCY_BINS
+    ).astype(numpy.int64)
+    bins += numpy.arange(n_windows)[:, None] * (LATENCY_BINS + 1)
+    hist = numpy.bincount(
+        bins.ravel(), minlength=n_windows * (LATENCY_BINS + 1)
+    ).reshape(n_windows, LATENCY_BINS + 1)[:, :-1]
+    cumulative = numpy.cumsum(hist, axis=1)
+    counts = cumulative[:, -1]
+    res = numpy.full((n_windows, len(percentiles)), numpy.nan)
+    for pos, percentile in enumerate(percentiles):
+        rank = numpy.ceil(counts * percentile / 100.0).clip(min=1)
+        bin_index = (cumulative < rank[:, None]).sum(axis=1)
+        # Geometric middle of the bin
+        value = LATENCY_MIN * LATENCY_BIN_RATIO ** (bin_index + 0.5)
+        res[:, pos] = numpy.where(counts > 0, value, numpy.nan)
+    return res
+
+
+class RenderSource:
+    """Series from the graphite render API"""
+
+    def __init__(self, url, timeout=300):
+        self.url = url
+        self.timeout = timeout
+
+    def _get(self, path, params):
+        response = requests.get(
+            urljoin(self.url + "/", path), params=params, timeout=self.timeout
+        )
+        if response.status_code != 200:
+            raise RuntimeError(
+                "Error querying %s: %s" % (response.url, response.text)
+            )
+        return response.json()
+
+    def find(self, query):
+        """Names of the nodes matching the query"""
+        return [
+            x["text"]
+            for x in self._get("metrics/find", dict(query=query))
+        ]
+
+    def fetch_series(self, target, from_time, until_time):
+        """Individual series of the render target
+
+        :returns: list of (name, timestamps, values)
+        """
+        res = []
+        data = self._get(
+            "render",
+            {
+                "target": target,
+                "from": from_time,
+                "until": until_time,
+                "format": "json",
+            },
+        )
+        for item in data:
+            # null values are converted to NaN
+            points = numpy.array(item["datapoints"], dtype=float).reshape(
+                -1, 2
+            )
+            res.append(
+                (
+                    item["target"],
+                    points[:, 1].astype(numpy.int64),
+                    points[:, 0],
+                )
+            )
+        return res
+
+    def fetch(self, query, from_time, until_time, how="sum"):
+        """Series of the query combined by graphite"""
+        return [
+            (timestamps, values)
+            for _, timestamps, values in self.fetch_series(
+                "%s(%s)" % (RENDER_FUNCTIONS[how], query),
+                from_time,
+                until_time,
+            )
+        ]
+
+
+class WhisperSource:
+    """Series from a local whisper directory"""
+
+    def __init__(self, data_dir, workers=None, now=None):
+        self.data_dir = Path(data_dir)
+        self.reader = whisperreader.WhisperReader(data_dir, workers)
+        self.now = now
+
+    def find(self, query):
+        return sorted(
+            {
+                x.name[:-4] if x.name.endswith(".wsp") else x.name
+                for x in self.data_dir.glob(query.replace(".", "/"))
+            }
+        )
+
+    def fetch_series(self, query, from_time, until_time):
+        """Individual series of the query
+
+        :returns: list of (name, timestamps, values)
+        """
+        return self.reader.read(query, from_time, until_time, self.now)
+
+    def fetch(self, query, from_time, until_time, how="sum"):
+        """Series of the query, combined later by ``to_grid``"""
+        return [
+            (timestamps, values)
+            for _, timestamps, values in self.fetch_series(
+                query, from_time, until_time
+            )
+        ]
+
+
+def get_source(source):
+    """Series source for URL or whisper directory"""
+    if source.startswith("http://") or source.startswith("https://"):
+        return RenderSource(source)
+    if not Path(source).is_dir():
+        raise RuntimeError("Whisper directory %s does not exist" % source)
+    return WhisperSource(source)
+
+
+def get_metrics_processor(cloudmon_config, name=None):
+    """Metrics processor instance by name (first one by default)"""
+    for instance in cloudmon_config.model.metrics_processor:
+        if name is None or instance.name == name:
+            return instance
+    if name is None:
+        raise RuntimeError("No metrics processor instances configured")
+    raise RuntimeError(
+        "Metrics processor instance %s is not configured" % name
+    )
+
+
+def get_datasource_url(cloudmon_config, instance):
+    """Query URL of the metrics processor instance
+
+    Falls back to the query endpoint of the configured TSDB backend.
+    """
+    if instance.datasource_url:
+        return instance.datasource_url
+    return tsdb.get_backend(cloudmon_config).get_query_url()
+
+
+class SlaResult:
+    def __init__(self, environment, service, start, percentiles):
+        self.environment = environment
+        self.service = service
+        self.start = start
+        self.availability = None
+        self.success_rate = None
+        self.requests = 0
+        self.latency = dict.fromkeys(percentiles)
+
+    def __repr__(self):
+        return (
+            "SlaResult("
+            f"environment: {self.environment}; "
+            f"service: {self.service}; "
+            f"start: {self.start}; "
+            f"availability: {self.availability}; "
+            f"success_rate: {self.success_rate}; "
+            f"requests: {self.requests}; "
+            f"latency: {self.latency}"
+            ")"
+        )
+
+
+class SlaCalculator:
+    """Availability and latency of the Status Dashboard environments
+
+    Environments are taken from the metrics processor instance, series are
+    queried with the ``sla`` templates of the instance. Services are
+    computed in parallel, every service is processed with vectorized
+    operations over the whole range.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(
+        self, cloudmon_config, instance, source, step=None, workers=None
+    ):
+        whisperreader._require_numpy()
+        self.config = cloudmon_config
+        self.instance = instance
+        self.source = source
+        self.step = step or cloudmon_config.model.statsd.flush_interval
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 2)
+
+    def get_services(self, environment):
+        sla = self.instance.sla
+        if sla.services:
+            return sla.services
+        return self.source.find(
+            sla.service_query.format(environment=environment)
+        )
+
+    def _grid(self, query, start, points, how):
+        return to_grid(
+            self.source.fetch(query, start, start + points * self.step, how),
+            start,
+            self.step,
+            points,
+            how,
+        )
+
+    def _compute_service(self, environment, service, start, points, window):
+        sla = self.instance.sla
+        fmt = dict(environment=environment, service=service)
+        self.log.debug("Computing SLA of %s/%s", environment, service)
+        avail, rate, requests = availability(
+            self._grid(sla.success_query.format(**fmt), start, points, "sum"),
+            self._grid(sla.total_query.format(**fmt), start, points, "sum"),
+            window,
+            sla.success_ratio,
+        )
+        latency = latency_percentiles(
+            self._grid(
+                sla.latency_query.format(**fmt), start, points, "average"
+            ),
+            window,
+            sla.percentiles,
+        )
+        res = []
+        for index in range(len(avail)):
+            item = SlaResult(
+                environment,
+                service,
+                start + index * window * self.step,
+                sla.percentiles,
+            )
+            if not numpy.isnan(avail[index]):
+                item.availability = float(avail[index])
+            if not numpy.isnan(rate[index]):
+                item.success_rate = float(rate[index])
+            item.requests = int(requests[index])
+            for pos, percentile in enumerate(sla.percentiles):
+                if not numpy.isnan(latency[index, pos]):
+                    item.latency[percentile] = float(latency[index, pos])
+            res.append(item)
+        return res
+
+    def compute(self, from_time, until_time, window):
+        """Compute availability and latency per window
+
+        :param int from_time: Start of the range (epoch)
+        :param int until_time: End of the range (epoch)
+        :param int window: Window length (seconds)
+        :returns: list of SlaResult
+        """
+        start = from_time - from_time % self.step
+        points = max(1, math.ceil((until_time - start) / self.step))
+        window_points = max(1, window // self.step)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(
+                    self._compute_service,
+                    env.name,
+                    service,
+                    start,
+                    points,
+                    window_points,
+                )
+                for env in self.instance.environments
+                for service in self.get_services(env.name)
+            ]
+            return [item for x in futures for item in x.result()]
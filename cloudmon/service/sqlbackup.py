@@ -0,0 +1,240 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import logging
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import time
+
+
+class BackupResult:
+    def __init__(self, database, operation, path, jobs):
+        self.database = database
+        self.operation = operation
+        self.path = path
+        self.jobs = jobs
+        self.size = 0
+        self.duration = 0.0
+        self.error = None
+
+    def __repr__(self):
+        return (
+            "BackupResult("
+            f"database: {self.database}; "
+            f"operation: {self.operation}; "
+            f"path: {self.path}; "
+            f"jobs: {self.jobs}; "
+            f"size: {self.size}; "
+            f"duration: {self.duration}; "
+            f"error: {self.error}"
+            ")"
+        )
+
+    @property
+    def status(self):
+        return "failed" if self.error else "ok"
+
+
+def _dir_size(path):
+    return sum(
+        x.stat().st_size for x in Path(path).glob("**/*") if x.is_file()
+    )
+
+
+class PostgreSQLBackupManager:
+    """Dump and restore databases with parallel pg_dump/pg_restore
+
+    Directory format is used, which allows dumping and restoring tables of
+    a single database with multiple jobs. Several databases are processed
+    concurrently. Jobs are distributed between concurrently processed
+    databases and are bound by the CPUs of the database host and of the
+    local host.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, cloudmon_config):
+        self.config = cloudmon_config
+
+    def get_jobs(self, parallel_databases):
+        """Amount of pg_dump/pg_restore jobs of every database"""
+        backup = self.config.model.database.backup
+        if backup.jobs:
+            return backup.jobs
+        cpus = os.cpu_count() or 1
+        facts = self.config.get_hosts_facts("postgres")
+        if facts:
+            cpus = min(
+                cpus, min(x["processor_vcpus"] for x in facts.values())
+            )
+        return max(1, cpus // max(1, parallel_databases))
+
+    def get_connection_env(self):
+        """Environment for libpq connection as postgres user
+
+        PgBouncer is bypassed since parallel dumps rely on the synchronized
+        snapshots which are not supported by transaction pooling.
+        """
+        db_config = self.config.model.database
+        db_hosts = self.config.inventory.get("postgres", {}).get("hosts", [])
+        if not db_hosts:
+            raise RuntimeError("No hosts in the postgres group")
+        host_vars = self.config.hostvars().get(db_hosts[0], {})
+        env = dict(os.environ)
+        env.update(
+            PGHOST=host_vars.get(
+                "internal_address",
+                host_vars.get("ansible_host", db_hosts[0]),
+            ),
+            PGPORT=str(5000 if db_config.ha_mode else 5432),
+            PGUSER="postgres",
+            PGPASSWORD=db_config.postgres_postgres_password,
+        )
+        return env
+
+    def _get_databases(self, names=None):
+        databases = [x.name for x in self.config.model.database.databases]
+        if names:
+            unknown = set(names) - set(databases)
+            if unknown:
+                raise RuntimeError(
+                    "Databases %s are not configured" % ", ".join(unknown)
+                )
+            databases = [x for x in databases if x in names]
+        return databases
+
+    def _run(self, result, cmd, env):
+        self.log.info(
+            "Starting %s of %s with %d jobs",
+            result.operation,
+            result.database,
+            result.jobs,
+        )
+        start = time.monotonic()
+        proc = subprocess.run(
+            cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        result.duration = time.monotonic() - start
+        if proc.returncode != 0:
+            result.error = proc.stderr.decode(errors="replace").strip()
+            self.log.error(
+                "%s of %s failed: %s",
+                result.operation,
+                result.database,
+                result.error,
+            )
+        else:
+            result.size = _dir_size(result.path)
+            self.log.info(
+                "Finished %s of %s in %.1fs",
+                result.operation,
+                result.database,
+                result.duration,
+            )
+        return result
+
+    def _execute(self, tasks, parallel_databases):
+        with ThreadPoolExecutor(max_workers=parallel_databases) as executor:
+            futures = [executor.submit(self._run, *task) for task in tasks]
+            return [x.result() for x in futures]
+
+    def backup(self, target=None, databases=None):
+        """Dump databases into the "<target>/<timestamp>/<db>" directories
+
+        :param str target: Target directory (``database.backup.target_dir``
+            by default)
+        :param list databases: Names of databases to dump (all by default)
+        :returns: list of BackupResult
+        """
+        if not shutil.which("pg_dump"):
+            raise RuntimeError("pg_dump is not installed")
+        backup = self.config.model.database.backup
+        databases = self._get_databases(databases)
+        parallel = min(backup.parallel_databases, len(databases)) or 1
+        jobs = self.get_jobs(parallel)
+        env = self.get_connection_env()
+        backup_dir = Path(
+            target or backup.target_dir,
+            datetime.datetime.now().strftime("%Y%m%dT%H%M%S"),
+        )
+        backup_dir.mkdir(parents=True, exist_ok=True)
+        tasks = []
+        for db_name in databases:
+            path = Path(backup_dir, db_name)
+            cmd = [
+                "pg_dump",
+                "--format=directory",
+                f"--jobs={jobs}",
+                f"--compress={backup.compression}",
+                f"--file={path.as_posix()}",
+                f"--dbname={db_name}",
+            ]
+            tasks.append(
+                (BackupResult(db_name, "backup", path, jobs), cmd, env)
+            )
+        return self._execute(tasks, parallel)
+
+    def restore(self, source, databases=None):
+        """Restore databases from the "<source>/<db>" directories
+
+        Existing objects are dropped before being recreated.
+
+        :param str source: Directory of a single backup
+        :param list databases: Names of databases to restore (all found in
+            the source by default)
+        :returns: list of BackupResult
+        """
+        if not shutil.which("pg_restore"):
+            raise RuntimeError("pg_restore is not installed")
+        source = Path(source)
+        if not source.is_dir():
+            raise RuntimeError("Backup directory %s does not exist" % source)
+        backup = self.config.model.database.backup
+        databases = [
+            x
+            for x in self._get_databases(databases)
+            if Path(source, x, "toc.dat").exists()
+        ]
+        if not databases:
+            raise RuntimeError("No database dumps found in %s" % source)
+        parallel = min(backup.parallel_databases, len(databases))
+        jobs = self.get_jobs(parallel)
+        env = self.get_connection_env()
+        tasks = []
+        for db_name in databases:
+            path = Path(source, db_name)
+            cmd = [
+                "pg_restore",
+                "--format=directory",
+                f"--jobs={jobs}",
+                "--clean",
+                "--if-exists",
+                "--no-owner",
+                f"--role={self._get_owner(db_name)}",
+                f"--dbname={db_name}",
+                path.as_posix(),
+            ]
+            tasks.append(
+                (BackupResult(db_name, "restore", path, jobs), cmd, env)
+            )
+        return self._execute(tasks, parallel)
+
+    def _get_owner(self, db_name):
+        for db in self.config.model.database.databases:
+            if db.name == db_name and db.users:
+                return db.users[0].name
+        return "postgres"
@@ -13,16 +13,157 @@
 
 import copy
 import logging
+import math
 
 import ansible_runner
 
 
+POSTGRES_DATA_PATH = "/var/lib/postgresql"
+# Parameters which Patroni requires to be equal on all cluster members
+CLUSTER_PARAMETERS = (
+    "max_connections",
+    "max_worker_processes",
+)
+DEFAULT_MAX_CONNECTIONS = 200
+DEFAULT_MAX_WAL_SIZE_MB = 4096
+MB = 1024 * 1024
+
+
+def format_size(size_mb):
+    """Format size in megabytes as PostgreSQL memory unit"""
+    size_mb = int(size_mb)
+    if size_mb >= 1024 and size_mb % 1024 == 0:
+        return "%dGB" % (size_mb // 1024)
+    return "%dMB" % size_mb
+
+
 class PostgreSQLManager:
     log = logging.getLogger(__name__)
 
     def __init__(self, cloudmon_config):
         self.config = cloudmon_config
 
+    def _get_data_mount(self, mounts):
+        """Mount holding PostgreSQL data"""
+        res = None
+        mount_len = -1
+        for mount in mounts:
+            path = mount.get("mount", "")
+            if (
+                POSTGRES_DATA_PATH.startswith(path)
+                and len(path) > mount_len
+            ):
+                res = mount
+                mount_len = len(path)
+        return res
+
+    def get_host_parameters(self, facts, host_vars=None):
+        """PostgreSQL parameters derived from the host hardware
+
+        Memory settings follow the usual recommendations (1/4 of RAM for
+        shared buffers, 3/4 as OS cache, work_mem sized so that every
+        connection may run few sorts in parallel), parallel workers and
+        autovacuum workers scale with CPUs and WAL size is bound by the
+        size of the data volume. Random page cost assumes SSD unless
+        ``cloudmon_disk_type`` host variable is ``hdd``.
+
+        :param dict facts: host facts (see CloudMonConfig.get_hosts_facts)
+        :param dict host_vars: host variables
+        :returns: dict of PostgreSQL parameters
+        """
+        host_vars = host_vars or {}
+        overrides = self.config.model.database.parameters
+        memory_mb = facts["memtotal_mb"]
+        vcpus = max(1, facts["processor_vcpus"])
+        max_connections = int(
+            overrides.get("max_connections", DEFAULT_MAX_CONNECTIONS)
+        )
+        shared_buffers = memory_mb // 4
+        parallel_per_gather = min(4, math.ceil(vcpus / 2))
+        work_mem = (memory_mb - shared_buffers) / (
+            max_connections * 3 * parallel_per_gather
+        )
+        max_wal_size = DEFAULT_MAX_WAL_SIZE_MB
+        mount = self._get_data_mount(facts.get("mounts", []))
+        if mount and mount.get("size_total"):
+            max_wal_size = min(
+                16384, max(1024, mount["size_total"] // MB // 10)
+            )
+        autovacuum_workers = min(8, max(3, vcpus // 2))
+        hdd = host_vars.get("cloudmon_disk_type") == "hdd"
+
+        res = dict(
+            max_connections=max_connections,
+            shared_buffers=format_size(shared_buffers),
+            effective_cache_size=format_size(memory_mb * 3 // 4),
+            maintenance_work_mem=format_size(min(2048, memory_mb // 16)),
+            work_mem="%dkB" % max(64, int(work_mem * 1024)),
+            wal_buffers="16MB",
+            min_wal_size=format_size(min(1024, max_wal_size // 4)),
+            max_wal_size=format_size(max_wal_size),
+            checkpoint_completion_target=0.9,
+            random_page_cost=4 if hdd else 1.1,
+            effective_io_concurrency=2 if hdd else 200,
+            max_worker_processes=max(8, vcpus),
+            max_parallel_workers=vcpus,
+            max_parallel_workers_per_gather=parallel_per_gather,
+            max_parallel_maintenance_workers=parallel_per_gather,
+            autovacuum_max_workers=autovacuum_workers,
+            # cost limit is shared by all workers
+            autovacuum_vacuum_cost_limit=200 * autovacuum_workers,
+            autovacuum_naptime="30s",
+            autovacuum_vacuum_scale_factor=0.05,
+            autovacuum_analyze_scale_factor=0.02,
+            # result tables are insert only
+            autovacuum_vacuum_insert_scale_factor=0.05,
+        )
+        res.update(overrides)
+        return res
+
+    def get_tuning_vars(self):
+        """PostgreSQL parameters of every database host
+
+        Tuning is best effort: hosts without facts keep the role defaults.
+
+        :returns: dict of host name to dict of parameters
+        """
+        res = dict()
+        try:
+            hosts_facts = self.config.get_hosts_facts("postgres")
+        except RuntimeError as ex:
+            self.log.warning("%s, gathering facts per host", ex)
+            hosts_facts = dict()
+            for host in self.config.inventory.get("postgres", {}).get(
+                "hosts", []
+            ):
+                try:
+                    hosts_facts.update(
+                        self.config.get_hosts_facts("postgres", [host])
+                    )
+                except RuntimeError as ex:
+                    self.log.warning(
+                        "%s, PostgreSQL tuning is not applied", ex
+                    )
+        for host, facts in hosts_facts.items():
+            res[host] = self.get_host_parameters(
+                facts, self.config.hostvars().get(host, {})
+            )
+        return res
+
+    def get_cluster_parameters(self, host_parameters):
+        """Parameters which must be same on all Patroni cluster members
+
+        Smallest value of all hosts is used.
+        """
+        res = dict()
+        for name in CLUSTER_PARAMETERS:
+            values = [
+                x[name] for x in host_parameters.values() if name in x
+            ]
+            if values:
+                res[name] = min(values)
+        return res
+
     def provision(self, options):
         self.log.info("Provisioning PostgreSQL")
 
@@ -39,6 +180,15 @@ class PostgreSQLManager:
             )
         )
         extravars.update(cloudmon_config.model.database.dict())
+        host_parameters = self.get_tuning_vars()
+        extravars["postgres_host_parameters"] = host_parameters
+        if self.config.model.database.ha_mode:
+            extravars["postgres_cluster_parameters"] = (
+                self.get_cluster_parameters(host_parameters)
+            )
+            extravars["postgres_replica_port"] = (
+                self.config.model.database.replica_port
+            )
         r = ansible_runner.run(
             private_data_dir=cloudmon_config.private_data_dir,
             artifact_dir=".cloudmon_artifact",
@@ -104,6 +254,39 @@ class PostgreSQLManager:
         if r.rc != 0:
             raise RuntimeError("Error Configuring PostgreSQL databases")
 
+    def manage_schema(self, options):
+        """Manage partitioning, indexes and rollups of the databases"""
+        self.log.info("Managing PostgreSQL databases schema")
+
+        db_config = self.config.model.database
+        databases = [
+            x.model_dump() for x in db_config.databases if x.partitioning
+        ]
+        if not databases:
+            self.log.info("No databases with partitioning configured")
+            return
+
+        extravars = copy.deepcopy(self.config.default_extravars)
+        extravars.update(
+            dict(
+                postgresql_group_name="postgres",
+                databases=databases,
+            )
+        )
+
+        r = ansible_runner.run(
+            private_data_dir=self.config.private_data_dir,
+            artifact_dir=".cloudmon_artifact",
+            project_dir=self.config.project_dir.as_posix(),
+            playbook="manage_db_schema.yaml",
+            inventory=self.config.inventory_path,
+            extravars=extravars,
+            verbosity=1,
+        )
+
+        if r.rc != 0:
+            raise RuntimeError("Error Managing PostgreSQL databases schema")
+
     def stop(self, options):
         self.log.info("Stopping PostgreSQL")
         r = ansible_runner.run(
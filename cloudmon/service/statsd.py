@@ -15,6 +15,8 @@ import logging
 
 import ansible_runner
 
+from cloudmon.service import tsdb
+
 
 class StatsdManager:
     log = logging.getLogger(__name__)
@@ -29,7 +31,9 @@ class StatsdManager:
         ) in self.config.model.monitoring_zones.items():
             statsd_group_name = zone_data.statsd_group_name
 
-            graphite_address = self.config.get_graphite_zone_address(zone_name)
+            endpoint = tsdb.get_backend(self.config).get_ingest_endpoint(
+                zone_name
+            )
 
             self.log.info(
                 "Provisioning StatsD on %s in zone: %s",
@@ -38,14 +42,20 @@ class StatsdManager:
             )
             extravars = dict(
                 statsd_hosts=statsd_group_name,
-                statsd_graphite_host=graphite_address,
-                statsd_graphite_port=2003,
-                # NOTE(gtema): for now we stick to push data into the relay
-                statsd_graphite_port_pickle=2014,
-                statsd_graphite_protocol="pickle",
+                statsd_graphite_host=endpoint.host,
+                statsd_graphite_protocol=endpoint.protocol,
                 statsd_legacy_namespace=False,
                 statsd_server="./servers/udp",
+                statsd_flush_interval=self.config.model.statsd.flush_interval,
             )
+            # Only the port of the used protocol matters
+            if endpoint.protocol == "pickle":
+                extravars.update(
+                    statsd_graphite_port=2003,
+                    statsd_graphite_port_pickle=endpoint.port,
+                )
+            else:
+                extravars.update(statsd_graphite_port=endpoint.port)
             r = ansible_runner.run(
                 private_data_dir=self.config.private_data_dir,
                 artifact_dir=".cloudmon_artifact",
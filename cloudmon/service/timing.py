@@ -0,0 +1,208 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from cloudmon.service.capacity import CapacityPlanner
+from cloudmon.service.capacity import GB
+from cloudmon.service.capacity import parse_retentions
+from cloudmon.service.capacity import whisper_file_size
+from cloudmon.types import TimingModel
+
+
+# Typical time range of the dashboards (seconds)
+DEFAULT_QUERY_RANGE = 6 * 3600
+
+
+def get_model_timing(model):
+    """Timing profile formed by the individual config settings"""
+    return TimingModel(
+        flush_interval=model.statsd.flush_interval,
+        retentions=model.graphite.retentions_stats,
+        x_files_factor=model.graphite.x_files_factor,
+        min_refresh_interval=(
+            model.grafana.min_refresh_interval
+            if model.grafana
+            else TimingModel().min_refresh_interval
+        ),
+        epmon_probe_interval=model.capacity.epmon_probe_interval,
+        globalmon_probe_interval=model.capacity.globalmon_probe_interval,
+    )
+
+
+def complete_timing(baseline, timing):
+    """Timing profile with unset settings taken from the baseline
+
+    Settings not mentioned in the profile keep their individual values
+    instead of being reset to the profile defaults.
+    """
+    return baseline.model_copy(
+        update={x: getattr(timing, x) for x in timing.model_fields_set}
+    )
+
+
+def apply_timing(model, timing):
+    """Propagate timing profile into the individual config settings"""
+    model.statsd.flush_interval = timing.flush_interval
+    model.graphite.retentions_stats = timing.retentions
+    model.graphite.x_files_factor = timing.x_files_factor
+    if model.grafana:
+        model.grafana.min_refresh_interval = timing.min_refresh_interval
+    model.capacity.epmon_probe_interval = timing.epmon_probe_interval
+    model.capacity.globalmon_probe_interval = timing.globalmon_probe_interval
+
+
+def validate_timing(timing):
+    """Validate combination of the timing profile settings
+
+    :returns: tuple of (list of errors, list of warnings)
+    """
+    errors = []
+    warnings = []
+    flush = timing.flush_interval
+    try:
+        archives = parse_retentions(timing.retentions)
+    except ValueError as ex:
+        return ([str(ex)], warnings)
+
+    precision = archives[0][0]
+    if precision < flush:
+        errors.append(
+            "Retention precision %ds is finer than the flush interval %ds, "
+            "%d%% of the points stay empty"
+            % (precision, flush, 100 - 100 * precision // flush)
+        )
+    elif precision % flush:
+        errors.append(
+            "Retention precision %ds is not a multiple of the flush "
+            "interval %ds" % (precision, flush)
+        )
+    for (prev_precision, prev_points), (cur_precision, cur_points) in zip(
+        archives, archives[1:]
+    ):
+        if cur_precision % prev_precision:
+            errors.append(
+                "Retention precision %ds is not a multiple of the previous "
+                "precision %ds" % (cur_precision, prev_precision)
+            )
+        if cur_precision * cur_points <= prev_precision * prev_points:
+            errors.append(
+                "Retention of the %ds archive does not exceed the retention "
+                "of the %ds archive" % (cur_precision, prev_precision)
+            )
+    if timing.min_refresh_interval < flush:
+        errors.append(
+            "Minimal refresh interval %ds is shorter than the flush "
+            "interval %ds" % (timing.min_refresh_interval, flush)
+        )
+
+    for name in ("epmon", "globalmon"):
+        interval = getattr(timing, f"{name}_probe_interval")
+        if interval < flush or interval % flush:
+            warnings.append(
+                "%s probe interval %ds is not a multiple of the flush "
+                "interval %ds" % (name, interval, flush)
+            )
+        # Share of the first archive points filled by a probe
+        filled = min(1.0, precision / interval)
+        if timing.x_files_factor > filled:
+            warnings.append(
+                "xFilesFactor %s is above the share of filled points (%.2f) "
+                "of %s series, their rollups stay empty"
+                % (timing.x_files_factor, filled, name)
+            )
+    return (errors, warnings)
+
+
+def estimate_timing(timing, series, query_range=DEFAULT_QUERY_RANGE):
+    """Estimate storage and query volume of the timing profile
+
+    Graphite answers a query from the finest archive covering its time
+    range. Every viewer re-reads the whole range on every refresh.
+
+    :param TimingModel timing: Timing profile
+    :param int series: Amount of series produced by StatsD
+    :param int query_range: Dashboard time range (seconds)
+    :returns: dict of estimations
+    """
+    archives = parse_retentions(timing.retentions)
+    precision = archives[-1][0]
+    for archive_precision, points in archives:
+        if archive_precision * points >= query_range:
+            precision = archive_precision
+            break
+    points_per_query = query_range // precision
+    refreshes = 3600 / max(timing.min_refresh_interval, timing.flush_interval)
+    file_size = whisper_file_size(timing.retentions)
+    return dict(
+        file_size=file_size,
+        disk_bytes=file_size * series,
+        filled_ratio=min(1.0, archives[0][0] / timing.flush_interval),
+        datapoints=series / timing.flush_interval,
+        points_per_query=points_per_query,
+        refreshes=refreshes,
+        points_read=points_per_query * refreshes,
+    )
+
+
+class TimingManager:
+    """Compare configured timing profile with the individual settings"""
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, cloudmon_config):
+        self.config = cloudmon_config
+
+    def get_series(self):
+        """Amount of stored StatsD series (all replicas)"""
+        planner = CapacityPlanner(self.config)
+        return int(
+            sum(planner.zone_series.values())
+            * self.config.model.graphite.replication_factor
+        )
+
+    def report(self, query_range=DEFAULT_QUERY_RANGE):
+        """Savings of the timing profile
+
+        :returns: list of (metric, current, profile, savings %) tuples
+        """
+        current = self.config.timing_baseline
+        profile = self.config.model.timing or current
+        series = self.get_series()
+        before = estimate_timing(current, series, query_range)
+        after = estimate_timing(profile, series, query_range)
+        rows = [
+            ("Whisper file size (KB)", "file_size", 1 / 1024),
+            ("Disk (GB)", "disk_bytes", 1 / GB),
+            ("Filled points (%)", "filled_ratio", 100),
+            ("Datapoints written/s", "datapoints", 1),
+            ("Points per query", "points_per_query", 1),
+            ("Refreshes per viewer hour", "refreshes", 1),
+            ("Points read per series per viewer hour", "points_read", 1),
+        ]
+        res = []
+        for title, key, factor in rows:
+            savings = None
+            if key != "filled_ratio" and before[key]:
+                savings = round(
+                    100 * (before[key] - after[key]) / before[key], 1
+                )
+            res.append(
+                (
+                    title,
+                    round(before[key] * factor, 2),
+                    round(after[key] * factor, 2),
+                    savings,
+                )
+            )
+        return res
@@ -12,21 +12,136 @@
 # limitations under the License.
 
 import copy
+import json
 import logging
+import math
+from pathlib import Path
 
 import ansible_runner
 
+from cloudmon.service import aggregation
+from cloudmon.service.capacity import CapacityPlanner
+from cloudmon.service.capacity import parse_retentions
+from cloudmon.service import grafana
+
+
+# Approximate memory consumed by a single datapoint in the carbon cache
+CACHE_POINT_BYTES = 64
+# Values used by the role when no tuning is applied
+DEFAULT_CACHE_MAX_SIZE = 1000000
+DEFAULT_CARBON_MAX_UPDATES_PER_SECOND = 500
+GRAPHITE_STORAGE_PATH = "/opt/graphite/storage"
+
+
+class MaintenanceResult:
+    def __init__(self, host, summary):
+        self.host = host
+        self.files = summary.get("files", 0)
+        self.stale = summary.get("stale", 0)
+        self.stale_bytes = summary.get("stale_bytes", 0)
+        self.resized = summary.get("resized", 0)
+        self.resized_bytes = summary.get("resized_bytes", 0)
+        self.errors = summary.get("errors", [])
+        self.dry_run = summary.get("dry_run", True)
+
+    def __repr__(self):
+        return (
+            "MaintenanceResult("
+            f"host: {self.host}; "
+            f"files: {self.files}; "
+            f"stale: {self.stale}; "
+            f"stale_bytes: {self.stale_bytes}; "
+            f"resized: {self.resized}; "
+            f"resized_bytes: {self.resized_bytes}; "
+            f"errors: {len(self.errors)}"
+            ")"
+        )
+
+    @property
+    def reclaimed_bytes(self):
+        """Space freed by pruning and resizing (negative when growing)"""
+        return self.stale_bytes + self.resized_bytes
+
+
+class TsdbEndpoint:
+    def __init__(self, host, port, protocol):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+
+    def __repr__(self):
+        return (
+            "TsdbEndpoint("
+            f"host: {self.host}; "
+            f"port: {self.port}; "
+            f"protocol: {self.protocol}"
+            ")"
+        )
+
+
+class TsdbBackend:
+    """Time series database backend
+
+    Backend provisions the storage and tells StatsD where to push the series
+    (ingest endpoint) and Grafana and Metrics Processor where to query them
+    (Graphite render API compatible query endpoint).
+    """
 
-class GraphiteManager:
     log = logging.getLogger(__name__)
+    group_name = "graphite"
 
     def __init__(self, cloudmon_config):
         self.config = cloudmon_config
 
+    def provision(self, options):
+        raise NotImplementedError
+
+    def get_ingest_endpoint(self, zone):
+        """Endpoint StatsD of the monitoring zone pushes series into
+
+        :returns: TsdbEndpoint
+        """
+        raise NotImplementedError
+
+    def get_query_url(self, port=None):
+        """URL of the Graphite render API"""
+        raise NotImplementedError
+
+    def get_query_address(self):
+        """Address of the first backend host"""
+        host = self.config.inventory[self.group_name]["hosts"][0]
+        host_vars = self.config.hostvars(host)
+        # internal_address or ansible_host or hostname
+        return host_vars.get(
+            "internal_address", host_vars.get("ansible_host", host)
+        )
+
+
+class GraphiteManager(TsdbBackend):
     def provision(self, options):
         self.log.info("Provisioning Graphite")
         extravars = copy.deepcopy(self.config.default_extravars)
-        extravars.update(dict(graphite_group_name="graphite"))
+        graphite_config = self.config.model.graphite
+        extravars.update(
+            dict(
+                graphite_group_name="graphite",
+                graphite_retentions_carbon=graphite_config.retentions_carbon,
+                graphite_retentions_stats=graphite_config.retentions_stats,
+                graphite_retentions_default=(
+                    graphite_config.retentions_default
+                ),
+                graphite_x_files_factor=graphite_config.x_files_factor,
+                statsd_flush_interval=self.config.model.statsd.flush_interval,
+            )
+        )
+        extravars.update(self.get_carbonapi_cache_vars())
+        extravars.update(graphite_tuning=self.get_tuning_vars())
+        if graphite_config.aggregation.enabled:
+            extravars.update(
+                graphite_aggregator=True,
+                graphite_aggregation_prefix=graphite_config.aggregation.prefix,
+                graphite_aggregation_rules=self.get_aggregation_rules(),
+            )
         r = ansible_runner.run(
             private_data_dir=self.config.private_data_dir,
             artifact_dir=".cloudmon_artifact",
@@ -38,3 +153,340 @@ class GraphiteManager:
         )
         if r.rc != 0:
             raise RuntimeError("Error configuring Graphite")
+
+    def get_aggregation_rules(self):
+        """carbon-aggregator rules of every graphite host
+
+        Every monitoring zone runs own carbon-aggregator and stores the
+        aggregates in own storage. Zone is part of every output series, so
+        zones do not overwrite aggregates of each other and queries combine
+        them. Dashboards are checked out and compiled the same way as by
+        Grafana provisioning, so the rewritten dashboard queries find their
+        pre-aggregated series.
+
+        :returns: dict of host name to list of rules
+        """
+        bodies = []
+        if (
+            self.config.model.graphite.aggregation.dashboards
+            and self.config.model.grafana
+        ):
+            manager = grafana.GrafanaManager(self.config, None, None)
+            bodies = manager.compile_dashboards(manager.prepare_dashboards())
+        res = dict()
+        for zone_name, zone in self.config.model.monitoring_zones.items():
+            rules = [
+                str(x)
+                for x in aggregation.get_rules(self.config, bodies, zone_name)
+            ]
+            for host in self.config.inventory.get(
+                zone.graphite_group_name, {}
+            ).get("hosts", []):
+                res[host] = rules
+        return res
+
+    def get_ingest_endpoint(self, zone):
+        if self.config.model.graphite.aggregation.enabled:
+            # carbon-aggregator of the zone forwards all received series
+            port = 2024
+        else:
+            # NOTE(gtema): for now we stick to push data into the relay
+            port = 2014
+        return TsdbEndpoint(
+            self.config.get_graphite_zone_address(zone), port, "pickle"
+        )
+
+    def get_query_url(self, port=None):
+        # graphite-web is served by nginx on the default port
+        url = f"http://{self.get_query_address()}"
+        if port:
+            url += f":{port}"
+        return url
+
+    def get_carbonapi_cache_vars(self):
+        """Carbonapi query cache settings
+
+        Cached render results are only valid until StatsD flushes the next
+        datapoint, therefore cache TTL is derived from the flush interval.
+        When memcached hosts are present in the inventory they are used as a
+        shared cache for all carbonapi instances.
+        """
+        cache_config = self.config.model.cache
+        res = dict(
+            carbonapi_cache_timeout=(
+                self.config.model.statsd.flush_interval
+                * cache_config.timeout_flush_intervals
+            )
+        )
+        memcached_servers = self.config.get_memcached_servers()
+        if memcached_servers:
+            res.update(
+                carbonapi_cache_type="memcache",
+                carbonapi_memcache_hosts=memcached_servers,
+            )
+        return res
+
+    def _get_available_disk(self, mounts):
+        """Available space of the mount holding whisper files"""
+        res = None
+        mount_len = -1
+        for mount in mounts:
+            path = mount.get("mount", "")
+            if (
+                GRAPHITE_STORAGE_PATH.startswith(path)
+                and len(path) > mount_len
+            ):
+                res = mount.get("size_available")
+                mount_len = len(path)
+        return res
+
+    def get_tuning_vars(self):
+        """go-carbon/carbon tuning of every graphite host
+
+        Tuning is derived from the expected ingestion rate of the host (see
+        CapacityPlanner) and from the host hardware:
+
+        - carbon cache must hold ``cache_headroom_seconds`` of incoming
+          datapoints (but at least 2 points per series) without exceeding
+          ``cache_memory_ratio`` of the host memory
+        - every flush StatsD sends all series at once, receiver buffers
+          must absorb such burst
+        - persister workers scale with CPUs
+        - whisper updates are throttled only when disk IOPS are known
+          (``cloudmon_disk_iops`` host variable)
+
+        Tuning is best effort: load of plugins without config is not
+        accounted and hosts without facts keep the role defaults.
+
+        :returns: dict of host name to tuning dict
+        """
+        model = self.config.model
+        flush_interval = model.statsd.flush_interval
+        estimates = {
+            x.host: x
+            for x in CapacityPlanner(self.config, strict=False).estimate()
+            if x.role == "graphite"
+        }
+        res = dict()
+        try:
+            hosts_facts = self.config.get_hosts_facts("graphite")
+        except RuntimeError as ex:
+            self.log.warning("%s, Graphite tuning is not applied", ex)
+            return res
+        for host, facts in hosts_facts.items():
+            estimate = estimates.get(host)
+            series = estimate.series if estimate else 0
+            datapoints = estimate.datapoints if estimate else 0
+            vcpus = max(1, facts["processor_vcpus"])
+
+            cache_max_size = max(
+                int(datapoints * model.graphite.cache_headroom_seconds),
+                int(series * 2),
+                DEFAULT_CACHE_MAX_SIZE,
+            )
+            memory_limit = int(
+                facts["memtotal_mb"]
+                * 1024
+                * 1024
+                * model.graphite.cache_memory_ratio
+                / CACHE_POINT_BYTES
+            )
+            if memory_limit and cache_max_size > memory_limit:
+                self.log.warning(
+                    "Graphite host %s does not have enough memory to cache "
+                    "%d points, limiting cache to %d points",
+                    host,
+                    cache_max_size,
+                    memory_limit,
+                )
+                cache_max_size = memory_limit
+
+            updates_needed = math.ceil(series / flush_interval)
+            iops = (
+                self.config.hostvars().get(host, {}).get("cloudmon_disk_iops")
+            )
+            if iops:
+                max_updates = int(int(iops) * 0.8)
+                if max_updates < updates_needed:
+                    self.log.warning(
+                        "Graphite host %s disk is not able to persist %d "
+                        "updates per second",
+                        host,
+                        updates_needed,
+                    )
+                    max_updates = updates_needed
+                carbon_max_updates = max_updates
+            else:
+                max_updates = 0
+                carbon_max_updates = max(
+                    DEFAULT_CARBON_MAX_UPDATES_PER_SECOND, updates_needed * 2
+                )
+
+            available_disk = self._get_available_disk(facts["mounts"])
+            if (
+                estimate
+                and available_disk is not None
+                and estimate.disk_bytes > available_disk
+            ):
+                self.log.warning(
+                    "Graphite host %s does not have enough disk space "
+                    "(%.2f GB required)",
+                    host,
+                    estimate.disk_gb,
+                )
+
+            res[host] = dict(
+                max_cpu=vcpus,
+                workers=min(max(2, vcpus * 2), 32),
+                cache_max_size=cache_max_size,
+                max_updates_per_second=max_updates,
+                carbon_max_updates_per_second=carbon_max_updates,
+                receiver_buffer_size=min(int(series), cache_max_size),
+            )
+        return res
+
+    def maintain(self, dry_run=True, report_dir="_graphite_maintain"):
+        """Prune stale series and resize whisper files on graphite hosts
+
+        Files are processed on every host by a pool of workers inside of
+        the graphite container (see ``graphite.maintenance``).
+
+        :param bool dry_run: Only report what would be done
+        :param str report_dir: Local directory for the host summaries
+        :returns: list of MaintenanceResult
+        """
+        maintenance = self.config.model.graphite.maintenance
+        report_dir = Path(report_dir).resolve()
+        report_dir.mkdir(parents=True, exist_ok=True)
+        for summary_file in report_dir.glob("*.json"):
+            summary_file.unlink()
+        extravars = copy.deepcopy(self.config.default_extravars)
+        extravars.update(
+            dict(
+                graphite_group_name="graphite",
+                graphite_maintain_stale_days=maintenance.stale_days,
+                graphite_maintain_stale_action=maintenance.stale_action,
+                graphite_maintain_archive_dir=maintenance.archive_dir,
+                graphite_maintain_workers=maintenance.workers,
+                graphite_maintain_io_limit=maintenance.io_limit,
+                graphite_maintain_resize=maintenance.resize,
+                graphite_maintain_dry_run=dry_run,
+                graphite_maintain_report_dir=report_dir.as_posix(),
+            )
+        )
+        r = ansible_runner.run(
+            private_data_dir=self.config.private_data_dir,
+            artifact_dir=".cloudmon_artifact",
+            project_dir=self.config.project_dir.as_posix(),
+            playbook="maintain_graphite.yaml",
+            inventory=self.config.inventory_path,
+            extravars=extravars,
+            verbosity=1,
+        )
+        if r.rc != 0:
+            raise RuntimeError("Error maintaining Graphite")
+        res = []
+        for summary_file in sorted(report_dir.glob("*.json")):
+            with open(summary_file, "r") as f:
+                res.append(MaintenanceResult(summary_file.stem, json.load(f)))
+        return res
+
+
+class VictoriaMetricsManager(TsdbBackend):
+    """VictoriaMetrics single node backend
+
+    Replaces whisper storage with a columnar one. StatsD pushes series with
+    the Graphite plaintext protocol and dashboards keep querying the Graphite
+    render API served by VictoriaMetrics.
+
+    There is neither replication nor query federation, therefore all
+    monitoring zones must push into the single host of the ``graphite``
+    group.
+    """
+
+    def check_topology(self):
+        """Ensure backend is deployed on a single node"""
+        hosts = self.config.inventory.get(self.group_name, {}).get(
+            "hosts", []
+        )
+        if len(hosts) != 1:
+            raise RuntimeError(
+                "VictoriaMetrics backend requires exactly one host in the "
+                "%s group, found %d" % (self.group_name, len(hosts))
+            )
+        for zone_name, zone in self.config.model.monitoring_zones.items():
+            if zone.graphite_group_name != self.group_name:
+                raise RuntimeError(
+                    "VictoriaMetrics backend does not support per zone "
+                    "graphite groups (zone %s uses %s)"
+                    % (zone_name, zone.graphite_group_name)
+                )
+
+    def provision(self, options):
+        self.log.info("Provisioning VictoriaMetrics")
+        self.check_topology()
+        settings = self.config.model.tsdb.victoriametrics
+        extravars = copy.deepcopy(self.config.default_extravars)
+        extravars.update(
+            dict(
+                victoriametrics_group_name=self.group_name,
+                victoriametrics_image=settings.image,
+                victoriametrics_port=settings.port,
+                victoriametrics_graphite_port=settings.graphite_port,
+                victoriametrics_retention_period=self.get_retention_period(),
+            )
+        )
+        r = ansible_runner.run(
+            private_data_dir=self.config.private_data_dir,
+            artifact_dir=".cloudmon_artifact",
+            project_dir=self.config.project_dir.as_posix(),
+            playbook="install_victoriametrics.yaml",
+            inventory=self.config.inventory_path,
+            extravars=extravars,
+            verbosity=1,
+        )
+        if r.rc != 0:
+            raise RuntimeError("Error configuring VictoriaMetrics")
+
+    def get_retention_period(self):
+        """Retention of the series
+
+        VictoriaMetrics keeps raw datapoints, by default they are kept as
+        long as the longest archive of the StatsD series in Graphite.
+        """
+        settings = self.config.model.tsdb.victoriametrics
+        if settings.retention_period:
+            return settings.retention_period
+        seconds = max(
+            precision * points
+            for precision, points in parse_retentions(
+                self.config.model.graphite.retentions_stats
+            )
+        )
+        return f"{math.ceil(seconds / 86400)}d"
+
+    def get_ingest_endpoint(self, zone):
+        self.check_topology()
+        return TsdbEndpoint(
+            self.config.get_graphite_zone_address(zone),
+            self.config.model.tsdb.victoriametrics.graphite_port,
+            "text",
+        )
+
+    def get_query_url(self, port=None):
+        self.check_topology()
+        port = port or self.config.model.tsdb.victoriametrics.port
+        return f"http://{self.get_query_address()}:{port}"
+
+
+BACKENDS = dict(
+    graphite=GraphiteManager, victoriametrics=VictoriaMetricsManager
+)
+
+
+def get_backend(cloudmon_config):
+    """Configured TSDB backend
+
+    :returns: TsdbBackend
+    """
+    return BACKENDS[cloudmon_config.model.tsdb.backend](cloudmon_config)
@@ -0,0 +1,258 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import logging
+import mmap
+import os
+from pathlib import Path
+import struct
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from cloudmon.service.capacity import parse_duration
+
+
+# aggregationType, maxRetention, xFilesFactor, archiveCount
+WHISPER_METADATA = struct.Struct("!2LfL")
+# offset, secondsPerPoint, points
+WHISPER_ARCHIVE_INFO = struct.Struct("!3L")
+AGGREGATION_METHODS = {
+    1: "average",
+    2: "sum",
+    3: "last",
+    4: "max",
+    5: "min",
+    6: "avg_zero",
+    7: "absmax",
+    8: "absmin",
+}
+
+
+def _require_numpy():
+    if numpy is None:
+        raise RuntimeError(
+            "numpy is required to read whisper files "
+            "(pip install stackmon[analytics])"
+        )
+
+
+def point_dtype():
+    """Big-endian (timestamp, value) record of the whisper archive"""
+    _require_numpy()
+    return numpy.dtype([("timestamp", ">u4"), ("value", ">f8")])
+
+
+def parse_time(value, now=None):
+    """Parse time argument into epoch seconds
+
+    Accepts epoch seconds, ISO 8601 date/time (UTC unless specified),
+    ``now`` and relative values like ``-7d``.
+    """
+    now = int(now if now is not None else time.time())
+    value = str(value).strip()
+    if value == "now":
+        return now
+    if value.startswith("-"):
+        return now - parse_duration(value[1:])
+    if value.isdigit():
+        return int(value)
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp())
+
+
+class WhisperFile:
+    """Memory mapped whisper file
+
+    Archives are exposed as NumPy record arrays backed directly by the
+    mapped file, no data is copied until points are selected.
+    """
+
+    def __init__(self, path):
+        _require_numpy()
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            aggregation,
+            self.max_retention,
+            self.x_files_factor,
+            archive_count,
+        ) = WHISPER_METADATA.unpack_from(self._mmap, 0)
+        self.aggregation_method = AGGREGATION_METHODS.get(aggregation)
+        self.archives = []
+        for index in range(archive_count):
+            (
+                offset,
+                seconds_per_point,
+                points,
+            ) = WHISPER_ARCHIVE_INFO.unpack_from(
+                self._mmap,
+                WHISPER_METADATA.size + index * WHISPER_ARCHIVE_INFO.size,
+            )
+            self.archives.append(
+                dict(
+                    offset=offset,
+                    seconds_per_point=seconds_per_point,
+                    points=points,
+                    retention=seconds_per_point * points,
+                )
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._mmap.close()
+
+    def archive(self, index):
+        """Zero-copy record array of the archive points"""
+        archive = self.archives[index]
+        return numpy.frombuffer(
+            self._mmap,
+            dtype=point_dtype(),
+            count=archive["points"],
+            offset=archive["offset"],
+        )
+
+    def fetch(self, from_time, until_time, now=None):
+        """Points of the time range
+
+        The finest archive covering ``from_time`` is used, same as by
+        graphite. Slots not written within the range are skipped.
+
+        :returns: tuple of (timestamps, values) native-endian arrays
+            sorted by timestamp
+        """
+        now = int(now if now is not None else time.time())
+        from_time = max(from_time, now - self.max_retention)
+        until_time = min(until_time, now)
+        index = len(self.archives) - 1
+        for pos, archive in enumerate(self.archives):
+            if archive["retention"] >= now - from_time:
+                index = pos
+                break
+        points = self.archive(index)
+        step = self.archives[index]["seconds_per_point"]
+        timestamps = points["timestamp"]
+        mask = (
+            (timestamps >= from_time - from_time % step)
+            & (timestamps < until_time)
+            & (timestamps % step == 0)
+        )
+        selected = points[mask]
+        order = numpy.argsort(selected["timestamp"], kind="stable")
+        return (
+            selected["timestamp"][order].astype(numpy.int64),
+            selected["value"][order].astype(numpy.float64),
+        )
+
+
+class WhisperReader:
+    """Read series of a whisper directory in parallel"""
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, data_dir, workers=None):
+        self.data_dir = Path(data_dir)
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 2)
+
+    def find(self, pattern):
+        """Find series matching the metric glob (``stats.*.epmon.**``)
+
+        :returns: list of (metric name, whisper file path)
+        """
+        nodes = pattern.split(".")
+        if nodes[-1] == "**":
+            # "**" must be an entire path component, series are files
+            # anywhere below
+            nodes[-1] = "**/*"
+        path_pattern = "/".join(nodes) + ".wsp"
+        res = []
+        for path in sorted(self.data_dir.glob(path_pattern)):
+            relpath = path.relative_to(self.data_dir).with_suffix("")
+            res.append((".".join(relpath.parts), path))
+        return res
+
+    def _read(self, metric, path, from_time, until_time, now):
+        with WhisperFile(path) as wsp:
+            timestamps, values = wsp.fetch(from_time, until_time, now)
+        return (metric, timestamps, values)
+
+    def read(self, pattern, from_time, until_time, now=None):
+        """Read points of every series matching the pattern
+
+        :returns: list of (metric, timestamps, values)
+        """
+        _require_numpy()
+        series = self.find(pattern)
+        self.log.debug("Reading %d series", len(series))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(
+                    self._read, metric, path, from_time, until_time, now
+                )
+                for metric, path in series
+            ]
+            return [x.result() for x in futures]
+
+
+def write_csv(series, stream):
+    """Write series as ``metric,timestamp,value`` rows"""
+    stream.write("metric,timestamp,value\n")
+    for metric, timestamps, values in series:
+        for timestamp, value in zip(timestamps.tolist(), values.tolist()):
+            stream.write(f"{metric},{timestamp},{value!r}\n")
+
+
+def write_parquet(series, path):
+    """Write series as parquet table (metric, timestamp, value)"""
+    if pyarrow is None:
+        raise RuntimeError(
+            "pyarrow is required to write parquet files "
+            "(pip install stackmon[analytics])"
+        )
+    metrics = [x[0] for x in series]
+    counts = [len(x[1]) for x in series]
+    table = pyarrow.table(
+        dict(
+            metric=pyarrow.DictionaryArray.from_arrays(
+                numpy.repeat(
+                    numpy.arange(len(metrics), dtype=numpy.int32), counts
+                ),
+                metrics,
+            ),
+            timestamp=pyarrow.array(
+                numpy.concatenate([x[1] for x in series] or [[]]).astype(
+                    "datetime64[s]"
+                )
+            ),
+            value=numpy.concatenate([x[2] for x in series] or [[]]),
+        )
+    )
+    pyarrow.parquet.write_table(table, path)
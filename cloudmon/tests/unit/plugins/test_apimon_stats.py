@@ -0,0 +1,72 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_apimon_stats
+----------------------------------
+
+Tests for `cloudmon.plugins.apimon_stats` module.
+"""
+from unittest import mock
+
+from cloudmon.tests.unit import base
+
+from cloudmon.plugin import apimon_stats
+
+
+class TestApimonStats(base.TestCase):
+    def test_compute_task_stats(self):
+        res = apimon_stats.compute_task_stats(
+            [
+                ("e1", "t1", 5, 10, 20),
+                ("e1", "t2", 5, 20, 40),
+                ("e2", "t1", 5, 40, 80),
+                ("e2", "t3", 1, None, None),
+            ]
+        )
+        self.assertEqual(["e1", "e2"], sorted(res))
+        self.assertEqual(0.5, res["e1"]["t1"].weight)
+        self.assertEqual(1.0, res["e1"]["t2"].weight)
+        self.assertEqual(2.0, res["e2"]["t1"].weight)
+        # task without durations still has a (minimal) weight
+        self.assertEqual(0.01, res["e2"]["t3"].weight)
+        self.assertDictEqual(
+            {"weight": 2.0, "p50": 40.0, "p95": 80.0},
+            res["e2"]["t1"].as_hint(),
+        )
+        self.assertDictEqual({}, apimon_stats.compute_task_stats([]))
+
+    def test_fetch_task_durations(self):
+        conn = mock.MagicMock()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [("e1", "t1", 1, 2, 3)]
+        with mock.patch.object(
+            apimon_stats, "psycopg2", autospec=True
+        ) as pg_mock:
+            pg_mock.connect.return_value = conn
+            res = apimon_stats.fetch_task_durations("postgresql://x", 3)
+        pg_mock.connect.assert_called_once_with(
+            "postgresql://x", connect_timeout=10
+        )
+        cursor.execute.assert_called_once_with(
+            apimon_stats.TASK_DURATIONS_QUERY, (3,)
+        )
+        conn.close.assert_called_once()
+        self.assertEqual([("e1", "t1", 1, 2, 3)], res)
+
+    def test_fetch_task_durations_no_driver(self):
+        with mock.patch.object(apimon_stats, "psycopg2", None):
+            self.assertRaises(
+                RuntimeError,
+                apimon_stats.fetch_task_durations,
+                "postgresql://x",
+            )
@@ -134,6 +134,15 @@ class TestEpmon(base.TestCase):
               h4:
     """
 
+    def setUp(self):
+        super().setUp()
+        # Do not write the rollout journal into the working directory
+        patcher = mock.patch(
+            "cloudmon.service.rollout.RolloutJournal.record", autospec=True
+        )
+        self.record_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_process_config(self):
         config = self.get_config(self.cfg1)
         manager = None
@@ -230,32 +239,104 @@ class TestEpmon(base.TestCase):
                 "epmon_image": "epmon_image",
                 "epmon_config_dir": "/etc/cloudmon",
                 "epmon_secure_config_file_name": "epmon-secure.yaml",
-                "epmon_config": {
-                    "epmon": {
-                        "clouds": [
-                            {
-                                "e2": {
-                                    "service_override": {
-                                        "foo": {"urls": ["/", "/bar"]}
+                "epmon_host_configs": {
+                    "h1": {
+                        "epmon": {
+                            "clouds": [
+                                {
+                                    "e2": {
+                                        "service_override": {
+                                            "foo": {"urls": ["/", "/bar"]}
+                                        }
                                     }
                                 }
-                            }
-                        ],
-                        "socket": "/tmp/epmon.socket",
-                        "zone": "zone2",
-                    },
-                    "log": {"config": "/etc/apimon/logging.conf"},
-                    "metrics": {"statsd": {"host": 4, "port": 8125}},
-                    "secure": "/etc/apimon/epmon-secure.yaml",
+                            ],
+                            "socket": "/tmp/epmon.socket",
+                            "zone": "zone2",
+                        },
+                        "log": {"config": "/etc/apimon/logging.conf"},
+                        "metrics": {"statsd": {"host": 4, "port": 8125}},
+                        "secure": "/etc/apimon/epmon-secure.yaml",
+                    }
                 },
-                "epmon_secure_config": {
-                    "clouds": [
-                        {
-                            "name": "e1",
-                            "data": {"profile": "b1", "auth": {"x": "y1"}},
-                        }
-                    ]
+                "epmon_host_secure_configs": {
+                    "h1": {
+                        "clouds": [
+                            {
+                                "name": "e1",
+                                "data": {
+                                    "profile": "b1",
+                                    "auth": {"x": "y1"},
+                                },
+                            }
+                        ]
+                    }
                 },
             },
             verbosity=3,
         )
+        self.record_mock.assert_has_calls(
+            [
+                mock.call(mock.ANY, "epmon", x, "epmon_image", digest=None)
+                for x in ("zone1", "zone2")
+            ]
+        )
+
+    def test_get_epmon_hosts(self):
+        config = self.get_config(self.cfg1, self.inventory)
+        with mock.patch(
+            "builtins.open", mock.mock_open(read_data=self.epmon_cfg)
+        ):
+            manager = epmon.EpmonManager(config)
+        # Hosts of the child groups are members as well
+        config.inventory["g1"]["children"] = ["g2", "g3"]
+        config.inventory["disabled"] = dict(children=["g3"])
+        self.assertEqual(["h1", "h2"], manager.get_epmon_hosts("g1"))
+
+    def test_partition_watch_clouds(self):
+        config = self.get_config(self.cfg1, self.inventory)
+        with mock.patch(
+            "builtins.open", mock.mock_open(read_data=self.epmon_cfg)
+        ):
+            manager = epmon.EpmonManager(config)
+        epmon_config = epmon.EpmonConfig()
+        epmon_config.watch_clouds = dict(
+            e1=dict(services={}, cloud="c1"),
+            e2=dict(
+                services={f"s{x}": {"urls": ["/"]} for x in range(20)},
+                cloud="c2",
+            ),
+        )
+        hosts = ["h1", "h2", "h3"]
+
+        res = manager.partition_watch_clouds(epmon_config, hosts)
+        # every service is probed exactly once
+        services = [
+            srv
+            for host in hosts
+            for srv in res[host].get("e2", {}).get("services", {})
+        ]
+        self.assertEqual(20, len(services))
+        self.assertEqual(20, len(set(services)))
+        # load is spread
+        self.assertTrue(all(res[host] for host in hosts))
+        # env without explicit services goes to a single host
+        self.assertEqual(1, len([x for x in hosts if "e1" in res[x]]))
+
+        # removing host only moves its own share
+        res2 = manager.partition_watch_clouds(epmon_config, ["h1", "h2"])
+        for host in ["h1", "h2"]:
+            for srv in res[host].get("e2", {}).get("services", {}):
+                self.assertIn(srv, res2[host]["e2"]["services"])
+
+        # replication
+        epmon_config.replication_factor = 2
+        res3 = manager.partition_watch_clouds(epmon_config, hosts)
+        services = [
+            srv
+            for host in hosts
+            for srv in res3[host].get("e2", {}).get("services", {})
+        ]
+        self.assertEqual(40, len(services))
+        self.assertEqual(20, len(set(services)))
+        self.assertEqual(2, len([x for x in hosts if "e1" in res3[x]]))
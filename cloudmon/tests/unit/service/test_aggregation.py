@@ -0,0 +1,173 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+test_aggregation
+----------------------------------
+
+"""
+
+from cloudmon.tests.unit import base
+
+from cloudmon.service import aggregation
+
+QUERY = "stats.counters.openstack.api.$environment.*.compute.*.*.*.count"
+
+
+class TestAggregation(base.TestCase):
+    cfg = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      monitoring_zones: []
+      plugins: []
+      matrix: []
+      graphite:
+        aggregation:
+          enabled: true
+      metrics_processor:
+        - name: m1
+          kube_context: m1_context
+          kube_namespace: m1_ns
+          datasource_url: fake_url
+          environments:
+            - name: e1
+              attributes: {}
+            - name: e2
+              attributes: {}
+          domain_name: fqdn
+          kustomization: {}
+        - name: m2
+          kube_context: m2_context
+          kube_namespace: m2_ns
+          datasource_url: fake_url
+          environments:
+            - name: e1
+              attributes: {}
+          domain_name: fqdn
+          kustomization: {}
+    """
+
+    def test_aggregate_target(self):
+        target, rules = aggregation.aggregate_target(
+            f"alias(sumSeries({QUERY}), 'requests')", "aggregated", 10, "z1"
+        )
+        # Query combines aggregates of all zones
+        self.assertEqual(
+            "alias(sumSeries(aggregated.sum.*.stats.counters.openstack.api."
+            "$environment.all.compute.all.all.all.count), 'requests')",
+            target,
+        )
+        self.assertEqual(1, len(rules))
+        self.assertEqual(
+            "aggregated.sum.z1.stats.counters.openstack.api.<environment>.all."
+            "compute.all.all.all.count (10) = sum stats.counters.openstack."
+            "api.<environment>.*.compute.*.*.*.count",
+            str(rules[0]),
+        )
+
+    def test_aggregate_target_average(self):
+        target, rules = aggregation.aggregate_target(
+            "averageSeries(stats.timers.${env}.*.[[service]].mean)", "a", 60
+        )
+        self.assertEqual(
+            "averageSeries(a.avg.*.stats.timers.${env}.all.[[service]].mean)",
+            target,
+        )
+        self.assertEqual(
+            "a.avg.all.stats.timers.<env>.all.<service>.mean (60) = "
+            "avg stats.timers.<env>.*.<service>.mean",
+            str(rules[0]),
+        )
+
+    def test_aggregate_target_unchanged(self):
+        for target in [
+            # nothing to aggregate
+            "sumSeries(stats.counters.a.b.count)",
+            # glob pattern within the node
+            "sumSeries(stats.counters.a.*.5*.count)",
+            "sumSeries(stats.counters.{a,b}.*.count)",
+            # nested function
+            "sumSeries(scale(stats.counters.*.count, 2))",
+            # not aggregatable by carbon-aggregator
+            "maxSeries(stats.counters.*.count)",
+            # variable used twice
+            "sum(stats.$a.*.$a.count)",
+        ]:
+            res, rules = aggregation.aggregate_target(target, "a", 10)
+            self.assertEqual(target, res)
+            self.assertEqual([], rules)
+
+    def test_aggregate_dashboards(self):
+        bodies = [
+            dict(
+                dashboard=dict(
+                    panels=[
+                        dict(targets=[dict(target=f"sumSeries({QUERY})")]),
+                        dict(
+                            type="row",
+                            panels=[
+                                dict(
+                                    targets=[
+                                        dict(
+                                            refId="A",
+                                            target=f"sum({QUERY})",
+                                        ),
+                                        dict(target="stats.gauges.x"),
+                                    ]
+                                )
+                            ],
+                        ),
+                    ]
+                )
+            )
+        ]
+        rules = aggregation.aggregate_dashboards(bodies, "aggregated", 10)
+        # Same query produces single rule
+        self.assertEqual(1, len(rules))
+        self.assertEqual(
+            f"sumSeries({QUERY})",
+            bodies[0]["dashboard"]["panels"][0]["targets"][0]["target"],
+        )
+
+        aggregation.aggregate_dashboards(
+            bodies, "aggregated", 10, rewrite=True
+        )
+        targets = bodies[0]["dashboard"]["panels"][1]["panels"][0]["targets"]
+        self.assertEqual(
+            "sumSeries(aggregated.sum.*.stats.counters.openstack.api."
+            "$environment.all.compute.all.all.all.count)",
+            targets[0]["target"],
+        )
+        self.assertEqual("stats.gauges.x", targets[1]["target"])
+
+    def test_get_rules(self):
+        config = self.get_config(self.cfg)
+        rules = aggregation.get_rules(config)
+        # Environments are deduplicated across instances
+        self.assertEqual(
+            2 * len(aggregation.ENVIRONMENT_RULES), len(rules)
+        )
+        self.assertEqual(
+            "aggregated.openstack.api.e1.<zone>.<service>.requests.count "
+            "(10) = sum stats.counters.openstack.api.e1.<zone>.<service>.*.*."
+            "*.count",
+            str(rules[0]),
+        )
+        self.assertEqual(
+            "aggregated.openstack.api.e2.<zone>.<service>.latency.mean (10) "
+            "= avg stats.timers.openstack.api.e2.<zone>.<service>.*.*.*.mean",
+            str(rules[-1]),
+        )
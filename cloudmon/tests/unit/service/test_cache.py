@@ -0,0 +1,110 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_cache
+----------------------------------
+
+"""
+
+from unittest import mock
+
+from cloudmon.tests.unit import base
+
+from cloudmon.service import cache
+from cloudmon.service import tsdb
+
+
+class TestCache(base.TestCase):
+    cfg1 = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      matrix: []
+      monitoring_zones: []
+      plugins: []
+      statsd:
+        flush_interval: 15
+      cache:
+        timeout_flush_intervals: 2
+    """
+    inventory = """
+      all:
+        hosts:
+          h1:
+            internal_address: 1.2.3.4
+          h2:
+            ansible_host: 2.3.4.5
+        children:
+          memcached:
+            hosts:
+              h1:
+              h2:
+    """
+
+    class Opts:
+        component: str
+
+        def __init__(self):
+            self.component = None
+
+    @mock.patch(
+        "ansible_runner.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_provision(self, runner_mock):
+        config = self.get_config(self.cfg1, self.inventory)
+        cache.MemcachedManager(config).provision(self.Opts())
+        runner_mock.assert_called_once_with(
+            private_data_dir=mock.ANY,
+            artifact_dir=".cloudmon_artifact",
+            project_dir=config.project_dir.as_posix(),
+            playbook="install_memcached.yaml",
+            inventory=mock.ANY,
+            extravars=dict(
+                distro_lookup_path=mock.ANY,
+                memcached_group_name="memcached",
+                memcached_port=11211,
+                memcached_memory_ratio=0.25,
+            ),
+            verbosity=1,
+        )
+
+    @mock.patch(
+        "ansible_runner.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_provision_no_hosts(self, runner_mock):
+        config = self.get_config(self.cfg1, "all: {}")
+        cache.MemcachedManager(config).provision(self.Opts())
+        runner_mock.assert_not_called()
+
+    def test_carbonapi_cache_vars(self):
+        config = self.get_config(self.cfg1, self.inventory)
+        self.assertDictEqual(
+            {
+                "carbonapi_cache_timeout": 30,
+                "carbonapi_cache_type": "memcache",
+                "carbonapi_memcache_hosts": [
+                    "1.2.3.4:11211",
+                    "2.3.4.5:11211",
+                ],
+            },
+            tsdb.GraphiteManager(config).get_carbonapi_cache_vars(),
+        )
+
+    def test_carbonapi_cache_vars_no_memcached(self):
+        config = self.get_config(self.cfg1, "all: {}")
+        self.assertDictEqual(
+            {"carbonapi_cache_timeout": 30},
+            tsdb.GraphiteManager(config).get_carbonapi_cache_vars(),
+        )
@@ -0,0 +1,196 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_capacity
+----------------------------------
+
+"""
+
+from pathlib import Path
+import tempfile
+
+from cloudmon.tests.unit import base
+
+from cloudmon.service import capacity
+
+
+class TestCapacity(base.TestCase):
+    epmon_cfg = """
+      elements:
+        ee1:
+          service_type: foo
+          urls:
+            - /
+            - /bar
+        ee2:
+          service_type: foo2
+          urls:
+            - /
+    """
+    cfg1 = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      monitoring_zones:
+        - name: zone1
+          graphite_group_name: graphite
+          statsd_group_name: statsd
+      plugins:
+        - name: epmon
+          type: epmon
+          image: epmon_image
+          config: %(epmon_config)s
+        - name: apimon
+          type: apimon
+          scheduler_image: s
+          executor_image: e
+          tests_projects: []
+      matrix:
+        - env: e1
+          monitoring_zone: zone1
+          db_entry: d1.d1u1
+          plugins:
+            - name: epmon
+              config_elements: ["ee1", "ee2", "missing"]
+            - name: apimon
+              tests_project: p1
+              tasks: ["t1.yaml", "t2.yaml"]
+      statsd:
+        flush_interval: 10
+      graphite:
+        retentions_stats: "10s:1d,1m:7d"
+        replication_factor: 1
+      capacity:
+        epmon_probe_interval: 30
+        epmon_series_per_url: 10
+        apimon_run_interval: 600
+        apimon_series_per_task: 30
+        apimon_rows_per_run: 10
+        apimon_row_bytes: 100
+        planning_horizon_days: 10
+        graphite_datapoints_budget: 5
+    """
+    inventory = """
+      all:
+        hosts:
+          g1:
+          g2:
+            cloudmon_datapoints_budget: 10
+          s1:
+          db1:
+            cloudmon_disk_budget_gb: 0.001
+        children:
+          graphite:
+            hosts:
+              g1:
+              g2:
+          statsd:
+            hosts:
+              s1:
+          postgres:
+            hosts:
+              db1:
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.epmon_config = Path(self.tmp_dir.name, "epmon.yaml")
+        self.epmon_config.write_text(self.epmon_cfg)
+
+    def test_parse_retentions(self):
+        self.assertEqual(
+            [(10, 8640), (60, 57600), (600, 157680)],
+            capacity.parse_retentions("10s:1d,1m:40d,10m:3y"),
+        )
+        self.assertEqual(
+            [(60, 129600), (300, 10)],
+            capacity.parse_retentions("60:90d, 5min:10"),
+        )
+        self.assertEqual(
+            16 + 12 * 2 + 12 * (8640 + 10080),
+            capacity.whisper_file_size("10s:1d,1m:7d"),
+        )
+        self.assertRaises(ValueError, capacity.parse_retentions, "10s")
+        self.assertRaises(ValueError, capacity.parse_retentions, "10x:1d")
+
+    def test_estimate(self):
+        config = self.get_config(
+            self.cfg1 % dict(epmon_config=self.epmon_config),
+            self.inventory,
+        )
+        planner = capacity.CapacityPlanner(config)
+        # 3 urls * 10 series + 2 tasks * 30 series
+        self.assertEqual(90, planner.zone_series["zone1"])
+        # 2 tasks * 10 rows * 144 runs/day
+        self.assertEqual(2880, planner.db_rows_per_day)
+
+        res = {(x.host, x.role): x for x in planner.estimate()}
+        self.assertEqual(
+            set(
+                [
+                    ("s1", "statsd"),
+                    ("g1", "graphite"),
+                    ("g2", "graphite"),
+                    ("db1", "postgres"),
+                ]
+            ),
+            set(res.keys()),
+        )
+        statsd = res[("s1", "statsd")]
+        self.assertEqual(90, statsd.series)
+        # 30 series every 30s + 60 series every 600s
+        self.assertAlmostEqual(1.1, statsd.datapoints)
+        self.assertFalse(statsd.over_budget)
+
+        whisper_size = capacity.whisper_file_size("10s:1d,1m:7d")
+        g1 = res[("g1", "graphite")]
+        # series are spread across 2 hosts
+        self.assertEqual(45, g1.series)
+        self.assertAlmostEqual(4.5, g1.datapoints)
+        self.assertEqual(45 * whisper_size, g1.disk_bytes)
+        self.assertFalse(g1.over_budget)
+        g2 = res[("g2", "graphite")]
+        self.assertEqual(10, g2.datapoints_budget)
+        self.assertFalse(g2.over_budget)
+
+        db = res[("db1", "postgres")]
+        self.assertEqual(2880, db.rows_per_day)
+        self.assertEqual(2880 * 10 * 100, db.disk_bytes)
+        self.assertTrue(db.over_budget)
+
+    def test_estimate_over_budget(self):
+        config = self.get_config(
+            self.cfg1 % dict(epmon_config=self.epmon_config)
+            + "\n        graphite_datapoints_budget: 4\n",
+            self.inventory,
+        )
+        res = {
+            (x.host, x.role): x
+            for x in capacity.CapacityPlanner(config).estimate()
+        }
+        self.assertTrue(res[("g1", "graphite")].over_budget)
+        self.assertFalse(res[("g2", "graphite")].over_budget)
+
+    def test_missing_plugin_config(self):
+        config = self.get_config(
+            self.cfg1 % dict(epmon_config="missing.yaml"),
+            self.inventory,
+        )
+        self.assertRaises(RuntimeError, capacity.CapacityPlanner, config)
+        # Best effort planning skips load of the plugin
+        planner = capacity.CapacityPlanner(config, strict=False)
+        self.assertEqual(60, planner.zone_series["zone1"])
@@ -0,0 +1,145 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+test_cardinality
+----------------------------------
+
+"""
+
+import gzip
+import json
+from pathlib import Path
+import shutil
+import tempfile
+from unittest import mock
+
+from cloudmon.tests.unit import base
+
+from cloudmon.service import cardinality
+
+
+class TestCardinality(base.TestCase):
+    cfg1 = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      matrix: []
+      monitoring_zones: []
+      plugins: []
+    """
+    metrics = [
+        "stats.timers.epmon.env1.zone1.url1.mean",
+        "stats.timers.epmon.env1.zone1.url2.mean",
+        "stats.timers.epmon.env1.zone2.url1.mean",
+        "stats.timers.apimon.env1.zone1.task.mean",
+        "carbon.agents.g1.cpuUsage",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.config = self.get_config(self.cfg1, "all: {}")
+        self.sot = cardinality.CardinalityManager(self.config)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_trie(self):
+        trie = cardinality.CardinalityTrie(max_depth=3, max_children=1)
+        trie.update((x, 10) for x in self.metrics)
+        self.assertEqual(
+            [
+                ("stats", 1, 4, 40),
+                ("stats.timers", 2, 4, 40),
+                ("stats.timers.epmon", 3, 3, 30),
+                ("stats.timers.<other>", 3, 1, 10),
+                ("<other>", 1, 1, 10),
+                ("<other>.agents", 2, 1, 10),
+                ("<other>.agents.g1", 3, 1, 10),
+            ],
+            list(trie.iter_prefixes()),
+        )
+        self.assertEqual(
+            [("stats", 1, 4, 40), ("<other>", 1, 1, 10)],
+            list(trie.iter_prefixes(depth=1)),
+        )
+
+    def test_whisper_dir(self):
+        for metric in self.metrics:
+            path = Path(self.tmp_dir, *metric.split(".")).with_suffix(".wsp")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"x" * 100)
+        Path(self.tmp_dir, "stats", "README").touch()
+        trie = self.sot.analyze([self.tmp_dir], max_depth=2)
+        self.assertEqual(
+            [
+                ("stats", 1, 4, 400),
+                ("stats.timers", 2, 4, 400),
+                ("carbon", 1, 1, 100),
+                ("carbon.agents", 2, 1, 100),
+            ],
+            list(trie.iter_prefixes()),
+        )
+
+    def test_listing(self):
+        listing = Path(self.tmp_dir, "g1.txt.gz")
+        with gzip.open(listing, "wt") as f:
+            for metric in self.metrics:
+                f.write("%s.wsp 1024\n" % metric.replace(".", "/"))
+        trie = self.sot.analyze([listing], max_depth=1)
+        self.assertEqual(
+            [("stats", 1, 4, 4096), ("carbon", 1, 1, 1024)],
+            list(trie.iter_prefixes()),
+        )
+
+    def test_json_list(self):
+        data = json.dumps(self.metrics + ["métrique"]).encode()
+        # Chunks split inside elements and multibyte characters
+        chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+        self.assertEqual(
+            self.metrics + ["métrique"],
+            list(cardinality.iter_json_list(chunks)),
+        )
+        self.assertRaises(
+            ValueError, list, cardinality.iter_json_list(["{}"])
+        )
+
+    @mock.patch("requests.get", autospec=True)
+    def test_index_url(self, get_mock):
+        get_mock.return_value = mock.MagicMock(
+            status_code=200,
+            iter_content=mock.MagicMock(
+                return_value=iter([json.dumps(self.metrics)])
+            ),
+        )
+        trie = self.sot.analyze(["http://carbonapi/metrics/index.json"], 1)
+        self.assertEqual(
+            [("stats", 1, 4, 0), ("carbon", 1, 1, 0)],
+            list(trie.iter_prefixes()),
+        )
+
+    @mock.patch("ansible_runner.run", autospec=True)
+    def test_fetch_listings(self, ansible_mock):
+        ansible_mock.return_value = mock.MagicMock(rc=0)
+        Path(self.tmp_dir, "g1.txt.gz").touch()
+        self.assertEqual(
+            [Path(self.tmp_dir, "g1.txt.gz").resolve()],
+            self.sot.fetch_listings(self.tmp_dir),
+        )
+        args = ansible_mock.call_args.kwargs
+        self.assertEqual("fetch_whisper_listing.yaml", args["playbook"])
+        self.assertEqual(
+            "/opt/graphite/storage/whisper",
+            args["extravars"]["whisper_data_path"],
+        )
@@ -0,0 +1,389 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+test_grafana
+----------------------------------
+
+"""
+
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from unittest import mock
+
+import yaml
+
+from cloudmon.tests.unit import base
+
+from cloudmon.service import grafana
+
+
+class TestGrafana(base.TestCase):
+    cfg1 = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      matrix: []
+      monitoring_zones: []
+      plugins: []
+      grafana:
+        datasources:
+          - name: cloudmon
+            type: graphite
+          - name: zone1
+            type: graphite
+            url: http://zone1:8080
+          - name: apimon_db
+            type: postgres
+            database: apimon
+            user: apimon
+            jsonData:
+              sslmode: disable
+            secureJsonData:
+              password: pw
+        config: {}
+        dashboards: []
+    """
+    inventory = """
+      all:
+        hosts:
+          g1:
+            internal_address: 1.1.1.1
+          db1:
+            internal_address: 2.2.2.2
+        children:
+          graphite:
+            hosts:
+              g1:
+          postgres:
+            hosts:
+              db1:
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.config = self.get_config(self.cfg1, self.inventory)
+        self.sot = grafana.GrafanaManager(self.config, "http://grafana", "t")
+
+    @staticmethod
+    def _response(status_code=200, data=None):
+        return mock.MagicMock(
+            status_code=status_code, json=mock.MagicMock(return_value=data)
+        )
+
+    def test_datasource_bodies(self):
+        bodies = self.sot.get_datasource_bodies()
+        self.assertEqual("http://1.1.1.1", bodies["cloudmon"]["url"])
+        self.assertEqual("http://zone1:8080", bodies["zone1"]["url"])
+        self.assertEqual("2.2.2.2:5432", bodies["apimon_db"]["url"])
+        self.assertIn(
+            "cloudmonSecureHash", bodies["apimon_db"]["jsonData"]
+        )
+        # model is not modified and result is stable
+        self.assertNotIn(
+            "cloudmonSecureHash",
+            self.config.model.grafana.datasources[2]["jsonData"],
+        )
+        self.assertDictEqual(bodies, self.sot.get_datasource_bodies())
+
+    def test_datasource_bodies_victoriametrics(self):
+        config = self.get_config(
+            self.cfg1
+            + """
+      tsdb:
+        backend: victoriametrics
+            """,
+            self.inventory,
+        )
+        bodies = grafana.GrafanaManager(
+            config, "http://grafana", "t"
+        ).get_datasource_bodies()
+        # graphite datasources query the render API of VictoriaMetrics
+        self.assertEqual("http://1.1.1.1:8428", bodies["cloudmon"]["url"])
+        self.assertEqual("http://zone1:8080", bodies["zone1"]["url"])
+
+    def test_aggregate_dashboards(self):
+        query = "sumSeries(stats.counters.$env.*.count)"
+        bodies = [
+            dict(dashboard=dict(panels=[dict(targets=[dict(target=query)])]))
+        ]
+        aggregation_cfg = (
+            "\n      graphite:\n"
+            "        aggregation:\n"
+            "          enabled: true\n"
+        )
+        config = self.get_config(self.cfg1 + aggregation_cfg, self.inventory)
+        grafana.GrafanaManager(config, "u", "t").aggregate_dashboards(bodies)
+        # Rewrite hides history and requires explicit switch
+        target = bodies[0]["dashboard"]["panels"][0]["targets"][0]
+        self.assertEqual(query, target["target"])
+
+        config = self.get_config(
+            self.cfg1
+            + aggregation_cfg
+            + "          rewrite_dashboards: true\n",
+            self.inventory,
+        )
+        grafana.GrafanaManager(config, "u", "t").aggregate_dashboards(bodies)
+        self.assertEqual(
+            "sumSeries(aggregated.sum.*.stats.counters.$env.all.count)",
+            target["target"],
+        )
+
+    def test_datasource_bodies_no_database(self):
+        # no hosts in the postgres group
+        inventory = self.inventory.replace("postgres:", "pg:")
+        config = self.get_config(self.cfg1, inventory)
+        self.assertRaisesRegex(
+            RuntimeError,
+            "postgres group",
+            grafana.GrafanaManager(config, "u", "t").get_datasource_bodies,
+        )
+
+    def test_datasource_changes(self):
+        desired = self.sot.get_datasource_bodies()
+        existing = [
+            dict(
+                desired["cloudmon"],
+                id=1,
+                uid="u1",
+                basicAuth=False,
+                jsonData={},
+            ),
+            dict(desired["zone1"], id=2, url="http://old:8080"),
+            dict(
+                {
+                    k: v
+                    for k, v in desired["apimon_db"].items()
+                    if k != "secureJsonData"
+                },
+                id=3,
+                secureJsonFields=dict(password=True),
+            ),
+        ]
+        self.assertEqual(
+            [("PUT", "/api/datasources/2", desired["zone1"])],
+            self.sot.get_datasource_changes(desired, existing),
+        )
+        # changed password is detected via hash
+        existing[2]["jsonData"] = dict(
+            sslmode="disable", cloudmonSecureHash="old"
+        )
+        self.assertEqual(
+            [
+                ("PUT", "/api/datasources/2", desired["zone1"]),
+                ("PUT", "/api/datasources/3", desired["apimon_db"]),
+            ],
+            self.sot.get_datasource_changes(desired, existing),
+        )
+
+    def test_provision_ds(self):
+        desired = self.sot.get_datasource_bodies()
+        existing = [dict(desired["cloudmon"], id=1)]
+        with mock.patch.object(
+            self.sot,
+            "request",
+            side_effect=[
+                self._response(data=existing),
+                self._response(),
+                self._response(),
+            ],
+        ) as request_mock:
+            self.sot.provision_ds(None)
+        request_mock.assert_any_call(method="GET", url="/api/datasources")
+        posted = sorted(
+            x.kwargs["json"]["name"]
+            for x in request_mock.call_args_list
+            if x.kwargs["method"] == "POST"
+        )
+        self.assertEqual(["apimon_db", "zone1"], posted)
+        self.assertEqual(3, request_mock.call_count)
+
+    def test_provision_ds_error(self):
+        with mock.patch.object(
+            self.sot,
+            "request",
+            side_effect=[
+                self._response(data=[]),
+                self._response(),
+                self._response(status_code=400),
+                self._response(),
+            ],
+        ):
+            self.assertRaises(RuntimeError, self.sot.provision_ds, None)
+
+    def _write_dashboard(self, dashboards_dir, uid="dash1", title="P1"):
+        dashboard_dir = Path(dashboards_dir, uid)
+        dashboard_dir.mkdir(parents=True, exist_ok=True)
+        with open(Path(dashboard_dir, "dashboard.yaml"), "w") as f:
+            yaml.safe_dump(dict(uid=uid, title=uid), f)
+        with open(Path(dashboard_dir, "panel1.yaml"), "w") as f:
+            yaml.safe_dump(dict(type="graph", title=title, order=1), f)
+
+    def _tmp_dir(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def test_get_panels_no_mutation(self):
+        panel_defs = [
+            dict(type="graph", order=2),
+            dict(type="stat", order=1, datasource="zone1"),
+        ]
+        panels = self.sot._get_panels(panel_defs)
+        self.assertEqual(
+            ["text", "stat", "graph"], [x["type"] for x in panels]
+        )
+        self.assertEqual(
+            ["zone1", "cloudmon"], [x["datasource"] for x in panels[1:]]
+        )
+        self.assertNotIn("order", panels[1])
+        self.assertEqual(
+            [
+                dict(type="graph", order=2),
+                dict(type="stat", order=1, datasource="zone1"),
+            ],
+            panel_defs,
+        )
+
+    def test_compile_dashboards(self):
+        tmp_dir = self._tmp_dir()
+        src = Path(tmp_dir, "src")
+        cache = Path(tmp_dir, "cache")
+        self._write_dashboard(src, "dash1")
+        self._write_dashboard(src, "dash2")
+
+        bodies = self.sot.compile_dashboards(src, cache)
+        self.assertEqual(
+            ["dash1", "dash2"], [x["dashboard"]["uid"] for x in bodies]
+        )
+        self.assertEqual(2, len(list(cache.glob("*.json"))))
+
+        # Only changed dashboard is compiled again
+        self._write_dashboard(src, "dash2", title="P2")
+        with mock.patch.object(
+            self.sot, "get_dashboard_body", wraps=self.sot.get_dashboard_body
+        ) as body_mock:
+            bodies = self.sot.compile_dashboards(src, cache)
+        body_mock.assert_called_once()
+        self.assertEqual("P2", bodies[1]["dashboard"]["panels"][1]["title"])
+        # Stale cache entry is dropped
+        self.assertEqual(2, len(list(cache.glob("*.json"))))
+
+        # Refresh depends on the graphite datasources
+        self.config.model.grafana.datasources.append(
+            dict(name="g2", type="graphite")
+        )
+        with mock.patch.object(
+            self.sot, "get_dashboard_body", wraps=self.sot.get_dashboard_body
+        ) as body_mock:
+            self.sot.compile_dashboards(src, cache)
+        self.assertEqual(2, body_mock.call_count)
+
+    def test_render_provisioning(self):
+        tmp_dir = self._tmp_dir()
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        self.addCleanup(os.chdir, cwd)
+        self._write_dashboard(Path(tmp_dir, "src"))
+        target = Path(tmp_dir, "target")
+        with mock.patch.object(
+            self.sot, "prepare_dashboards", return_value=Path(tmp_dir, "src")
+        ):
+            self.sot.render_provisioning(target)
+
+        with open(Path(target, "datasources", "cloudmon.yaml")) as f:
+            datasources = yaml.safe_load(f)
+        self.assertEqual(1, datasources["apiVersion"])
+        self.assertEqual(
+            ["cloudmon", "zone1", "apimon_db"],
+            [x["name"] for x in datasources["datasources"]],
+        )
+        self.assertTrue(
+            all(not x["editable"] for x in datasources["datasources"])
+        )
+
+        with open(Path(target, "dashboards", "cloudmon.yaml")) as f:
+            providers = yaml.safe_load(f)["providers"]
+        self.assertEqual(1, len(providers))
+        self.assertEqual("CloudMon", providers[0]["folderUid"])
+        self.assertEqual(
+            "/etc/grafana/provisioning/dashboards/CloudMon",
+            providers[0]["options"]["path"],
+        )
+
+        with open(Path(target, "dashboards", "CloudMon", "dash1.json")) as f:
+            dashboard = json.load(f)
+        self.assertEqual("dash1", dashboard["uid"])
+        self.assertEqual(
+            ["text", "graph"], [x["type"] for x in dashboard["panels"]]
+        )
+
+    @mock.patch("ansible_runner.run", autospec=True)
+    def test_provision_files(self, ansible_mock):
+        ansible_mock.return_value = mock.MagicMock(rc=0)
+        with mock.patch.object(self.sot, "render_provisioning") as render:
+            self.sot.provision_files(None)
+        render.assert_called_once()
+        args = ansible_mock.call_args.kwargs
+        self.assertEqual(
+            "configure_grafana_provisioning.yaml", args["playbook"]
+        )
+        self.assertEqual(
+            render.call_args.args[0].as_posix(),
+            args["extravars"]["grafana_provisioning_src"],
+        )
+
+    def test_dashboard_refresh(self):
+        panels = [dict(type="graph")]
+        self.assertEqual(
+            "30s", self.sot.get_dashboard_refresh(dict(uid="d1"), panels)
+        )
+        # Coarse data is not refreshed more often than it changes
+        self.config.model.statsd.flush_interval = 60
+        self.assertEqual(
+            "1m", self.sot.get_dashboard_refresh(dict(uid="d1"), panels)
+        )
+        self.assertEqual(
+            "30s",
+            self.sot.get_dashboard_refresh(
+                dict(uid="d1"), [dict(type="table", datasource="apimon_db")]
+            ),
+        )
+        # Modern datasource reference
+        self.assertEqual(
+            "1m",
+            self.sot.get_dashboard_refresh(
+                dict(uid="d1"),
+                [dict(datasource=dict(type="graphite", uid="x"))],
+            ),
+        )
+        # Overrides may only request longer intervals
+        self.assertEqual(
+            "5m",
+            self.sot.get_dashboard_refresh(
+                dict(uid="d1", refresh="5m"), panels
+            ),
+        )
+        self.config.model.grafana.refresh_overrides = dict(d1=10)
+        self.assertEqual(
+            "1m",
+            self.sot.get_dashboard_refresh(
+                dict(uid="d1", refresh="5m"), panels
+            ),
+        )
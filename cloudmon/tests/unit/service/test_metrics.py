@@ -126,3 +126,34 @@ class TestMetrics(base.TestCase):
                 },
                 mp_config,
             )
+
+    @mock.patch(
+        "subprocess.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_provision_tsdb_datasource(self, runner_mock):
+        config = self.get_config(
+            self.cfg1.replace("datasource_url: fake_url", "")
+            + """
+      tsdb:
+        backend: victoriametrics
+            """,
+            """
+      all:
+        hosts:
+          g1:
+            internal_address: 1.1.1.1
+        children:
+          graphite:
+            hosts:
+              g1:
+            """,
+        )
+        metrics.MetricsProcessorManager(config).provision(self.Opts())
+        overlay_dir = runner_mock.call_args.kwargs["cwd"]
+        with open(Path(overlay_dir, "config.yaml")) as fp:
+            mp_config = yaml.safe_load(fp)
+        # Query endpoint of the TSDB backend is used
+        self.assertDictEqual(
+            {"type": "graphite", "url": "http://1.1.1.1:8428"},
+            mp_config["datasource"],
+        )
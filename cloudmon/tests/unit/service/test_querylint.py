@@ -0,0 +1,156 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+test_querylint
+----------------------------------
+
+"""
+
+from pathlib import Path
+import shutil
+import tempfile
+
+from cloudmon.tests.unit import base
+
+from cloudmon.service import querylint
+
+
+class TestQueryLint(base.TestCase):
+    cfg1 = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      matrix: []
+      monitoring_zones: []
+      plugins: []
+      grafana:
+        datasources:
+          - name: cloudmon
+            type: graphite
+          - name: apimon_db
+            type: postgres
+        config: {}
+        dashboards: []
+        lint:
+          series_warning: 2
+          series_budget: 4
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.config = self.get_config(self.cfg1, "all: {}")
+        self.index = querylint.MetricIndex(
+            [
+                "stats.timers.env1.zone1.compute.mean",
+                "stats.timers.env1.zone2.compute.mean",
+                "stats.timers.env2.zone1.compute.mean",
+                "stats.timers.env2.zone1.network.mean",
+                "stats.timers.env2.zone1.network.upper",
+            ]
+        )
+
+    def test_extract_series(self):
+        self.assertEqual(
+            ["stats.timers.*.{a,b}.mean", "stats.counters.x"],
+            querylint.extract_series(
+                "aliasByNode(sumSeries(stats.timers.$env.{a,b}.mean), 2, 3)"
+                ", asPercent(stats.counters.x, #A, 'name.with.dot', true)"
+            ),
+        )
+        self.assertEqual(
+            ["stats.*.*"],
+            querylint.extract_series("stats.${env:raw}.[[zone]]"),
+        )
+
+    def test_index_count(self):
+        self.assertEqual(5, self.index.size)
+        self.assertEqual(
+            1, self.index.count("stats.timers.env1.zone1.compute.mean")
+        )
+        self.assertEqual(0, self.index.count("stats.timers.env1"))
+        # Branches are matched by find queries
+        self.assertEqual(2, self.index.count("stats.timers.*", nodes=True))
+        self.assertEqual(3, self.index.count("stats.timers.*.*", nodes=True))
+        self.assertEqual(4, self.index.count("stats.timers.*.*.*.mean"))
+        self.assertEqual(
+            2, self.index.count("stats.timers.env2.zone1.network.{mean,upper}")
+        )
+        self.assertEqual(2, self.index.count("stats.timers.env[1].zone?.*.*"))
+
+    def test_index_whisper_dir(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        Path(tmp_dir, "stats", "gauges").mkdir(parents=True)
+        Path(tmp_dir, "stats", "gauges", "a.wsp").touch()
+        Path(tmp_dir, "stats", "gauges", "b.wsp").touch()
+        Path(tmp_dir, "stats", "gauges", "c.txt").touch()
+        index = querylint.MetricIndex.load(tmp_dir)
+        self.assertEqual(2, index.count("stats.gauges.*"))
+
+    def test_lint(self):
+        body = dict(
+            dashboard=dict(
+                uid="d1",
+                templating=dict(
+                    list=[
+                        dict(
+                            name="env",
+                            type="query",
+                            datasource="cloudmon",
+                            query="stats.timers.*.*",
+                        )
+                    ]
+                ),
+                panels=[
+                    dict(
+                        title="p1",
+                        datasource="cloudmon",
+                        targets=[
+                            dict(target="stats.timers.$env.zone1.*.*"),
+                            dict(target="stats.timers.*.*.*.*"),
+                            dict(target="stats.timers.*.*.*.*", hide=True),
+                        ],
+                    ),
+                    dict(
+                        title="sql",
+                        datasource="apimon_db",
+                        targets=[dict(target="stats.*")],
+                    ),
+                    dict(
+                        title="p2",
+                        datasource=dict(type="graphite", uid="Xy1z"),
+                        targets=[dict(target="stats.timers.*.*.*.*")],
+                    ),
+                    dict(
+                        title="pg",
+                        datasource=dict(type="postgres", uid="Ab2c"),
+                        targets=[dict(target="stats.*")],
+                    ),
+                ],
+            )
+        )
+        linter = querylint.QueryLinter(self.config, self.index)
+        res = linter.lint([body])
+        self.assertEqual(
+            [
+                ("$env", 3, "warning"),
+                ("p1", 4, "warning"),
+                ("p1", 5, "error"),
+                ("p2", 5, "error"),
+            ],
+            [(x.panel, x.series, x.status) for x in res],
+        )
+        self.assertRaises(RuntimeError, linter.check, [body])
@@ -0,0 +1,181 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+test_rollout
+----------------------------------
+
+"""
+
+from pathlib import Path
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from cloudmon.tests.unit import base
+from cloudmon.tests.unit.service.test_whisperreader import write_whisper
+
+from cloudmon.service import rollout
+from cloudmon.service import sla
+
+ROLLOUT = 1700003600
+PREFIX = "stats.timers.openstack.api.e1.zone1.compute"
+COUNTERS = "stats.counters.openstack.api.e1.zone1.compute"
+
+
+class TestRolloutJournal(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_record(self):
+        journal = rollout.RolloutJournal(Path(self.tmp_dir, "j.jsonl"))
+        self.assertEqual([], journal.load())
+        item = journal.record("epmon", "zone1", "epmon:1", 100, "sha1")
+        self.assertIsNone(item.previous)
+        # Re-run without a new build is not a rollout
+        self.assertIsNone(
+            journal.record("epmon", "zone1", "epmon:1", 150, "sha1")
+        )
+        # Floating tag points to a new build
+        item = journal.record("epmon", "zone1", "epmon:1", 200, "sha2")
+        self.assertEqual("epmon:1", item.previous)
+        self.assertEqual("sha2", item.digest)
+        self.assertIsNone(journal.record("epmon", "zone1", None, 250))
+        journal.record("epmon", "zone2", "epmon:1", 300)
+        item = journal.record("epmon", "zone1", "epmon:2", 400)
+        self.assertEqual("epmon:1", item.previous)
+        self.assertEqual(
+            [(100, "zone1"), (200, "zone1"), (300, "zone2"), (400, "zone1")],
+            [(x.timestamp, x.zone) for x in journal.load()],
+        )
+        self.assertEqual(
+            [100, 200, 400],
+            [x.timestamp for x in journal.find("epmon", "zone1")],
+        )
+        self.assertEqual([], journal.find("apimon_executor"))
+
+    def test_get_image_digest(self):
+        events = [
+            dict(event="runner_on_start"),
+            dict(
+                event="runner_on_ok",
+                event_data=dict(
+                    task="Write env", res=dict(rc=0, stdout="x")
+                ),
+            ),
+        ] + [
+            dict(
+                event="runner_on_ok",
+                event_data=dict(
+                    task=rollout.DIGEST_TASK, res=dict(rc=0, stdout=x)
+                ),
+            )
+            for x in ("epmon@sha2\n", "epmon@sha1", "epmon@sha1")
+        ]
+        runner = mock.MagicMock(events=events)
+        self.assertEqual(
+            "epmon@sha1,epmon@sha2", rollout.get_image_digest(runner)
+        )
+        # Image is not present
+        events[-1]["event_data"]["res"] = dict(rc=1, stdout="")
+        runner = mock.MagicMock(events=events[:2] + events[-1:])
+        self.assertIsNone(rollout.get_image_digest(runner))
+
+
+@unittest.skipIf(rollout.numpy is None, "numpy is not installed")
+class TestShiftTest(base.TestCase):
+    def test_shift_test(self):
+        numpy = rollout.numpy
+        # group 0: shifted up, group 1: unchanged with ties
+        values = numpy.array(
+            [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+            + [5, 5, 6, 6, 7, 5, 6, 6, 7, 5],
+            dtype=float,
+        )
+        groups = numpy.repeat([0, 1], 10)
+        after = numpy.tile(numpy.repeat([False, True], 5), 2)
+        res = rollout.shift_test(values, groups, after, 2)
+        numpy.testing.assert_array_equal([3, 6], res["before"])
+        numpy.testing.assert_array_equal([8, 6], res["after"])
+        numpy.testing.assert_array_equal([5, 5], res["n_before"])
+        # U=25, n1=n2=5: exact p is 0.004, normal approximation 0.006
+        self.assertAlmostEqual(0.0061, res["p"][0], places=4)
+        self.assertGreater(res["p"][1], 0.3)
+
+
+@unittest.skipIf(rollout.numpy is None, "numpy is not installed")
+class TestRegressionDetector(base.TestCase):
+    cfg = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      matrix: []
+      monitoring_zones: []
+      plugins: []
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        numpy = rollout.numpy
+        rng = numpy.random.default_rng(1)
+        slots = list(range(ROLLOUT - 3600, ROLLOUT + 1800, 10))
+        before = len([x for x in slots if x < ROLLOUT])
+        servers = rng.normal(100, 5, len(slots))
+        # Latency of the flavors doubles after the rollout
+        flavors = rng.normal(100, 5, len(slots))
+        flavors[before:] *= 2
+        series = {
+            f"{PREFIX}.GET.servers.200.mean": servers,
+            f"{PREFIX}.GET.flavors.200.mean": flavors,
+            f"{COUNTERS}.GET.servers.200.count": numpy.full(len(slots), 10),
+            f"{COUNTERS}.GET.flavors.200.count": numpy.where(
+                numpy.arange(len(slots)) < before, 10, 8
+            ),
+            f"{COUNTERS}.GET.flavors.503.count": numpy.where(
+                numpy.arange(len(slots)) < before, 0, 2
+            ),
+        }
+        for name, values in series.items():
+            write_whisper(
+                Path(self.tmp_dir, name.replace(".", "/") + ".wsp"),
+                [(10, 1000)],
+                {0: list(zip(slots, values.tolist()))},
+            )
+
+    def test_compare(self):
+        config = self.get_config(self.cfg)
+        source = sla.WhisperSource(self.tmp_dir, now=ROLLOUT + 1800)
+        detector = rollout.RegressionDetector(config, source)
+        results = detector.compare(
+            rollout.Rollout(ROLLOUT + 5, "epmon", "zone1", "epmon:2"),
+            before=3600,
+            after=1800,
+            now=ROLLOUT + 1800,
+        )
+        res = {(x.name.split(".")[-1], x.metric): x for x in results}
+        self.assertEqual(4, len(res))
+        flavors = res[("flavors", "latency")]
+        self.assertTrue(flavors.regressed)
+        self.assertAlmostEqual(2, flavors.after / flavors.before, delta=0.1)
+        self.assertFalse(res[("servers", "latency")].regressed)
+        self.assertTrue(res[("flavors", "errors")].regressed)
+        self.assertEqual(0, res[("flavors", "errors")].before)
+        self.assertAlmostEqual(0.2, res[("flavors", "errors")].after)
+        self.assertFalse(res[("servers", "errors")].regressed)
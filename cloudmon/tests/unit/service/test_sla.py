@@ -0,0 +1,269 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+test_sla
+----------------------------------
+
+"""
+
+import fnmatch
+import http.server
+import json
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+import unittest
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from cloudmon.tests.unit import base
+from cloudmon.tests.unit.service.test_whisperreader import write_whisper
+
+from cloudmon.service import sla
+
+START = 1700000000
+PREFIX = "stats.counters.openstack.api.e1.zone1"
+TIMERS = "stats.timers.openstack.api.e1.zone1"
+
+
+def get_series():
+    """Series of two 60s windows with 10s step"""
+    slots = [START + 10 * x for x in range(12)]
+    series = {
+        f"{PREFIX}.compute.GET.servers.200.count": [(x, 6.0) for x in slots],
+        f"{PREFIX}.compute.POST.servers.201.count": [
+            (x, 0.0 if pos == 8 else 4.0) for pos, x in enumerate(slots)
+        ],
+        f"{PREFIX}.compute.POST.servers.500.count": [(slots[8], 4.0)],
+        f"{TIMERS}.compute.GET.servers.200.mean": [(x, 100.0) for x in slots],
+        f"{TIMERS}.compute.POST.servers.201.mean": [
+            (x, 300.0) for x in slots
+        ],
+        # Network only reports in the first window
+        f"{PREFIX}.network.GET.ports.200.count": [
+            (x, 2.0) for x in slots[:6]
+        ],
+        f"{TIMERS}.network.GET.ports.200.mean": [(x, 50.0) for x in slots[:6]],
+    }
+    return series
+
+
+def match(pattern, name):
+    pattern = pattern.split(".")
+    name = name.split(".")
+    return len(pattern) == len(name) and all(
+        fnmatch.fnmatchcase(x, y) for x, y in zip(name, pattern)
+    )
+
+
+class RenderStandIn(http.server.ThreadingHTTPServer):
+    """Local stand-in of the graphite render API"""
+
+    def __init__(self, series):
+        self.series = series
+        super().__init__(("127.0.0.1", 0), RenderHandler)
+        self.url = "http://127.0.0.1:%d" % self.server_address[1]
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class RenderHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        series = self.server.series
+        if url.path == "/render":
+            # Only sumSeries(query) and averageSeries(query) are used
+            function, _, target = params["target"].rstrip(")").partition("(")
+            from_time = int(params["from"])
+            until_time = int(params["until"])
+            slots = {}
+            for name, points in series.items():
+                if not match(target, name):
+                    continue
+                for ts, value in points:
+                    if from_time <= ts < until_time:
+                        slots.setdefault(ts, []).append(value)
+            datapoints = []
+            for ts in range(from_time - from_time % 10, until_time, 10):
+                values = slots.get(ts)
+                if not values:
+                    datapoints.append([None, ts])
+                elif function == "averageSeries":
+                    datapoints.append([sum(values) / len(values), ts])
+                else:
+                    datapoints.append([sum(values), ts])
+            body = [dict(target=params["target"], datapoints=datapoints)]
+        elif url.path == "/metrics/find":
+            depth = len(params["query"].split("."))
+            nodes = sorted(
+                {
+                    ".".join(x.split(".")[:depth])
+                    for x in series
+                    if match(params["query"], ".".join(x.split(".")[:depth]))
+                }
+            )
+            body = [dict(id=x, text=x.split(".")[-1]) for x in nodes]
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@unittest.skipIf(sla.numpy is None, "numpy is not installed")
+class TestSlaFunctions(base.TestCase):
+    def test_to_grid(self):
+        numpy = sla.numpy
+        series = [
+            (numpy.array([100, 110, 130]), numpy.array([1.0, 2.0, 3.0])),
+            (numpy.array([100, 120, 200]), numpy.array([3.0, numpy.nan, 1])),
+        ]
+        res = sla.to_grid(series, 100, 10, 4)
+        numpy.testing.assert_array_equal([4.0, 2.0, numpy.nan, 3.0], res)
+        res = sla.to_grid(series, 100, 10, 4, how="average")
+        numpy.testing.assert_array_equal([2.0, 2.0, numpy.nan, 3.0], res)
+        # Regular series is placed by slice
+        regular = (numpy.array([110, 120]), numpy.array([5.0, numpy.nan]))
+        res = sla.to_grid([regular], 100, 10, 4)
+        numpy.testing.assert_array_equal(
+            [numpy.nan, 5.0, numpy.nan, numpy.nan], res
+        )
+        res = sla.to_grid([regular, series[0]], 100, 10, 4)
+        numpy.testing.assert_array_equal([1.0, 7.0, numpy.nan, 3.0], res)
+
+    def test_windows(self):
+        res = sla.windows(sla.numpy.arange(5.0), 2)
+        self.assertEqual((3, 2), res.shape)
+        self.assertTrue(sla.numpy.isnan(res[2, 1]))
+
+    def test_availability(self):
+        numpy = sla.numpy
+        total = numpy.array([10, 10, 10, numpy.nan, 0, numpy.nan])
+        success = numpy.array([10, 8, 9, numpy.nan, 0, numpy.nan])
+        avail, rate, requests = sla.availability(success, total, 3, 0.9)
+        numpy.testing.assert_allclose([2 / 3, numpy.nan], avail)
+        numpy.testing.assert_allclose([27 / 30, numpy.nan], rate)
+        numpy.testing.assert_array_equal([30, 0], requests)
+
+    def test_latency_percentiles(self):
+        numpy = sla.numpy
+        values = numpy.random.default_rng(1).lognormal(5, 1, 10000)
+        values[:100] = numpy.nan
+        res = sla.latency_percentiles(values, 5000, [50, 95, 99])
+        for window in range(2):
+            chunk = values[window * 5000:(window + 1) * 5000]
+            expected = numpy.nanpercentile(chunk, [50, 95, 99])
+            numpy.testing.assert_allclose(expected, res[window], rtol=0.01)
+        res = sla.latency_percentiles(
+            numpy.full(4, numpy.nan), 2, [50]
+        )
+        self.assertTrue(numpy.isnan(res).all())
+
+
+@unittest.skipIf(sla.numpy is None, "numpy is not installed")
+class TestSlaCalculator(base.TestCase):
+    cfg = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      matrix: []
+      monitoring_zones: []
+      plugins: []
+      metrics_processor:
+        - name: m1
+          kube_context: m1_context
+          kube_namespace: m1_ns
+          datasource_url: fake_url
+          environments:
+            - name: e1
+              attributes:
+                foo: bar
+          domain_name: fqdn
+          kustomization: {}
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.config = self.get_config(self.cfg, "")
+        self.instance = sla.get_metrics_processor(self.config)
+
+    def _check(self, results):
+        res = {(x.service, x.start): x for x in results}
+        self.assertEqual(4, len(res))
+        first = res[("compute", START)]
+        self.assertEqual(1.0, first.availability)
+        self.assertEqual(1.0, first.success_rate)
+        self.assertEqual(60, first.requests)
+        for value in first.latency.values():
+            self.assertAlmostEqual(200, value, delta=2)
+        second = res[("compute", START + 60)]
+        self.assertAlmostEqual(5 / 6, second.availability)
+        self.assertAlmostEqual(56 / 60, second.success_rate)
+        self.assertEqual(60, second.requests)
+        network = res[("network", START)]
+        self.assertEqual(1.0, network.availability)
+        self.assertEqual(12, network.requests)
+        self.assertAlmostEqual(50, network.latency[95], delta=0.5)
+        network = res[("network", START + 60)]
+        self.assertIsNone(network.availability)
+        self.assertIsNone(network.success_rate)
+        self.assertIsNone(network.latency[50])
+        self.assertEqual(0, network.requests)
+
+    def test_render_source(self):
+        server = RenderStandIn(get_series())
+        self.addCleanup(server.stop)
+        source = sla.get_source(server.url)
+        self.assertIsInstance(source, sla.RenderSource)
+        calculator = sla.SlaCalculator(self.config, self.instance, source)
+        self.assertEqual(["compute", "network"], calculator.get_services("e1"))
+        self._check(calculator.compute(START + 5, START + 120, 60))
+
+    def test_whisper_source(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        for name, points in get_series().items():
+            write_whisper(
+                Path(tmp_dir, name.replace(".", "/") + ".wsp"),
+                [(10, 20)],
+                {0: points},
+            )
+        source = sla.get_source(tmp_dir)
+        source.now = START + 120
+        self.instance.sla.services = ["compute", "network"]
+        calculator = sla.SlaCalculator(self.config, self.instance, source)
+        self._check(calculator.compute(START, START + 120, 60))
+
+    def test_missing_source(self):
+        self.assertRaises(RuntimeError, sla.get_source, "/nonexisting")
+
+    def test_missing_instance(self):
+        self.assertRaises(
+            RuntimeError, sla.get_metrics_processor, self.config, "m2"
+        )
@@ -99,9 +99,19 @@ class TestSql(base.TestCase):
                     "default.yaml",
                 ],
                 postgresql_group_name="postgres",
+                backup=dict(
+                    compression=5,
+                    jobs=None,
+                    parallel_databases=2,
+                    target_dir="backups",
+                ),
                 postgres_postgres_password="abc",
                 ha_mode=False,
                 databases=[],
+                parameters={},
+                pgbouncer=None,
+                replica_port=5001,
+                postgres_host_parameters={},
             ),
             verbosity=1,
         )
@@ -125,3 +135,191 @@ class TestSql(base.TestCase):
             ),
             verbosity=1,
         )
+
+    @mock.patch(
+        "ansible_runner.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_manage_schema_no_partitioning(self, runner_mock):
+        self.sot.manage_schema(self.Opts())
+        runner_mock.assert_not_called()
+
+    @mock.patch(
+        "ansible_runner.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_manage_schema(self, runner_mock):
+        cfg = self.cfg1.replace(
+            "databases: []",
+            """databases:
+          - name: grafana
+            users: []
+          - name: apimon
+            partitioning:
+              interval: weekly
+              retention_days: 30
+            users: []""",
+        )
+        config = self.get_config(cfg)
+        sot = sqldb.PostgreSQLManager(config)
+        sot.manage_schema(self.Opts())
+        runner_mock.assert_called_once_with(
+            private_data_dir=mock.ANY,
+            artifact_dir=".cloudmon_artifact",
+            project_dir=config.project_dir.as_posix(),
+            playbook="manage_db_schema.yaml",
+            inventory=mock.ANY,
+            extravars=mock.ANY,
+            verbosity=1,
+        )
+        extravars = runner_mock.call_args.kwargs["extravars"]
+        self.assertEqual("postgres", extravars["postgresql_group_name"])
+        self.assertEqual(
+            [
+                dict(
+                    name="apimon",
+                    partitioning=dict(
+                        column="timestamp",
+                        interval="weekly",
+                        premake=7,
+                        retention_days=30,
+                        rollup_retention_days=400,
+                        tables=["result_summary", "result_task"],
+                    ),
+                    users=[],
+                )
+            ],
+            extravars["databases"],
+        )
+
+    @mock.patch(
+        "ansible_runner.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_manage_schema_invalid_interval(self, runner_mock):
+        cfg = self.cfg1.replace(
+            "databases: []",
+            """databases:
+          - name: apimon
+            partitioning:
+              interval: hourly
+            users: []""",
+        )
+        self.assertRaises(Exception, self.get_config, cfg)
+
+    def test_host_parameters(self):
+        facts = dict(
+            processor_vcpus=4,
+            memtotal_mb=16384,
+            mounts=[
+                dict(mount="/", size_total=20 * 1024 ** 3),
+                dict(mount="/var/lib", size_total=500 * 1024 ** 3),
+            ],
+        )
+        params = self.sot.get_host_parameters(facts)
+        self.assertEqual(200, params["max_connections"])
+        self.assertEqual("4GB", params["shared_buffers"])
+        self.assertEqual("12GB", params["effective_cache_size"])
+        self.assertEqual("1GB", params["maintenance_work_mem"])
+        # (16384 - 4096) / (200 * 3 * 2)
+        self.assertEqual("10485kB", params["work_mem"])
+        # 10% of the data volume, at most 16GB
+        self.assertEqual("16GB", params["max_wal_size"])
+        self.assertEqual(2, params["max_parallel_workers_per_gather"])
+        self.assertEqual(4, params["max_parallel_workers"])
+        self.assertEqual(3, params["autovacuum_max_workers"])
+        self.assertEqual(1.1, params["random_page_cost"])
+
+        params = self.sot.get_host_parameters(
+            dict(processor_vcpus=1, memtotal_mb=1024, mounts=[]),
+            dict(cloudmon_disk_type="hdd"),
+        )
+        self.assertEqual("256MB", params["shared_buffers"])
+        self.assertEqual("1310kB", params["work_mem"])
+        self.assertEqual("4GB", params["max_wal_size"])
+        self.assertEqual(4, params["random_page_cost"])
+
+    def test_host_parameters_overrides(self):
+        cfg = self.cfg1.replace(
+            "databases: []",
+            """databases: []
+        parameters:
+          max_connections: 50
+          shared_buffers: 1GB""",
+        )
+        sot = sqldb.PostgreSQLManager(self.get_config(cfg))
+        params = sot.get_host_parameters(
+            dict(processor_vcpus=2, memtotal_mb=8192, mounts=[])
+        )
+        self.assertEqual(50, params["max_connections"])
+        self.assertEqual("1GB", params["shared_buffers"])
+        # work_mem is derived from overridden max_connections
+        self.assertEqual("41943kB", params["work_mem"])
+
+    @mock.patch(
+        "ansible_runner.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_provision_ha_tuning(self, runner_mock):
+        inventory = """
+      all:
+        hosts:
+          db1:
+            ansible_processor_vcpus: 4
+            ansible_memtotal_mb: 8192
+          db2:
+            ansible_processor_vcpus: 16
+            ansible_memtotal_mb: 65536
+        children:
+          postgres:
+            hosts:
+              db1:
+              db2:
+        """
+        config = self.get_config(
+            self.cfg1.replace(
+                "databases: []", "databases: []\n        ha_mode: true"
+            ),
+            inventory,
+        )
+        sqldb.PostgreSQLManager(config).provision(self.Opts())
+        runner_mock.assert_called_once()
+        extravars = runner_mock.call_args.kwargs["extravars"]
+        self.assertEqual(
+            "install_postgresql_ha.yaml",
+            runner_mock.call_args.kwargs["playbook"],
+        )
+        self.assertEqual(
+            "2GB",
+            extravars["postgres_host_parameters"]["db1"]["shared_buffers"],
+        )
+        self.assertEqual(
+            "16GB",
+            extravars["postgres_host_parameters"]["db2"]["shared_buffers"],
+        )
+        self.assertDictEqual(
+            dict(max_connections=200, max_worker_processes=8),
+            extravars["postgres_cluster_parameters"],
+        )
+        self.assertEqual(5001, extravars["postgres_replica_port"])
+
+    def test_tuning_unreachable_host(self):
+        inventory = """
+      all:
+        hosts:
+          db1:
+            ansible_processor_vcpus: 4
+            ansible_memtotal_mb: 8192
+          db2:
+        children:
+          postgres:
+            hosts:
+              db1:
+              db2:
+        """
+        config = self.get_config(self.cfg1, inventory)
+        with mock.patch(
+            "ansible_runner.run",
+            autospec=True,
+            return_value=mock.MagicMock(rc=4, events=[]),
+        ):
+            res = sqldb.PostgreSQLManager(config).get_tuning_vars()
+        # Host without facts keeps the defaults
+        self.assertEqual(["db1"], list(res))
+        self.assertEqual("2GB", res["db1"]["shared_buffers"])
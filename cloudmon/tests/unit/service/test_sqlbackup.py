@@ -0,0 +1,172 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+test_sqlbackup
+----------------------------------
+
+"""
+
+from pathlib import Path
+import subprocess
+import tempfile
+from unittest import mock
+
+from cloudmon.tests.unit import base
+
+from cloudmon.service import sqlbackup
+
+
+class TestSqlBackup(base.TestCase):
+    cfg1 = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        backup:
+          parallel_databases: 2
+        databases:
+          - name: apimon
+            users:
+              - name: apimon
+                password: pw1
+          - name: grafana
+            users:
+              - name: grafana
+                password: pw2
+      environments: []
+      matrix: []
+      monitoring_zones: []
+      plugins: []
+    """
+    inventory = """
+      all:
+        hosts:
+          db1:
+            internal_address: 1.1.1.1
+            ansible_processor_vcpus: 4
+            ansible_memtotal_mb: 8192
+        children:
+          postgres:
+            hosts:
+              db1:
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.config = self.get_config(self.cfg1, self.inventory)
+        self.sot = sqlbackup.PostgreSQLBackupManager(self.config)
+        self.target = tempfile.mkdtemp()
+
+    @staticmethod
+    def _fake_dump(cmd, env, **kwargs):
+        path = [x for x in cmd if x.startswith("--file=")][0][7:]
+        Path(path).mkdir()
+        Path(path, "toc.dat").write_bytes(b"x" * 1024)
+        return subprocess.CompletedProcess(cmd, 0, b"", b"")
+
+    def test_get_jobs(self):
+        with mock.patch("os.cpu_count", return_value=16):
+            # bound by the database host CPUs
+            self.assertEqual(2, self.sot.get_jobs(2))
+            self.assertEqual(4, self.sot.get_jobs(1))
+        with mock.patch("os.cpu_count", return_value=1):
+            self.assertEqual(1, self.sot.get_jobs(2))
+
+    def test_connection_env(self):
+        env = self.sot.get_connection_env()
+        self.assertEqual("1.1.1.1", env["PGHOST"])
+        self.assertEqual("5432", env["PGPORT"])
+        self.assertEqual("postgres", env["PGUSER"])
+        self.assertEqual("abc", env["PGPASSWORD"])
+
+    @mock.patch("shutil.which", return_value="/usr/bin/pg_dump")
+    @mock.patch("os.cpu_count", return_value=8)
+    def test_backup(self, cpu_mock, which_mock):
+        with mock.patch(
+            "subprocess.run", side_effect=self._fake_dump
+        ) as run_mock:
+            results = self.sot.backup(self.target)
+        self.assertEqual(2, run_mock.call_count)
+        cmds = sorted(x.args[0] for x in run_mock.call_args_list)
+        backup_dir = results[0].path.parent
+        self.assertEqual(Path(self.target), backup_dir.parent)
+        self.assertEqual(
+            [
+                "pg_dump",
+                "--format=directory",
+                "--jobs=2",
+                "--compress=5",
+                f"--file={backup_dir}/apimon",
+                "--dbname=apimon",
+            ],
+            cmds[0],
+        )
+        self.assertEqual(
+            ["apimon", "grafana"], [x.database for x in results]
+        )
+        self.assertEqual([1024, 1024], [x.size for x in results])
+        self.assertEqual(["ok", "ok"], [x.status for x in results])
+
+    @mock.patch("shutil.which", return_value="/usr/bin/pg_dump")
+    def test_backup_failure(self, which_mock):
+        with mock.patch(
+            "subprocess.run",
+            return_value=subprocess.CompletedProcess([], 1, b"", b"boom"),
+        ):
+            results = self.sot.backup(self.target, ["grafana"])
+        self.assertEqual(1, len(results))
+        self.assertEqual("failed", results[0].status)
+        self.assertEqual("boom", results[0].error)
+
+    def test_backup_unknown_database(self):
+        with mock.patch("shutil.which", return_value="/usr/bin/pg_dump"):
+            self.assertRaises(
+                RuntimeError, self.sot.backup, self.target, ["foo"]
+            )
+
+    @mock.patch("shutil.which", return_value=None)
+    def test_backup_no_pg_dump(self, which_mock):
+        self.assertRaises(RuntimeError, self.sot.backup, self.target)
+
+    @mock.patch("shutil.which", return_value="/usr/bin/pg_restore")
+    @mock.patch("os.cpu_count", return_value=8)
+    def test_restore(self, cpu_mock, which_mock):
+        Path(self.target, "apimon").mkdir()
+        Path(self.target, "apimon", "toc.dat").write_bytes(b"x")
+        with mock.patch(
+            "subprocess.run",
+            return_value=subprocess.CompletedProcess([], 0, b"", b""),
+        ) as run_mock:
+            results = self.sot.restore(self.target)
+        # only databases with dumps are restored with all the jobs
+        run_mock.assert_called_once_with(
+            [
+                "pg_restore",
+                "--format=directory",
+                "--jobs=4",
+                "--clean",
+                "--if-exists",
+                "--no-owner",
+                "--role=apimon",
+                "--dbname=apimon",
+                f"{self.target}/apimon",
+            ],
+            env=mock.ANY,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.assertEqual(["apimon"], [x.database for x in results])
+
+    @mock.patch("shutil.which", return_value="/usr/bin/pg_restore")
+    def test_restore_no_dumps(self, which_mock):
+        self.assertRaises(RuntimeError, self.sot.restore, self.target)
@@ -0,0 +1,146 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+test_timing
+----------------------------------
+
+"""
+
+from unittest import mock
+
+from cloudmon.tests.unit import base
+
+from cloudmon.service import timing
+from cloudmon.types import TimingModel
+
+
+class TestTiming(base.TestCase):
+    cfg1 = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      matrix: []
+      monitoring_zones: []
+      plugins: []
+      statsd:
+        flush_interval: 10
+      graphite:
+        retentions_stats: "1s:1d,1m:40d,10m:3y"
+      grafana:
+        datasources: []
+        config: {}
+        dashboards: []
+        min_refresh_interval: 10
+      timing:
+        flush_interval: 30
+        retentions: "30s:1d,5m:40d,1h:3y"
+        min_refresh_interval: 60
+        epmon_probe_interval: 30
+        globalmon_probe_interval: 60
+    """
+
+    def test_validate(self):
+        self.assertEqual(([], []), timing.validate_timing(TimingModel()))
+        errors, warnings = timing.validate_timing(
+            TimingModel(
+                flush_interval=10,
+                retentions="5s:1d,7s:40d,14s:1h",
+                min_refresh_interval=5,
+                epmon_probe_interval=15,
+                globalmon_probe_interval=60,
+                x_files_factor=0.5,
+            )
+        )
+        self.assertEqual(4, len(errors))
+        self.assertIn("50% of the points stay empty", errors[0])
+        self.assertIn("not a multiple of the previous", errors[1])
+        self.assertIn("does not exceed", errors[2])
+        self.assertIn("Minimal refresh", errors[3])
+        self.assertEqual(3, len(warnings))
+        self.assertIn("epmon probe interval", warnings[0])
+        self.assertIn("epmon series", warnings[1])
+        self.assertIn("globalmon series", warnings[2])
+
+    def test_apply(self):
+        config = self.get_config(self.cfg1)
+        model = config.model
+        self.assertEqual(30, model.statsd.flush_interval)
+        self.assertEqual(
+            "30s:1d,5m:40d,1h:3y", model.graphite.retentions_stats
+        )
+        self.assertEqual(60, model.grafana.min_refresh_interval)
+        self.assertEqual(60, model.capacity.globalmon_probe_interval)
+        # Individual settings are preserved for comparison
+        self.assertEqual(10, config.timing_baseline.flush_interval)
+        self.assertEqual(
+            "1s:1d,1m:40d,10m:3y", config.timing_baseline.retentions
+        )
+
+    def test_apply_partial(self):
+        cfg = self.cfg1.replace(
+            """
+        retentions: "30s:1d,5m:40d,1h:3y"
+        min_refresh_interval: 60
+        epmon_probe_interval: 30
+        globalmon_probe_interval: 60
+""",
+            "\n",
+        )
+        cfg = cfg.replace('"1s:1d,1m:40d,10m:3y"', '"30s:1d,1m:40d,10m:3y"')
+        cfg = cfg.replace(
+            "min_refresh_interval: 10", "min_refresh_interval: 90"
+        )
+        config = self.get_config(cfg)
+        model = config.model
+        self.assertEqual(30, model.statsd.flush_interval)
+        # Settings not in the profile keep their individual values
+        self.assertEqual(
+            "30s:1d,1m:40d,10m:3y", model.graphite.retentions_stats
+        )
+        self.assertEqual(90, model.grafana.min_refresh_interval)
+        self.assertEqual("30s:1d,1m:40d,10m:3y", model.timing.retentions)
+
+    def test_invalid_profile(self):
+        self.assertRaises(
+            ValueError,
+            self.get_config,
+            self.cfg1.replace('"30s:1d,5m:40d,1h:3y"', '"10s:1d"'),
+        )
+
+    def test_estimate(self):
+        res = timing.estimate_timing(
+            TimingModel(flush_interval=10, min_refresh_interval=10),
+            100,
+            query_range=3600,
+        )
+        self.assertEqual(1.0, res["filled_ratio"])
+        self.assertEqual(360, res["points_per_query"])
+        self.assertEqual(360, res["refreshes"])
+        self.assertEqual(10, res["datapoints"])
+        # Range beyond the first archive is served by the next one
+        res = timing.estimate_timing(TimingModel(), 1, query_range=7 * 86400)
+        self.assertEqual(7 * 1440, res["points_per_query"])
+
+    def test_report(self):
+        config = self.get_config(self.cfg1)
+        manager = timing.TimingManager(config)
+        with mock.patch.object(manager, "get_series", return_value=1000):
+            res = {x[0]: x[1:] for x in manager.report()}
+        # 1s points are written only once per 10s flush
+        self.assertEqual((10.0, 100.0, None), res["Filled points (%)"])
+        self.assertEqual((100.0, 33.33, 66.7), res["Datapoints written/s"])
+        self.assertEqual((360, 60, 83.3), res["Refreshes per viewer hour"])
+        self.assertGreater(res["Disk (GB)"][2], 80)
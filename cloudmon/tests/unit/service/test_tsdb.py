@@ -0,0 +1,566 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_tsdb
+----------------------------------
+
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from cloudmon.tests.unit import base
+
+from cloudmon.service import aggregation
+from cloudmon.service import statsd
+from cloudmon.service import tsdb
+
+
+class TestGraphite(base.TestCase):
+    cfg1 = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      monitoring_zones:
+        - name: zone1
+      plugins:
+        - name: apimon
+          type: apimon
+          scheduler_image: s
+          executor_image: e
+          tests_projects: []
+      matrix:
+        - env: e1
+          monitoring_zone: zone1
+          db_entry: d1.d1u1
+          plugins:
+            - name: apimon
+              tests_project: p1
+      statsd:
+        flush_interval: 10
+      capacity:
+        apimon_tasks_per_project: 1000
+        apimon_series_per_task: 1000
+        apimon_run_interval: 10
+    """
+    inventory = """
+      all:
+        hosts:
+          g1:
+            ansible_processor_vcpus: 4
+            ansible_memtotal_mb: 16384
+            ansible_mounts:
+              - mount: /
+                size_available: 1000000000000
+              - mount: /opt
+                size_available: 1000
+          g2:
+            ansible_processor_vcpus: 32
+            ansible_memtotal_mb: 256
+            cloudmon_disk_iops: 1000
+        children:
+          graphite:
+            hosts:
+              g1:
+              g2:
+    """
+
+    class Opts:
+        component: str
+
+        def __init__(self):
+            self.component = None
+
+    def test_tuning_vars(self):
+        config = self.get_config(self.cfg1, self.inventory)
+        with mock.patch("ansible_runner.run", autospec=True) as runner_mock:
+            res = tsdb.GraphiteManager(config).get_tuning_vars()
+            # facts are taken from inventory
+            runner_mock.assert_not_called()
+
+        # 1M series spread across 2 hosts, flushed every 10s
+        self.assertDictEqual(
+            dict(
+                max_cpu=4,
+                workers=8,
+                cache_max_size=30000000,
+                max_updates_per_second=0,
+                carbon_max_updates_per_second=100000,
+                receiver_buffer_size=500000,
+            ),
+            res["g1"],
+        )
+        # 256MB * 0.25 / 64 bytes per point
+        self.assertDictEqual(
+            dict(
+                max_cpu=32,
+                workers=32,
+                cache_max_size=1048576,
+                max_updates_per_second=50000,
+                carbon_max_updates_per_second=50000,
+                receiver_buffer_size=500000,
+            ),
+            res["g2"],
+        )
+
+    def test_tuning_vars_best_effort(self):
+        config = self.get_config(
+            self.cfg1.replace(
+                "          tests_projects: []\n",
+                "          tests_projects: []\n"
+                "        - name: epmon\n"
+                "          type: epmon\n"
+                "          image: i\n"
+                "          config: missing.yaml\n",
+            ).replace(
+                "              tests_project: p1\n",
+                "              tests_project: p1\n"
+                "            - name: epmon\n",
+            ),
+            self.inventory,
+        )
+        # Missing plugin config does not block tuning
+        res = tsdb.GraphiteManager(config).get_tuning_vars()
+        self.assertEqual(8, res["g1"]["workers"])
+
+        config = self.get_config(
+            self.cfg1,
+            """
+      all:
+        hosts:
+          g1:
+        children:
+          graphite:
+            hosts:
+              g1:
+            """,
+        )
+        with mock.patch(
+            "ansible_runner.run",
+            autospec=True,
+            return_value=mock.MagicMock(rc=1, events=[]),
+        ):
+            # Role defaults are used when facts are not available
+            self.assertEqual(
+                {}, tsdb.GraphiteManager(config).get_tuning_vars()
+            )
+
+    def test_hosts_facts_gathered(self):
+        config = self.get_config(
+            self.cfg1,
+            """
+      all:
+        hosts:
+          g1:
+        children:
+          graphite:
+            hosts:
+              g1:
+            """,
+        )
+        events = [
+            dict(event="runner_on_start"),
+            dict(
+                event="runner_on_ok",
+                event_data=dict(
+                    host="g1",
+                    res=dict(
+                        ansible_facts=dict(
+                            ansible_processor_vcpus=2,
+                            ansible_memtotal_mb=4096,
+                        )
+                    ),
+                ),
+            ),
+        ]
+        with mock.patch(
+            "ansible_runner.run",
+            autospec=True,
+            return_value=mock.MagicMock(rc=0, events=events),
+        ) as runner_mock:
+            facts = config.get_hosts_facts("graphite")
+            # second call is served from cache
+            config.get_hosts_facts("graphite")
+            # hosts outside of the group are ignored
+            self.assertEqual(
+                [], list(config.get_hosts_facts("graphite", ["g2"]))
+            )
+            runner_mock.assert_called_once_with(
+                private_data_dir=mock.ANY,
+                artifact_dir=".cloudmon_artifact",
+                inventory=mock.ANY,
+                host_pattern="g1",
+                module="setup",
+                module_args="gather_subset=!all,!min,hardware",
+                quiet=True,
+            )
+        self.assertDictEqual(
+            dict(g1=dict(processor_vcpus=2, memtotal_mb=4096, mounts=[])),
+            facts,
+        )
+
+    @mock.patch(
+        "ansible_runner.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_provision(self, runner_mock):
+        config = self.get_config(self.cfg1, self.inventory)
+        tsdb.GraphiteManager(config).provision(self.Opts())
+        runner_mock.assert_called_once_with(
+            private_data_dir=mock.ANY,
+            artifact_dir=".cloudmon_artifact",
+            project_dir=config.project_dir.as_posix(),
+            playbook="install_graphite.yaml",
+            inventory=mock.ANY,
+            extravars=dict(
+                distro_lookup_path=mock.ANY,
+                graphite_group_name="graphite",
+                graphite_retentions_carbon="60:90d",
+                graphite_retentions_stats="10s:1d,1m:40d,10m:3y",
+                graphite_retentions_default="60s:1d,5m:30d,1h:1y",
+                graphite_x_files_factor=0.1,
+                statsd_flush_interval=10,
+                carbonapi_cache_timeout=10,
+                graphite_tuning=dict(g1=mock.ANY, g2=mock.ANY),
+            ),
+            verbosity=1,
+        )
+
+    @mock.patch(
+        "ansible_runner.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_provision_aggregation(self, runner_mock):
+        config = self.get_config(
+            self.cfg1
+            + """
+      graphite:
+        aggregation:
+          enabled: true
+            """,
+            self.inventory,
+        )
+        rule = aggregation.AggregationRule("a.<x>.b", "sum", "c.<x>.*", 10)
+        with mock.patch(
+            "cloudmon.service.aggregation.get_rules",
+            autospec=True,
+            return_value=[rule],
+        ) as rules_mock:
+            tsdb.GraphiteManager(config).provision(self.Opts())
+            # No Grafana configured, no dashboards to compile
+            rules_mock.assert_called_once_with(config, [], "zone1")
+        extravars = runner_mock.call_args.kwargs["extravars"]
+        self.assertTrue(extravars["graphite_aggregator"])
+        self.assertEqual(
+            "aggregated", extravars["graphite_aggregation_prefix"]
+        )
+        self.assertEqual(
+            {
+                "g1": ["a.<x>.b (10) = sum c.<x>.*"],
+                "g2": ["a.<x>.b (10) = sum c.<x>.*"],
+            },
+            extravars["graphite_aggregation_rules"],
+        )
+
+    @mock.patch("ansible_runner.run", autospec=True)
+    def test_maintain(self, runner_mock):
+        config = self.get_config(self.cfg1, self.inventory)
+        report_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, report_dir)
+        # Summary of the previous run is not reported
+        Path(report_dir, "old.json").write_text("{}")
+
+        def _run(**kwargs):
+            with open(Path(report_dir, "g1.json"), "w") as f:
+                json.dump(
+                    dict(
+                        files=10,
+                        stale=2,
+                        stale_bytes=2048,
+                        resized=1,
+                        resized_bytes=-1024,
+                        errors=["e"],
+                    ),
+                    f,
+                )
+            return mock.MagicMock(rc=0)
+
+        runner_mock.side_effect = _run
+        res = tsdb.GraphiteManager(config).maintain(True, report_dir)
+        extravars = runner_mock.call_args.kwargs["extravars"]
+        self.assertEqual(
+            "maintain_graphite.yaml", runner_mock.call_args.kwargs["playbook"]
+        )
+        self.assertTrue(extravars["graphite_maintain_dry_run"])
+        self.assertEqual(90, extravars["graphite_maintain_stale_days"])
+        self.assertEqual(["g1"], [x.host for x in res])
+        self.assertEqual(1024, res[0].reclaimed_bytes)
+        self.assertEqual(["e"], res[0].errors)
+
+
+class TestWhisperMaintain(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        spec = importlib.util.spec_from_file_location(
+            "whisper_maintain",
+            Path(
+                Path(tsdb.__file__).parent.parent,
+                "ansible/project/roles/graphite/files/whisper-maintain.py",
+            ),
+        )
+        self.script = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.script)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.data_dir = Path(self.tmp_dir, "whisper")
+        for name, age in (("stats/old/a", 100), ("stats/new/b", 0)):
+            path = Path(self.data_dir, name + ".wsp")
+            path.parent.mkdir(parents=True)
+            path.write_bytes(b"x" * 100)
+            mtime = time.time() - age * 86400
+            os.utime(path, (mtime, mtime))
+
+    def _args(self, **kwargs):
+        args = dict(
+            data_dir=self.data_dir.as_posix(),
+            stale_days=90,
+            stale_action="archive",
+            archive_dir=Path(self.tmp_dir, "archive").as_posix(),
+            resize=False,
+            resize_command="whisper-resize.py",
+            workers=2,
+            io_limit=0,
+            dry_run=True,
+        )
+        args.update(kwargs)
+        return argparse.Namespace(**args)
+
+    def test_schemas(self):
+        schemas_file = Path(self.tmp_dir, "storage-schemas.conf")
+        schemas_file.write_text(
+            '["stats"]\npattern = ^stats.*\nretentions = 10s:1d,1m:7d\n'
+            '["default"]\npattern = .*\nretentions = 60:100\n'
+        )
+        schemas = self.script.load_schemas(schemas_file)
+        self.assertEqual(
+            [(10, 8640), (60, 10080)],
+            self.script.match_schema(schemas, "stats.a.b"),
+        )
+        self.assertEqual(
+            [(60, 100)], self.script.match_schema(schemas, "carbon.a")
+        )
+
+    def test_dry_run(self):
+        summary = self.script.Maintainer(self._args(), []).run()
+        self.assertEqual(
+            (2, 1, 100),
+            (summary["files"], summary["stale"], summary["stale_bytes"]),
+        )
+        self.assertTrue(Path(self.data_dir, "stats/old/a.wsp").exists())
+
+    def test_archive(self):
+        summary = self.script.Maintainer(
+            self._args(dry_run=False, io_limit=10), []
+        ).run()
+        self.assertEqual(1, summary["stale"])
+        self.assertTrue(Path(self.tmp_dir, "archive/stats/old/a.wsp").exists())
+        # Emptied directories are dropped
+        self.assertFalse(Path(self.data_dir, "stats/old").exists())
+        self.assertTrue(Path(self.data_dir, "stats/new/b.wsp").exists())
+
+    def test_delete(self):
+        self.script.Maintainer(
+            self._args(dry_run=False, stale_action="delete"), []
+        ).run()
+        self.assertFalse(Path(self.data_dir, "stats/old").exists())
+        self.assertFalse(Path(self.tmp_dir, "archive").exists())
+
+
+class TestTsdbBackend(base.TestCase):
+    cfg = """
+      clouds_credentials: []
+      database:
+        postgres_postgres_password: abc
+        databases: []
+      environments: []
+      matrix: []
+      monitoring_zones:
+        - name: zone1
+        - name: zone2
+          graphite_group_name: graphite2
+      plugins: []
+    """
+    inventory = """
+      all:
+        hosts:
+          g1:
+            internal_address: 1.1.1.1
+          g2:
+            ansible_host: 2.2.2.2
+        children:
+          graphite:
+            hosts:
+              g1:
+          graphite2:
+            hosts:
+              g2:
+          statsd:
+            hosts:
+              g1:
+    """
+
+    zone2_group = "          graphite_group_name: graphite2\n"
+
+    class Opts:
+        component: str
+
+        def __init__(self):
+            self.component = None
+
+    def test_graphite(self):
+        config = self.get_config(self.cfg, self.inventory)
+        backend = tsdb.get_backend(config)
+        self.assertIsInstance(backend, tsdb.GraphiteManager)
+        endpoint = backend.get_ingest_endpoint("zone2")
+        self.assertEqual(
+            ("2.2.2.2", 2014, "pickle"),
+            (endpoint.host, endpoint.port, endpoint.protocol),
+        )
+        self.assertEqual("http://1.1.1.1", backend.get_query_url())
+        self.assertEqual("http://1.1.1.1:8080", backend.get_query_url(8080))
+
+        config = self.get_config(
+            self.cfg
+            + """
+      graphite:
+        aggregation:
+          enabled: true
+            """,
+            self.inventory,
+        )
+        # StatsD pushes into carbon-aggregator of own zone
+        endpoint = tsdb.get_backend(config).get_ingest_endpoint("zone2")
+        self.assertEqual(("2.2.2.2", 2024), (endpoint.host, endpoint.port))
+
+    def test_victoriametrics(self):
+        config = self.get_config(
+            self.cfg.replace(self.zone2_group, "")
+            + """
+      tsdb:
+        backend: victoriametrics
+            """,
+            self.inventory,
+        )
+        backend = tsdb.get_backend(config)
+        self.assertIsInstance(backend, tsdb.VictoriaMetricsManager)
+        endpoint = backend.get_ingest_endpoint("zone1")
+        self.assertEqual(
+            ("1.1.1.1", 2003, "text"),
+            (endpoint.host, endpoint.port, endpoint.protocol),
+        )
+        self.assertEqual("http://1.1.1.1:8428", backend.get_query_url())
+        # Longest archive of retentions_stats
+        self.assertEqual("1095d", backend.get_retention_period())
+
+    def test_victoriametrics_single_node(self):
+        backend_cfg = """
+      tsdb:
+        backend: victoriametrics
+        """
+        # zone2 pushes into own graphite group, not visible for queries
+        config = self.get_config(self.cfg + backend_cfg, self.inventory)
+        backend = tsdb.get_backend(config)
+        self.assertRaises(RuntimeError, backend.get_query_url)
+        self.assertRaises(RuntimeError, backend.get_ingest_endpoint, "zone1")
+
+        # several hosts are not replicated
+        config = self.get_config(
+            self.cfg.replace(self.zone2_group, "") + backend_cfg,
+            """
+      all:
+        hosts:
+          g1:
+          g2:
+        children:
+          graphite:
+            hosts:
+              g1:
+              g2:
+            """,
+        )
+        self.assertRaises(
+            RuntimeError, tsdb.get_backend(config).provision, self.Opts()
+        )
+
+    @mock.patch(
+        "ansible_runner.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_victoriametrics_provision(self, runner_mock):
+        config = self.get_config(
+            self.cfg.replace(self.zone2_group, "")
+            + """
+      tsdb:
+        backend: victoriametrics
+        victoriametrics:
+          retention_period: 1y
+            """,
+            self.inventory,
+        )
+        tsdb.get_backend(config).provision(self.Opts())
+        runner_mock.assert_called_once_with(
+            private_data_dir=mock.ANY,
+            artifact_dir=".cloudmon_artifact",
+            project_dir=config.project_dir.as_posix(),
+            playbook="install_victoriametrics.yaml",
+            inventory=mock.ANY,
+            extravars=dict(
+                distro_lookup_path=mock.ANY,
+                victoriametrics_group_name="graphite",
+                victoriametrics_image=mock.ANY,
+                victoriametrics_port=8428,
+                victoriametrics_graphite_port=2003,
+                victoriametrics_retention_period="1y",
+            ),
+            verbosity=1,
+        )
+
+        runner_mock.return_value.rc = 1
+        self.assertRaises(
+            RuntimeError, tsdb.get_backend(config).provision, self.Opts()
+        )
+
+    @mock.patch(
+        "ansible_runner.run", autospec=True, return_value=mock.MagicMock(rc=0)
+    )
+    def test_statsd_provision(self, runner_mock):
+        config = self.get_config(
+            self.cfg.replace(self.zone2_group, "")
+            + """
+      tsdb:
+        backend: victoriametrics
+            """,
+            self.inventory,
+        )
+        statsd.StatsdManager(config).provision(self.Opts())
+        extravars = runner_mock.call_args_list[1].kwargs["extravars"]
+        self.assertEqual("1.1.1.1", extravars["statsd_graphite_host"])
+        self.assertEqual("text", extravars["statsd_graphite_protocol"])
+        self.assertEqual(2003, extravars["statsd_graphite_port"])
+        self.assertNotIn("statsd_graphite_port_pickle", extravars)
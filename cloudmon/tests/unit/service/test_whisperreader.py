@@ -0,0 +1,129 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+test_whisperreader
+----------------------------------
+
+"""
+
+import io
+from pathlib import Path
+import shutil
+import struct
+import tempfile
+import unittest
+
+from cloudmon.tests.unit import base
+
+from cloudmon.service import whisperreader
+
+NOW = 1700000040
+
+
+def write_whisper(path, archives, points):
+    """Write whisper file
+
+    :param archives: list of (seconds per point, points)
+    :param points: dict of archive index to list of (timestamp, value)
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    header = struct.pack(
+        "!2LfL", 1, max(x * y for x, y in archives), 0.5, len(archives)
+    )
+    offset = len(header) + 12 * len(archives)
+    infos = b""
+    data = b""
+    for index, (step, count) in enumerate(archives):
+        infos += struct.pack("!3L", offset, step, count)
+        slots = [(0, 0.0)] * count
+        for timestamp, value in points.get(index, []):
+            slots[(timestamp // step) % count] = (timestamp, value)
+        data += b"".join(struct.pack("!Ld", *x) for x in slots)
+        offset += 12 * count
+    path.write_bytes(header + infos + data)
+
+
+@unittest.skipIf(whisperreader.numpy is None, "numpy is not installed")
+class TestWhisperReader(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        archives = [(10, 6), (60, 10)]
+        fine = [(NOW - 10 * x, float(x)) for x in range(1, 7)]
+        # Point of the previous archive cycle is not returned
+        fine[-1] = (NOW - 120, 99.0)
+        coarse = [(NOW - 60 * x, float(x * 10)) for x in range(1, 11)]
+        for name in ("stats/e1/zone1/a", "stats/e1/zone2/a", "stats/e2/b"):
+            write_whisper(
+                Path(self.tmp_dir, name + ".wsp"),
+                archives,
+                {0: fine, 1: coarse},
+            )
+
+    def test_fetch(self):
+        path = Path(self.tmp_dir, "stats/e1/zone1/a.wsp")
+        with whisperreader.WhisperFile(path) as wsp:
+            self.assertEqual(600, wsp.max_retention)
+            self.assertEqual("average", wsp.aggregation_method)
+            self.assertEqual(2, len(wsp.archives))
+            # Archive is a view of the mapped file
+            self.assertFalse(wsp.archive(0).flags.owndata)
+            timestamps, values = wsp.fetch(NOW - 60, NOW, NOW)
+            self.assertEqual(
+                [NOW - 50, NOW - 40, NOW - 30, NOW - 20, NOW - 10],
+                timestamps.tolist(),
+            )
+            self.assertEqual([5.0, 4.0, 3.0, 2.0, 1.0], values.tolist())
+            # Longer range is served by the coarse archive
+            timestamps, values = wsp.fetch(NOW - 300, NOW - 120, NOW)
+            self.assertEqual(
+                [NOW - 300 + 60 * x for x in range(3)], timestamps.tolist()
+            )
+            self.assertEqual([50.0, 40.0, 30.0], values.tolist())
+
+    def test_read(self):
+        reader = whisperreader.WhisperReader(self.tmp_dir, workers=2)
+        res = reader.read("stats.e1.*.a", NOW - 60, NOW, NOW)
+        self.assertEqual(
+            ["stats.e1.zone1.a", "stats.e1.zone2.a"], [x[0] for x in res]
+        )
+        self.assertEqual(
+            ["stats.e1.zone1.a", "stats.e1.zone2.a", "stats.e2.b"],
+            [x[0] for x in reader.find("stats.**.*")],
+        )
+        # Documented form with trailing "**"
+        self.assertEqual(
+            ["stats.e1.zone1.a"],
+            [x[0] for x in reader.find("stats.*.zone1.**")],
+        )
+        self.assertEqual(
+            ["stats.e1.zone1.a", "stats.e1.zone2.a", "stats.e2.b"],
+            [x[0] for x in reader.find("stats.**")],
+        )
+        out = io.StringIO()
+        whisperreader.write_csv(res[:1], out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual("metric,timestamp,value", lines[0])
+        self.assertEqual(f"stats.e1.zone1.a,{NOW - 50},5.0", lines[1])
+        self.assertEqual(6, len(lines))
+
+    def test_parse_time(self):
+        self.assertEqual(NOW, whisperreader.parse_time("now", NOW))
+        self.assertEqual(NOW - 86400, whisperreader.parse_time("-1d", NOW))
+        self.assertEqual(100, whisperreader.parse_time("100", NOW))
+        self.assertEqual(
+            1700000000,
+            whisperreader.parse_time("2023-11-14T22:13:20", NOW),
+        )
@@ -205,6 +205,17 @@ class TestConfig(base.TestCase):
         self.assertEqual("1.2.3.4", config.get_graphite_zone_address("zone1"))
         self.assertEqual("3.4.5.6", config.get_graphite_zone_address("zone2"))
 
+    def test_get_group_hosts(self):
+        config = self.get_config(self.cfg1)
+        config.inventory = dict(
+            g1=dict(hosts=["h1"], children=["g2", "g3"]),
+            g2=dict(hosts=["h2", "h1"], children=["g3"]),
+            g3=dict(hosts=["h3"]),
+        )
+        self.assertEqual(["h1", "h2", "h3"], config.get_group_hosts("g1"))
+        self.assertEqual(["h3"], config.get_group_hosts("g3"))
+        self.assertEqual([], config.get_group_hosts("missing"))
+
     def test_config_merge(self):
         config = CloudMonConfig()
         with tempfile.TemporaryDirectory() as dir1, tempfile.TemporaryDirectory() as dir2:  # noqa
@@ -270,16 +281,26 @@ class TestConfig(base.TestCase):
                 )
                 self.assertDictEqual(
                     {
+                        "backup": {
+                            "compression": 5,
+                            "jobs": None,
+                            "parallel_databases": 2,
+                            "target_dir": "backups",
+                        },
                         "postgres_postgres_password": "abc",
                         "ha_mode": False,
                         "databases": [
                             {
                                 "name": "d1",
+                                "partitioning": None,
                                 "users": [
                                     {"name": "d1u1", "password": "d1u1p"}
                                 ],
                             }
                         ],
+                        "parameters": {},
+                        "pgbouncer": None,
+                        "replica_port": 5001,
                     },
                     config.model.database.model_dump(),
                 )
@@ -10,6 +10,7 @@
 # implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from typing import Dict
 from typing import List
 from typing import Literal
 from typing import Union
@@ -20,6 +21,58 @@ from pydantic import Field
 from pydantic import RootModel
 
 
+class CacheModel(BaseModel):
+    """Query cache (memcached) configuration"""
+
+    group_name: str = "memcached"
+    """ansible group name of the memcached hosts"""
+    port: int = 11211
+    """memcached port"""
+    memory_ratio: float = 0.25
+    """Share of the host memory to be used for the cache"""
+    timeout_flush_intervals: int = 1
+    """Cache TTL expressed in amount of StatsD flush intervals"""
+
+
+class CapacityModel(BaseModel):
+    """Capacity planning assumptions
+
+    Values describe how much load a single monitored element produces and
+    what each host is allowed to consume. Budgets can be overridden per host
+    with ``cloudmon_disk_budget_gb`` and ``cloudmon_datapoints_budget``
+    inventory variables.
+    """
+
+    epmon_probe_interval: int = 30
+    """Interval (in seconds) epmon probes every URL"""
+    epmon_series_per_url: int = 17
+    """Amount of Graphite series produced by a single epmon URL"""
+    globalmon_probe_interval: int = 60
+    """Interval (in seconds) globalmon probes every URL"""
+    globalmon_series_per_url: int = 17
+    """Amount of Graphite series produced by a single globalmon URL"""
+    apimon_run_interval: int = 300
+    """Interval (in seconds) every ApiMon task (playbook) is executed"""
+    apimon_series_per_task: int = 60
+    """Amount of Graphite series produced by a single ApiMon task"""
+    apimon_tasks_per_project: int = 20
+    """Assumed amount of tasks when matrix entry does not limit them"""
+    apimon_rows_per_run: int = 25
+    """Amount of result rows ApiMon writes to the database per task run"""
+    apimon_row_bytes: int = 400
+    """Average size of the ApiMon result row (including indexes)"""
+    planning_horizon_days: int = 90
+    """Amount of days database growth is projected for"""
+    graphite_disk_budget_gb: float = 100
+    """Disk budget of a single graphite host"""
+    graphite_datapoints_budget: int = 50000
+    """Amount of datapoints per second a single graphite host can persist"""
+    postgres_disk_budget_gb: float = 100
+    """Disk budget of a single database host"""
+    statsd_datapoints_budget: int = 100000
+    """Amount of samples per second a single StatsD host can receive"""
+
+
 class CloudCredentialModel(BaseModel):
     """Cloud Credentials"""
     model_config = ConfigDict(extra='allow')
@@ -47,6 +100,46 @@ class CloudCredentialsModel(RootModel):
             yield (item.name, item)
 
 
+class DatabasePartitioningModel(BaseModel):
+    """Time partitioning of the database tables"""
+
+    column: str = "timestamp"
+    """Column used as partition key"""
+    interval: Literal["daily", "weekly"] = "daily"
+    """Partition size"""
+    premake: int = 7
+    """Amount of future partitions to precreate"""
+    retention_days: int = 90
+    """Partitions with older data are dropped"""
+    rollup_retention_days: int = 400
+    """Retention of the hourly rollup tables"""
+    tables: List[str] = ["result_summary", "result_task"]
+    """Tables to partition"""
+
+
+class DatabasePgBouncerModel(BaseModel):
+    """PgBouncer connection pooler in front of the databases"""
+
+    group_name: str = "postgres"
+    """ansible group name of the PgBouncer hosts"""
+    port: int = 6432
+    """PgBouncer port"""
+    pool_mode: Literal["session", "transaction"] = "transaction"
+    """PgBouncer pool mode"""
+    server_connections_ratio: float = 0.25
+    """Server connections opened per client connection of the executors
+    (executors are idle most of the time waiting for the tests)"""
+    min_pool_size: int = 5
+    """Minimal server connections pool size of every database"""
+    max_db_connections: int = 80
+    """Maximal server connections of every database (must stay below
+    max_connections of PostgreSQL)"""
+    reserve_pool_size: int = 5
+    """Additional server connections allowed when pool is exhausted"""
+    grafana_connections: int = 50
+    """Client connections reserved for Grafana"""
+
+
 class DatabaseUserModel(BaseModel):
     """Database user"""
 
@@ -56,11 +149,28 @@ class DatabaseUserModel(BaseModel):
     """DB user password"""
 
 
+class DatabaseBackupModel(BaseModel):
+    """Database backups (pg_dump directory format)"""
+
+    compression: int = 5
+    """Compression level of the dumps"""
+    jobs: int = None
+    """Jobs per database (derived from CPUs of the database and local
+    hosts by default)"""
+    parallel_databases: int = 2
+    """Amount of databases processed concurrently"""
+    target_dir: str = "backups"
+    """Local directory to store backups in"""
+
+
 class DatabaseInstanceModel(BaseModel):
     """Database instance"""
 
     name: str
     """DB name"""
+    partitioning: DatabasePartitioningModel = None
+    """Optional time partitioning with retention and rollups (ApiMon
+    results database)"""
     users: List[DatabaseUserModel]
     """DB users list"""
 
@@ -68,6 +178,8 @@ class DatabaseInstanceModel(BaseModel):
 class DatabaseModel(BaseModel):
     """Database configuration"""
 
+    backup: DatabaseBackupModel = DatabaseBackupModel()
+    """Backup settings"""
     postgres_postgres_password: str
     """Password of the postgres user (used to create Databases)"""
     ha_mode: bool = False
@@ -75,6 +187,15 @@ class DatabaseModel(BaseModel):
     to be managed externally)"""
     databases: List[DatabaseInstanceModel]
     """Databases list"""
+    parameters: Dict[str, Union[int, float, str]] = {}
+    """PostgreSQL parameters overriding values derived from the host
+    hardware"""
+    pgbouncer: DatabasePgBouncerModel = None
+    """Optional PgBouncer connection pooler used by ApiMon executors and
+    Grafana"""
+    replica_port: int = 5001
+    """HAProxy port balancing read only connections over replicas (HA
+    mode)"""
 
 
 class EnvZoneCloudModel(BaseModel):
@@ -162,6 +283,19 @@ class GrafanaDashboardRepoModel(GitRepoModel):
     """Path to the dashboards definitions inside the repository"""
 
 
+class GrafanaLintModel(BaseModel):
+    """Dashboard query cost linter configuration"""
+
+    index: str = None
+    """Metric names index: whisper storage directory, graphite
+    ``/metrics/index.json`` dump or its URL. Linter is skipped when not set"""
+    series_budget: int = 10000
+    """Amount of series a single query may match. Provisioning fails above
+    it"""
+    series_warning: int = 1000
+    """Amount of series a single query may match without a warning"""
+
+
 class GrafanaModel(BaseModel):
     """Grafana configuration"""
 
@@ -177,6 +311,75 @@ class GrafanaModel(BaseModel):
     """Configuration options to use for deploying on VMs"""
     dashboards: List[GrafanaDashboardRepoModel]
     """List of dashboards to be managed in the instance"""
+    lint: GrafanaLintModel = GrafanaLintModel()
+    """Query cost linter configuration"""
+    min_refresh_interval: int = 30
+    """Minimal dashboard refresh interval (seconds). Also enforced by Grafana
+    for the viewers"""
+    refresh_overrides: Dict[str, int] = {}
+    """Refresh interval (seconds) of dashboards by uid. Intervals below the
+    minimal one are raised"""
+    provisioning_mode: Literal["api", "file"] = "api"
+    """Install datasources and dashboards with API requests or by shipping
+    them into the Grafana provisioning directory"""
+
+
+class GraphiteMaintenanceModel(BaseModel):
+    """Whisper files maintenance configuration"""
+
+    stale_days: int = 90
+    """Series not updated for that amount of days are stale"""
+    stale_action: Literal["archive", "delete"] = "archive"
+    """What to do with stale series"""
+    archive_dir: str = "/opt/graphite/storage/archive"
+    """Directory (on graphite hosts) stale series are moved to"""
+    resize: bool = True
+    """Resize whisper files to the current storage schema"""
+    workers: int = 4
+    """Amount of files processed concurrently on every host"""
+    io_limit: float = 0
+    """Limit of the processed data (MB/s) on every host, 0 - no limit"""
+
+
+class GraphiteAggregationModel(BaseModel):
+    """Pre-aggregation of the series by carbon-aggregator"""
+
+    enabled: bool = False
+    """Run carbon-aggregator in front of the graphite storage (StatsD
+    pushes data into it)"""
+    prefix: str = "aggregated"
+    """Prefix of the pre-aggregated series"""
+    dashboards: bool = True
+    """Pre-aggregate sumSeries/averageSeries queries of the Grafana
+    dashboards"""
+    rewrite_dashboards: bool = False
+    """Replace dashboard queries with the pre-aggregated series. They only
+    exist since aggregation is enabled, older history disappears from the
+    dashboards"""
+
+
+class GraphiteModel(BaseModel):
+    """Graphite configuration"""
+
+    retentions_carbon: str = "60:90d"
+    """Retentions of the carbon internal metrics"""
+    retentions_stats: str = "10s:1d,1m:40d,10m:3y"
+    """Retentions of the metrics produced by StatsD"""
+    retentions_default: str = "60s:1d,5m:30d,1h:1y"
+    """Retentions of all other metrics"""
+    replication_factor: int = 1
+    """Amount of graphite hosts every metric is stored on"""
+    cache_headroom_seconds: int = 600
+    """Amount of seconds of the incoming datapoints the carbon cache must be
+    able to hold while disk is not keeping up"""
+    cache_memory_ratio: float = 0.25
+    """Maximal share of the host memory to be used by the carbon cache"""
+    x_files_factor: float = 0.1
+    """xFilesFactor of the averaged (not summed) StatsD series"""
+    maintenance: GraphiteMaintenanceModel = GraphiteMaintenanceModel()
+    """Whisper files maintenance configuration"""
+    aggregation: GraphiteAggregationModel = GraphiteAggregationModel()
+    """Pre-aggregation of the series at ingest time"""
 
 
 class Kustomization(RootModel):
@@ -194,6 +397,38 @@ class MetricProcessorEnvironmentModel(BaseModel):
     """Status Dashboard attributes linked to the environment"""
 
 
+class MetricsProcessorSlaModel(BaseModel):
+    """Availability calculation of the Metrics Processor environments
+
+    Queries are graphite globs with ``{environment}`` and ``{service}``
+    placeholders.
+    """
+
+    services: List[str] = []
+    """Service types to evaluate, discovered with ``service_query`` when
+    empty"""
+    service_query: str = "stats.counters.openstack.api.{environment}.*.*"
+    """Query of the service nodes of the environment"""
+    total_query: str = (
+        "stats.counters.openstack.api.{environment}.*.{service}.*.*.*.count"
+    )
+    """Query of the total amount of requests"""
+    success_query: str = (
+        "stats.counters.openstack.api.{environment}.*.{service}.*.*.[23]*"
+        ".count"
+    )
+    """Query of the amount of successful requests"""
+    latency_query: str = (
+        "stats.timers.openstack.api.{environment}.*.{service}.*.*.*.mean"
+    )
+    """Query of the request latency"""
+    success_ratio: float = 0.9
+    """Interval is available when at least that share of requests
+    succeeded"""
+    percentiles: List[float] = [50, 95, 99]
+    """Latency percentiles to report"""
+
+
 class MetricsProcessorModel(BaseModel):
     """Metrics Processor configuration"""
 
@@ -203,8 +438,9 @@ class MetricsProcessorModel(BaseModel):
     """Kubernetes context to use for deployment"""
     kube_namespace: str
     """Kubernetes namespace name for deploy"""
-    datasource_url: str
-    """URL to the datasource (the one where graphite is deployed)"""
+    datasource_url: str = None
+    """URL to the datasource (query endpoint of the ``tsdb`` backend when not
+    set)"""
     datasource_type: str = "graphite"
     """Datasource type"""
     domain_name: str
@@ -215,6 +451,38 @@ class MetricsProcessorModel(BaseModel):
     """Kustomize overlay options"""
     status_dashboard_instance_name: str = None
     """Reference name of the associated Status Dashboard instance name"""
+    sla: MetricsProcessorSlaModel = MetricsProcessorSlaModel()
+    """Availability calculation (``cloudmon metrics sla``)"""
+
+
+class RolloutModel(BaseModel):
+    """Rollout journal and regression detection
+
+    Queries are graphite globs with ``{environment}`` and ``{zone}``
+    placeholders. Series names end with ``<status>.<suffix>``, the rest
+    after the zone identifies the compared series.
+    """
+
+    journal: str = "_rollout_journal.jsonl"
+    """Journal file of the image rollouts performed by provisioning"""
+    latency_query: str = (
+        "stats.timers.openstack.api.{environment}.{zone}.*.*.*.*.mean"
+    )
+    """Query of the request latency series"""
+    count_query: str = (
+        "stats.counters.openstack.api.{environment}.{zone}.*.*.*.*.count"
+    )
+    """Query of the request count series"""
+    before: str = "1h"
+    """Window before the rollout"""
+    after: str = "30m"
+    """Window after the rollout"""
+    alpha: float = 0.01
+    """Significance level of the Mann-Whitney test"""
+    min_latency_shift: float = 0.1
+    """Minimal relative shift of the median latency to flag"""
+    min_error_shift: float = 0.01
+    """Minimal absolute increase of the error rate to flag"""
 
 
 class MonitoringZoneModel(BaseModel):
@@ -271,6 +539,9 @@ class PluginApimonRefModel(BaseModel):
     the plugin configuration)"""
     tasks: List[str] = list()
     """Optional list of tasks (playbooks) to schedule"""
+    executor_load_multiplier: float = None
+    """Executor load multiplier to use in the monitoring zone instead of
+    the one derived from the executor host hardware"""
 
 
 class PluginEpmonModel(BaseModel):
@@ -298,6 +569,8 @@ class PluginEpmonRefModel(BaseModel):
     """List of configuration entries of the epmon"""
     epmon_inventory_group_name: str = "epmons"
     """ansible group name to deploy epmon process"""
+    replication_factor: int = 1
+    """Amount of epmon hosts probing every service of the environment"""
 
 
 class PluginGlobalmonModel(BaseModel):
@@ -349,6 +622,69 @@ class PluginRefModel(RootModel):
                 PluginGlobalmonRefModel, PluginGeneralModel]
 
 
+class StatsdModel(BaseModel):
+    """StatsD configuration"""
+
+    flush_interval: int = 10
+    """Interval (in seconds) StatsD flushes metrics into Graphite"""
+
+
+class TimingModel(BaseModel):
+    """Timing profile of the metrics pipeline
+
+    When present it is the single source of the StatsD flush interval, the
+    StatsD series retentions and aggregation, the minimal Grafana refresh
+    and the probe intervals, overriding ``statsd.flush_interval``,
+    ``graphite.retentions_stats``, ``graphite.x_files_factor``,
+    ``grafana.min_refresh_interval`` and the ``capacity`` probe intervals.
+    """
+
+    flush_interval: int = 10
+    """Interval (in seconds) StatsD flushes metrics into Graphite"""
+    retentions: str = "10s:1d,1m:40d,10m:3y"
+    """Retentions of the metrics produced by StatsD"""
+    x_files_factor: float = 0.1
+    """xFilesFactor of the averaged StatsD series"""
+    min_refresh_interval: int = 30
+    """Minimal Grafana dashboard refresh interval (seconds)"""
+    epmon_probe_interval: int = 30
+    """Interval (in seconds) epmon probes every URL"""
+    globalmon_probe_interval: int = 60
+    """Interval (in seconds) globalmon probes every URL"""
+
+
+class VictoriaMetricsModel(BaseModel):
+    """VictoriaMetrics (single node) configuration
+
+    Series are ingested with the Graphite plaintext protocol and queried
+    through the Graphite render API, so dashboards need no changes.
+    """
+
+    image: str = "docker.io/victoriametrics/victoria-metrics:v1.93.5"
+    """VictoriaMetrics image to use"""
+    port: int = 8428
+    """HTTP port (query API)"""
+    graphite_port: int = 2003
+    """Graphite plaintext ingestion port"""
+    retention_period: str = None
+    """Retention of the series (longest archive of the StatsD series
+    retentions when not set)"""
+
+
+class TsdbModel(BaseModel):
+    """Time series database backend
+
+    StatsD, Grafana datasources and Metrics Processor pick their ingest and
+    query endpoints from the selected backend. Backend is deployed on the
+    ``graphite`` hosts.
+    """
+
+    backend: Literal["graphite", "victoriametrics"] = "graphite"
+    """Backend name"""
+    victoriametrics: VictoriaMetricsModel = VictoriaMetricsModel()
+    """VictoriaMetrics backend configuration"""
+
+
 class StatusDashboardModel(BaseModel):
     """Status Dashboard configuration"""
 
@@ -388,6 +724,12 @@ class MatrixModel(BaseModel):
 class ConfigModel(BaseModel):
     """CloudMon Config"""
 
+    cache: CacheModel = CacheModel()
+    """Query cache configuration"""
+
+    capacity: CapacityModel = CapacityModel()
+    """Capacity planning assumptions"""
+
     clouds_credentials: CloudCredentialsModel
     """Cloud Credentials section"""
 
@@ -400,6 +742,9 @@ class ConfigModel(BaseModel):
     grafana: GrafanaModel = None
     """Grafana configuration"""
 
+    graphite: GraphiteModel = GraphiteModel()
+    """Graphite configuration"""
+
     matrix: List[MatrixModel]
     """Testing matrix (where to, from where and what)"""
 
@@ -411,9 +756,21 @@ class ConfigModel(BaseModel):
     plugins: List[PluginModel]
     """Registered plugins to enable for testing"""
 
+    statsd: StatsdModel = StatsdModel()
+    """StatsD configuration"""
+
+    rollouts: RolloutModel = RolloutModel()
+    """Rollout journal and regression detection"""
+
     status_dashboard: List[StatusDashboardModel] = []
     """Status dashboard configuration"""
 
+    timing: TimingModel = None
+    """Timing profile (see TimingModel)"""
+
+    tsdb: TsdbModel = TsdbModel()
+    """Time series database backend"""
+
     def get_env_by_name(self, name) -> EnvironmentModel:
         for item in self.environments.root:
             if item.name == name:
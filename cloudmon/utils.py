@@ -11,6 +11,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import importlib
 import logging
 from pathlib import Path
@@ -44,6 +45,23 @@ def checkout_git_repository(repo_dir, repo: GitRepoModel):
         git_repo.remotes.origin.pull()
 
 
+def rendezvous_hash(key: str, nodes: list, replicas: int = 1) -> list:
+    """Select nodes responsible for the key (highest random weight)
+
+    Every node gets a stable score for the key and the ``replicas`` nodes
+    with highest scores are returned. Adding or removing a node only moves
+    keys owned by that node.
+    """
+    scores = sorted(
+        nodes,
+        key=lambda node: hashlib.sha256(
+            f"{node}:{key}".encode("utf-8")
+        ).hexdigest(),
+        reverse=True,
+    )
+    return scores[:max(1, replicas)]
+
+
 def copy_kustomize_app_base(kustomize_base_dir: Path, kustomize_app_name: str):
     """Copy Kustomize app base to the destination directory"""
     kust_base_src = Path(